@@ -0,0 +1,99 @@
+"""
+PCM helpers for the normalized 16 kHz mono s16le WAV files used by the pipeline
+"""
+import struct
+import logging
+from pathlib import Path
+from typing import Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TARGET_SAMPLE_RATE = 16000
+
+
+def _find_data_chunk(wav_path: Path) -> Tuple[int, int, int, int, int, int]:
+    """解析 RIFF 头，返回 (data偏移, data字节数, 格式码, 声道数, 采样率, 位深)"""
+    file_size = wav_path.stat().st_size
+    with open(wav_path, "rb") as f:
+        riff, _, wave = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave != b"WAVE":
+            raise ValueError(f"Not a RIFF/WAVE file: {wav_path}")
+
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"No data chunk in WAV file: {wav_path}")
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                fmt = struct.unpack("<HHIIHH", f.read(16))
+                f.seek(chunk_size - 16 + (chunk_size & 1), 1)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise ValueError(f"WAV data chunk before fmt chunk: {wav_path}")
+                offset = f.tell()
+                # 流式写出的 WAV 可能把 data 长度写成 0 或 0xFFFFFFFF，以实际文件长度为准
+                size = min(chunk_size, file_size - offset) if chunk_size else file_size - offset
+                format_tag, channels, sample_rate, _, _, bits = fmt
+                return offset, size, format_tag, channels, sample_rate, bits
+            else:
+                f.seek(chunk_size + (chunk_size & 1), 1)
+
+
+def is_normalized_wav(path: Union[str, Path]) -> bool:
+    """检查文件是否已经是 16 kHz 单声道 16-bit PCM WAV"""
+    path = Path(path)
+    if path.suffix.lower() != ".wav" or not path.exists():
+        return False
+    try:
+        _, _, format_tag, channels, sample_rate, bits = _find_data_chunk(path)
+    except (ValueError, struct.error, OSError):
+        return False
+    # 0xFFFE = WAVE_FORMAT_EXTENSIBLE
+    return format_tag in (1, 0xFFFE) and channels == 1 and sample_rate == TARGET_SAMPLE_RATE and bits == 16
+
+
+def read_pcm16_wav(path: Union[str, Path]) -> Tuple[np.ndarray, int]:
+    """以只读内存映射方式打开 16-bit 单声道 WAV，返回 (samples, sample_rate)"""
+    path = Path(path)
+    offset, size, format_tag, channels, sample_rate, bits = _find_data_chunk(path)
+    if format_tag not in (1, 0xFFFE) or channels != 1 or bits != 16:
+        raise ValueError(f"Expected mono 16-bit PCM WAV, got format={format_tag} channels={channels} bits={bits}")
+    n_samples = size // 2
+    if n_samples == 0:
+        return np.zeros(0, dtype=np.int16), sample_rate
+    samples = np.memmap(path, dtype="<i2", mode="r", offset=offset, shape=(n_samples,))
+    return samples, sample_rate
+
+
+def write_pcm16_wav(path: Union[str, Path], samples: np.ndarray, sample_rate: int = TARGET_SAMPLE_RATE):
+    """把 int16 样本写成单声道 WAV 文件"""
+    data = np.ascontiguousarray(samples, dtype="<i2")
+    data_size = data.nbytes
+    header = struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data_size, b"WAVE",
+        b"fmt ", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b"data", data_size,
+    )
+    with open(path, "wb") as f:
+        f.write(header)
+        f.write(data.tobytes())
+
+
+def wav_duration(path: Union[str, Path]) -> float:
+    """读取 WAV 头计算时长（秒）"""
+    offset, size, _, channels, sample_rate, bits = _find_data_chunk(Path(path))
+    return size / (channels * (bits // 8) * sample_rate)
+
+
+def frame_rms_db(samples: np.ndarray, frame_length: int) -> np.ndarray:
+    """按固定帧长计算每帧的 RMS 能量（dBFS），尾部不足一帧的样本被忽略"""
+    n_frames = len(samples) // frame_length
+    if n_frames == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = np.asarray(samples[: n_frames * frame_length]).reshape(n_frames, frame_length)
+    power = np.einsum("ij,ij->i", frames, frames, dtype=np.float64) / frame_length
+    return (10.0 * np.log10(power / (32768.0 ** 2) + 1e-12)).astype(np.float32)
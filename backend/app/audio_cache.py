@@ -0,0 +1,79 @@
+"""
+Decoded-audio cache: the normalized 16 kHz mono PCM of every upload, per content hash
+
+Entries are plain s16le WAV files (44-byte header + raw samples) rather than
+FLAC, so whisper.cpp, ffmpeg and the chunker / VAD / cascade readers (which
+memory-map WAVs via audio.read_pcm16_wav) use them directly without another
+decode. Re-running a file with another model or language skips ffmpeg.
+"""
+import os
+import json
+import hashlib
+import logging
+from pathlib import Path
+from typing import Optional
+
+from .config import settings
+from .audio import is_normalized_wav
+from .disk_cache import DiskLRUCache
+
+logger = logging.getLogger(__name__)
+
+
+def audio_cache_key(content_hash: str, audio_stream: Optional[int] = None) -> str:
+    """同一文件的不同音轨分别缓存"""
+    return hashlib.sha256(json.dumps([content_hash, audio_stream]).encode()).hexdigest()
+
+
+class AudioCache(DiskLRUCache):
+    """
+    Size-bounded LRU directory of normalized WAVs under AUDIO_CACHE_DIR/<key[:2]>/<key>.wav
+
+    Writers decode into reserve(key) and publish with commit(); readers only
+    ever see complete files. get() returns the cached path itself, so entries
+    used within AUDIO_CACHE_MIN_IDLE seconds are never evicted.
+    """
+
+    SUFFIX = ".wav"
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None):
+        super().__init__(
+            cache_dir or settings.AUDIO_CACHE_DIR,
+            settings.AUDIO_CACHE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes,
+            min_idle=settings.AUDIO_CACHE_MIN_IDLE,
+        )
+
+    def get(self, key: str) -> Optional[Path]:
+        path = self._path(key)
+        if not is_normalized_wav(path) or not self._touch(path):
+            return None
+        logger.info(f"♻️ Decoded audio cache hit {key[:12]}")
+        return path
+
+    def reserve(self, key: str) -> Path:
+        """解码写入的临时路径（与缓存条目同一文件系统，commit 时原子替换）"""
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path.with_name(f"{path.name}.{os.getpid()}.tmp")  # 不以 .wav 结尾，淘汰时不会被删除
+
+    def commit(self, key: str, temp_path: Path) -> Optional[Path]:
+        """发布 reserve() 中写好的文件；失败时返回 None，临时文件仍由调用方处理"""
+        path = self._path(key)
+        try:
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not cache decoded audio {key[:12]}: {e}")
+            return None
+        self.evict(keep=[key])
+        return path
+
+
+_audio_cache: Optional[AudioCache] = None
+
+
+def get_audio_cache() -> AudioCache:
+    """Get or create the global decoded-audio cache"""
+    global _audio_cache
+    if _audio_cache is None:
+        _audio_cache = AudioCache()
+    return _audio_cache
@@ -0,0 +1,183 @@
+"""
+Streaming decode: ffmpeg writes 16 kHz mono s16le to a pipe, consumers read
+it through a bounded ring buffer instead of an intermediate WAV file
+"""
+import struct
+import logging
+import subprocess
+import threading
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+
+from .config import settings
+from .audio import TARGET_SAMPLE_RATE, write_pcm16_wav
+
+logger = logging.getLogger(__name__)
+
+# 每次从 ffmpeg 管道读取的字节数
+PIPE_READ_BYTES = 64 * 1024
+
+
+class PCMRingBuffer:
+    """
+    Bounded single-producer / single-consumer buffer of int16 samples
+
+    write() blocks while the buffer is full, so a slow consumer stops the
+    producer (and, through the pipe, ffmpeg) instead of growing memory.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self._data = np.zeros(self.capacity, dtype=np.int16)
+        self._start = 0  # 最早未读样本的位置
+        self._size = 0
+        self._closed = False
+        self._error: Optional[BaseException] = None
+        self._condition = threading.Condition()
+        self.samples_written = 0
+
+    def write(self, samples: np.ndarray):
+        position = 0
+        while position < len(samples):
+            with self._condition:
+                while self._size == self.capacity and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return  # 读取方已放弃，丢弃剩余数据
+                count = min(len(samples) - position, self.capacity - self._size)
+                end = (self._start + self._size) % self.capacity
+                first = min(count, self.capacity - end)
+                self._data[end:end + first] = samples[position:position + first]
+                self._data[:count - first] = samples[position + first:position + count]
+                self._size += count
+                self.samples_written += count
+                position += count
+                self._condition.notify_all()
+
+    def read(self, count: int) -> np.ndarray:
+        """读取 count 个样本；数据结束时返回的样本可能更少（为空表示结束）"""
+        with self._condition:
+            while self._size < count and not self._closed:
+                self._condition.wait()
+            if self._error is not None:
+                raise self._error
+            count = min(count, self._size)
+            first = min(count, self.capacity - self._start)
+            samples = np.concatenate((self._data[self._start:self._start + first], self._data[:count - first]))
+            self._start = (self._start + count) % self.capacity
+            self._size -= count
+            self._condition.notify_all()
+            return samples
+
+    def close(self, error: Optional[BaseException] = None):
+        """结束写入（error 不为空时，读取方会收到该异常）"""
+        with self._condition:
+            self._closed = True
+            self._error = self._error or error
+            self._condition.notify_all()
+
+
+class FFmpegPCMStream:
+    """
+    Decodes any ffmpeg-readable input to 16 kHz mono PCM on a background thread
+
+        with FFmpegPCMStream(path) as stream:
+            while len(block := stream.read(16000 * 10)):
+                ...
+    """
+
+    def __init__(self, input_path: Union[str, Path], buffer_seconds: Optional[float] = None,
+                 audio_stream: Optional[int] = None, tee_path: Optional[Union[str, Path]] = None):
+        self.input_path = str(input_path)
+        self.audio_stream = audio_stream  # 多音轨时选择的音频流（-map 0:a:N）
+        self.tee_path = Path(tee_path) if tee_path else None  # 同时写出的 WAV（解码音频缓存），解码完整时才有效
+        self.completed = False
+        buffer_seconds = buffer_seconds or settings.STREAM_BUFFER_SECONDS
+        self.buffer = PCMRingBuffer(int(buffer_seconds * TARGET_SAMPLE_RATE))
+        self.process: Optional[subprocess.Popen] = None
+        self._pump_thread: Optional[threading.Thread] = None
+        self._stderr_thread: Optional[threading.Thread] = None
+        self._stderr = b""
+
+    def start(self) -> "FFmpegPCMStream":
+        cmd = [
+            "ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error",
+            "-i", self.input_path,
+            *(["-map", f"0:a:{self.audio_stream}"] if self.audio_stream is not None else []),
+            "-vn", "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(TARGET_SAMPLE_RATE),
+            "pipe:1",
+        ]
+        self.process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE)
+        self._stderr_thread = threading.Thread(target=self._drain_stderr, daemon=True)
+        self._stderr_thread.start()
+        self._pump_thread = threading.Thread(target=self._pump, name="ffmpeg-pcm-pump", daemon=True)
+        self._pump_thread.start()
+        return self
+
+    def _drain_stderr(self):
+        self._stderr = self.process.stderr.read()
+        self.process.stderr.close()
+
+    def _pump(self):
+        leftover = b""
+        tee = None
+        try:
+            if self.tee_path is not None:
+                # 先写 data 长度为 0 的头，解码结束后补上实际长度
+                write_pcm16_wav(self.tee_path, np.zeros(0, dtype=np.int16))
+                tee = open(self.tee_path, "r+b")
+                tee.seek(0, 2)
+            while True:
+                data = self.process.stdout.read(PIPE_READ_BYTES)
+                if not data:
+                    break
+                data = leftover + data
+                usable = len(data) - len(data) % 2
+                leftover = data[usable:]
+                if tee is not None:
+                    tee.write(data[:usable])
+                self.buffer.write(np.frombuffer(data[:usable], dtype="<i2"))
+            returncode = self.process.wait()
+            self._stderr_thread.join(timeout=5)
+            error = None
+            if returncode != 0:
+                message = self._stderr.decode(errors="replace").strip()[-500:]
+                error = RuntimeError(f"ffmpeg decode of {Path(self.input_path).name} failed ({returncode}): {message}")
+            elif tee is not None:
+                data_size = tee.tell() - 44
+                tee.seek(4)
+                tee.write(struct.pack("<I", 36 + data_size))
+                tee.seek(40)
+                tee.write(struct.pack("<I", data_size))
+            self.completed = returncode == 0
+            self.buffer.close(error)
+        except Exception as e:
+            self.buffer.close(e)
+        finally:
+            if tee is not None:
+                tee.close()
+
+    def read(self, count: int) -> np.ndarray:
+        return self.buffer.read(count)
+
+    @property
+    def decoded_seconds(self) -> float:
+        return self.buffer.samples_written / TARGET_SAMPLE_RATE
+
+    def close(self):
+        """停止解码（提前退出时终止 ffmpeg）"""
+        self.buffer.close()
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        if self._pump_thread is not None:
+            self._pump_thread.join(timeout=5)
+
+    def __enter__(self) -> "FFmpegPCMStream":
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,224 @@
+"""
+Offline autotuning: benchmark threads x concurrent processes x models on this host
+
+Usage:
+    python -m app.autotune                          # 生成参考音频，扫描默认组合
+    python -m app.autotune --clip sample.wav --models base,small --threads 2,4,8 --processes 1,2,4
+
+Every configuration runs in a fresh interpreter through the same
+WhisperManager.transcribe() path the workers use, so the measured real-time
+factor and peak RSS (of the whisper.cpp child processes) are what a worker
+would see. The winner is written to HOST_PROFILE_PATH, which Settings loads
+at startup instead of the built-in heuristics.
+"""
+import os
+import json
+import time
+import socket
+import logging
+import argparse
+import resource
+import tempfile
+import multiprocessing
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+from .config import settings
+from .audio import TARGET_SAMPLE_RATE, write_pcm16_wav, wav_duration, is_normalized_wav
+from .cpu_planner import cpu_topology
+from .workspace import mem_available_bytes
+
+logger = logging.getLogger(__name__)
+
+
+def generate_reference_clip(path: Path, seconds: float = 60.0, seed: int = 0) -> Path:
+    """
+    生成一段类似语音节奏的参考音频：带谐波的“音节”、短停顿和底噪
+
+    内容不可识别，但 whisper.cpp 的计算量取决于音频长度和解码出的 token 数，
+    足以比较不同配置的相对速度；需要精确数据时请用 --clip 指定真实录音。
+    """
+    rng = np.random.default_rng(seed)
+    sample_rate = TARGET_SAMPLE_RATE
+    total = int(seconds * sample_rate)
+    signal = rng.normal(0, 0.003, total).astype(np.float32)
+
+    position = 0
+    while position < total:
+        length = int(rng.uniform(0.12, 0.35) * sample_rate)
+        end = min(total, position + length)
+        t = np.arange(end - position) / sample_rate
+        pitch = rng.uniform(100, 220)
+        syllable = sum(np.sin(2 * np.pi * pitch * k * t) / k for k in range(1, 6))
+        envelope = np.sin(np.pi * np.arange(end - position) / max(1, end - position))
+        signal[position:end] += 0.2 * syllable * envelope
+        # 音节之间的停顿，偶尔是句子间的长停顿
+        gap = rng.uniform(0.6, 1.2) if rng.random() < 0.1 else rng.uniform(0.03, 0.12)
+        position = end + int(gap * sample_rate)
+
+    write_pcm16_wav(path, signal, sample_rate)
+    return path
+
+
+def _run_configuration(clip: str, model_name: str, threads: int, processes: int) -> Dict[str, Any]:
+    """在独立进程中运行一组配置（由 ProcessPoolExecutor 以 spawn 方式调用）"""
+    from .whisper_manager import get_whisper_manager
+
+    manager = get_whisper_manager()
+    if not manager.whisper_cpp_path:
+        raise RuntimeError("whisper.cpp is not available, cannot benchmark")
+
+    clip_seconds = wav_duration(clip)
+    with tempfile.TemporaryDirectory(prefix="audio2sub_autotune_") as work_dir:
+        def _one(index: int) -> Dict[str, Any]:
+            output_dir = Path(work_dir) / str(index)
+            output_dir.mkdir()
+            # 合成片段的实时率不写入 Redis，它会决定真实任务的超时
+            return manager.transcribe(clip, model_name=model_name, threads=threads, output_dir=str(output_dir),
+                                      timeout=max(600.0, clip_seconds * 20), record_rtf=False)
+
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(_one, range(processes)))
+        wall_time = time.time() - start
+
+    # ru_maxrss 是已结束子进程中最大的常驻内存（Linux 上单位为 KB）
+    peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    job_times = [r["transcription_time"] for r in results]
+    return {
+        "model": model_name,
+        "threads": threads,
+        "processes": processes,
+        "wall_time": round(wall_time, 3),
+        "realtime_factor": round(sum(job_times) / len(job_times) / clip_seconds, 4),
+        "throughput": round(processes * clip_seconds / wall_time, 3),  # 每秒处理的音频秒数
+        "peak_rss_mb": round(peak_rss / 1024 / 1024, 1),
+    }
+
+
+def benchmark(clip: str, model_name: str, threads: int, processes: int) -> Dict[str, Any]:
+    """用全新的解释器运行一组配置，保证 ru_maxrss 只统计这组配置"""
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(_run_configuration, clip, model_name, threads, processes).result()
+
+
+def select_recommendation(results: List[Dict[str, Any]], memory_budget: Optional[int]) -> Dict[str, Any]:
+    """
+    在内存预算内选出吞吐量最高的配置（每个模型一组，再汇总为主机默认值）
+    """
+    per_model: Dict[str, Dict[str, Any]] = {}
+    for result in results:
+        if memory_budget and result["peak_rss_mb"] * result["processes"] * 1024 * 1024 > memory_budget:
+            continue
+        best = per_model.get(result["model"])
+        if best is None or result["throughput"] > best["throughput"]:
+            per_model[result["model"]] = result
+
+    # 单任务最快的线程数作为长音频的线程数
+    fastest_threads: Dict[str, int] = {}
+    for model_name in per_model:
+        single = [r for r in results if r["model"] == model_name and r["processes"] == 1]
+        if single:
+            fastest_threads[model_name] = min(single, key=lambda r: r["realtime_factor"])["threads"]
+
+    default_model = settings.MODEL_NAME if settings.MODEL_NAME in per_model else next(iter(per_model), None)
+    if default_model is None:
+        raise RuntimeError("No configuration fits in the memory budget")
+    best = per_model[default_model]
+    return {
+        "threads": best["threads"],
+        "long_threads": fastest_threads.get(default_model, best["threads"]),
+        "worker_concurrency": best["processes"],
+        "per_model": {
+            model_name: {
+                "threads": result["threads"],
+                "worker_concurrency": result["processes"],
+                "realtime_factor": result["realtime_factor"],
+                "throughput": result["throughput"],
+                "peak_rss_mb": result["peak_rss_mb"],
+            }
+            for model_name, result in per_model.items()
+        },
+    }
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(part) for part in value.split(",") if part.strip()]
+
+
+def main(argv: Optional[List[str]] = None):
+    topology = cpu_topology()
+    physical_cores = topology["physical_cores"]
+    default_threads = sorted({t for t in (1, 2, 4, 8, 16) if t <= physical_cores} | {physical_cores})
+    default_processes = sorted({p for p in (1, 2, 4) if p <= physical_cores})
+
+    parser = argparse.ArgumentParser(prog="python -m app.autotune", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clip", help="参考音频（16 kHz 单声道 PCM WAV），默认生成合成音频")
+    parser.add_argument("--seconds", type=float, default=60.0, help="生成的参考音频时长（秒）")
+    parser.add_argument("--models", default=settings.MODEL_NAME, help="逗号分隔的模型列表")
+    parser.add_argument("--threads", type=_int_list, default=default_threads, help="逗号分隔的线程数")
+    parser.add_argument("--processes", type=_int_list, default=default_processes, help="逗号分隔的并发进程数")
+    parser.add_argument("--output", default=settings.HOST_PROFILE_PATH, help="主机配置文件输出路径")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    # 基准测试只测 CLI 路径，常驻 whisper-server 不参与
+    os.environ["WHISPER_ENGINE_MODE"] = "cli"
+
+    with tempfile.TemporaryDirectory(prefix="audio2sub_autotune_clip_") as clip_dir:
+        clip = args.clip
+        if clip is None:
+            clip = str(generate_reference_clip(Path(clip_dir) / "reference.wav", args.seconds))
+            logger.info(f"Generated {args.seconds:.0f}s reference clip: {clip}")
+        elif not is_normalized_wav(clip):
+            raise SystemExit("--clip must be a 16 kHz mono PCM WAV (ffmpeg -i in -ar 16000 -ac 1 out.wav)")
+
+        models = [m.strip() for m in args.models.split(",") if m.strip()]
+        results = []
+        for model_name in models:
+            # 预热：下载模型并让模型文件进入页缓存
+            benchmark(clip, model_name, args.threads[-1], 1)
+            for threads in args.threads:
+                for processes in args.processes:
+                    if threads * processes > topology["logical_cpus"] * 2:
+                        continue
+                    result = benchmark(clip, model_name, threads, processes)
+                    logger.info(f"{model_name:>16} threads={threads:<3} processes={processes:<2} "
+                                f"RTF={result['realtime_factor']:.3f} throughput={result['throughput']:.2f}x "
+                                f"peak RSS={result['peak_rss_mb']:.0f} MB")
+                    results.append(result)
+
+        memory_available = mem_available_bytes()
+        memory_budget = int(memory_available * 0.8) if memory_available else None
+        profile = {
+            "created_at": datetime.now().isoformat(),
+            "host": {
+                "hostname": socket.gethostname(),
+                "logical_cpus": topology["logical_cpus"],
+                "physical_cores": physical_cores,
+                "numa_nodes": len(topology["numa_nodes"]),
+                "memory_budget_mb": round(memory_budget / 1024 / 1024) if memory_budget else None,
+            },
+            "clip": {"path": args.clip, "seconds": wav_duration(clip)},
+            "results": results,
+            "recommended": select_recommendation(results, memory_budget),
+        }
+
+    output = Path(args.output).expanduser()
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tmp_output = output.with_suffix(".tmp")
+    tmp_output.write_text(json.dumps(profile, indent=2))
+    os.replace(tmp_output, output)
+
+    recommended = profile["recommended"]
+    logger.info(f"✅ Host profile written to {output}: threads={recommended['threads']}, "
+                f"long_threads={recommended['long_threads']}, worker_concurrency={recommended['worker_concurrency']}")
+
+
+if __name__ == "__main__":
+    main()
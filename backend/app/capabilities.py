@@ -0,0 +1,146 @@
+"""
+Host capability probes cached on disk, keyed by binary mtime and hash
+
+Settings and WhisperManager used to scan paths and shell out to `nvidia-smi`,
+`sysctl` and `whisper-cli --help` in every process. The probes now run once
+per host (or whenever a probed binary changes) and later processes read the
+result from a small JSON file.
+
+This module must not import app.config: Settings uses it while it is being
+constructed.
+"""
+import os
+import json
+import time
+import fcntl
+import hashlib
+import logging
+import platform
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Callable
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+
+
+def file_fingerprint(path: str, with_hash: bool = True) -> Optional[Dict[str, Any]]:
+    """文件的 mtime、大小和（可选）SHA-256"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    fingerprint = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+    if with_hash:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        fingerprint["sha256"] = digest.hexdigest()
+    return fingerprint
+
+
+class CapabilityCache:
+    """
+    Named probe results stored in one JSON file shared by all processes on the host.
+
+    An entry is reused while its key (environment, host) matches and every
+    binary it depends on still has the recorded mtime and size. A binary whose
+    mtime changed but whose SHA-256 did not (re-copied, touched) keeps the
+    entry. Results that found nothing expire after negative_ttl seconds, so a
+    freshly installed binary is picked up without clearing the cache.
+    """
+
+    def __init__(self, path: str, negative_ttl: float = 300):
+        self.path = Path(path).expanduser()
+        self.negative_ttl = negative_ttl
+        self._memory: Dict[str, Dict[str, Any]] = {}
+
+    def _read(self) -> Dict[str, Any]:
+        try:
+            cache = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+        return cache if cache.get("version") == CACHE_VERSION else {}
+
+    def _write_entry(self, name: str, entry: Dict[str, Any]):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path.with_suffix(".lock"), "a+") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    cache = self._read()
+                    cache["version"] = CACHE_VERSION
+                    cache.setdefault("entries", {})[name] = entry
+                    tmp_file = self.path.with_suffix(f".{os.getpid()}.tmp")
+                    tmp_file.write_text(json.dumps(cache, indent=2))
+                    os.replace(tmp_file, self.path)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        except OSError as e:
+            logger.debug(f"Could not write capability cache {self.path}: {e}")
+
+    @staticmethod
+    def _binaries_unchanged(binaries: Dict[str, Dict[str, Any]]) -> bool:
+        for path, recorded in binaries.items():
+            current = file_fingerprint(path, with_hash=False)
+            if current is None:
+                return False
+            if current["mtime_ns"] == recorded["mtime_ns"] and current["size"] == recorded["size"]:
+                continue
+            # mtime 变了但内容可能没变（重新拷贝、touch），用哈希确认
+            if current["size"] != recorded["size"] or file_fingerprint(path)["sha256"] != recorded.get("sha256"):
+                return False
+        return True
+
+    def get(self, name: str, probe: Callable[[], Dict[str, Any]], key: Optional[Dict[str, Any]] = None,
+            binaries: Callable[[Dict[str, Any]], List[str]] = lambda data: [],
+            is_negative: Callable[[Dict[str, Any]], bool] = lambda data: False) -> Dict[str, Any]:
+        """
+        Return the cached result of probe() or run it and store the result.
+
+        binaries(data) lists executables the result depends on; they are
+        fingerprinted with mtime, size and SHA-256.
+        """
+        key = {"host": platform.node(), **(key or {})}
+        entry = self._memory.get(name) or self._read().get("entries", {}).get(name)
+        if entry is not None and entry.get("key") == key and self._binaries_unchanged(entry.get("binaries", {})):
+            expired = is_negative(entry["data"]) and time.time() - entry.get("created_at", 0) > self.negative_ttl
+            if not expired:
+                self._memory[name] = entry
+                return entry["data"]
+
+        start = time.time()
+        data = probe()
+        fingerprints = {}
+        for path in binaries(data):
+            fingerprint = file_fingerprint(path) if path else None
+            if fingerprint is not None:
+                fingerprints[path] = fingerprint
+        entry = {"key": key, "binaries": fingerprints, "data": data, "created_at": time.time()}
+        self._memory[name] = entry
+        self._write_entry(name, entry)
+        logger.info(f"Probed {name} capabilities in {time.time() - start:.2f}s (cached in {self.path})")
+        return data
+
+    def invalidate(self, name: Optional[str] = None):
+        """清除缓存（name 为空时清除全部）"""
+        if name is None:
+            self._memory.clear()
+            self.path.unlink(missing_ok=True)
+            return
+        self._memory.pop(name, None)
+        cache = self._read()
+        if name in cache.get("entries", {}):
+            self._write_entry(name, {"key": None, "data": {}, "binaries": {}})
+
+
+_caches: Dict[str, CapabilityCache] = {}
+
+
+def get_capability_cache(path: str) -> CapabilityCache:
+    """Get the process-wide cache instance for a cache file"""
+    cache = _caches.get(path)
+    if cache is None:
+        cache = _caches[path] = CapabilityCache(path)
+    return cache
@@ -0,0 +1,159 @@
+"""
+Cascade transcription: a fast draft with a small model, then only the
+low-confidence spans re-decoded with a large model and spliced back
+"""
+import time
+import logging
+from pathlib import Path
+from datetime import timedelta
+from typing import Dict, Any, List, Optional, Callable, Tuple
+
+import numpy as np
+
+from .config import settings
+from .audio import read_pcm16_wav, write_pcm16_wav
+from .vad import remap_segments
+
+logger = logging.getLogger(__name__)
+
+# 拼接待重转的片段时，片段之间插入的静音（秒），避免跨片段的句子粘连
+SPAN_GAP_SECONDS = 0.3
+
+TranscribeFn = Callable[..., Dict[str, Any]]
+
+
+def segment_confidence(segment: Dict[str, Any]) -> Optional[float]:
+    """片段内单词概率的平均值（没有单词概率时返回 None）"""
+    probabilities = [word["probability"] for word in segment.get("words", []) if "probability" in word]
+    if not probabilities:
+        return None
+    return float(np.mean(probabilities))
+
+
+def low_confidence_spans(segments: List[Dict[str, Any]], duration: float,
+                         threshold: float = None, padding: float = None) -> List[Tuple[float, float]]:
+    """
+    Time spans whose draft needs the large model
+
+    A segment is flagged when its mean word probability is below threshold
+    or any word is below half of it. Each flagged segment is padded on both
+    sides for context, and overlapping spans are merged.
+    """
+    threshold = settings.CASCADE_CONFIDENCE_THRESHOLD if threshold is None else threshold
+    padding = settings.CASCADE_SPAN_PADDING if padding is None else padding
+
+    spans: List[Tuple[float, float]] = []
+    for segment in segments:
+        confidence = segment_confidence(segment)
+        if confidence is None:
+            continue
+        weakest = min(word["probability"] for word in segment["words"] if "probability" in word)
+        if confidence >= threshold and weakest >= threshold / 2:
+            continue
+        start = max(0.0, segment["start"] - padding)
+        end = min(duration, segment["end"] + padding)
+        if spans and start <= spans[-1][1]:
+            spans[-1] = (spans[-1][0], max(spans[-1][1], end))
+        else:
+            spans.append((start, end))
+    return spans
+
+
+def splice_segments(draft: List[Dict[str, Any]], refined: List[Dict[str, Any]],
+                    spans: List[Tuple[float, float]]) -> List[Dict[str, Any]]:
+    """用重转结果替换草稿中落在重转区间内的片段（按片段中点判断归属）"""
+    def _inside(segment: Dict[str, Any]) -> bool:
+        midpoint = (segment["start"] + segment["end"]) / 2
+        return any(start <= midpoint < end for start, end in spans)
+
+    kept = [segment for segment in draft if not _inside(segment)]
+    replaced = [segment for segment in refined if _inside(segment)]
+    return sorted(kept + replaced, key=lambda segment: (segment["start"], segment["end"]))
+
+
+def transcribe_cascade(wav_path: str, transcribe: TranscribeFn, draft_model: str, final_model: str,
+                       language: Optional[str] = None, work_dir: Optional[str] = None,
+                       progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    Draft the whole file with draft_model, then re-decode low-confidence spans with final_model.
+
+    transcribe(audio_path, model_name, language, progress_callback, **options)
+    runs one pass (plain or chunked) and must return engine-shaped results.
+    All flagged spans are concatenated into one WAV, so the large model is
+    loaded and run once however many spans there are. When more than
+    CASCADE_MAX_REFINE_RATIO of the audio is flagged, the whole file is
+    re-decoded instead.
+    """
+    start_time = time.time()
+    samples, sample_rate = read_pcm16_wav(wav_path)
+    duration = len(samples) / sample_rate
+
+    def _stage_progress(offset: float, weight: float):
+        if not progress_callback:
+            return None
+
+        def _report(info: Dict[str, Any]):
+            progress_callback({**info, "percent": round(offset + info.get("percent", 0) * weight, 1)})
+        return _report
+
+    # 草稿预计占大部分进度；若不需要重转，后面直接报告 100%
+    draft = transcribe(wav_path, draft_model, language, _stage_progress(0.0, 0.7), token_probabilities=True)
+    draft_time = time.time() - start_time
+    spans = low_confidence_spans(draft.get("segments", []), duration)
+    refine_seconds = sum(end - start for start, end in spans)
+    cascade_info = {
+        "draft_model": draft_model,
+        "final_model": final_model,
+        "spans": len(spans),
+        "refined_seconds": round(refine_seconds, 2),
+        "refined_fraction": round(refine_seconds / duration, 3) if duration else 0.0,
+        "draft_time": round(draft_time, 2),
+    }
+    logger.info(f"🪜 Cascade draft with {draft_model}: {len(spans)} low-confidence spans, "
+                f"{refine_seconds:.1f}s of {duration:.1f}s to re-decode with {final_model}")
+
+    # 重转时固定为草稿识别出的语言，避免短片段上的语言误判
+    refine_language = language
+    if refine_language is None and draft.get("language") not in (None, "", "unknown"):
+        refine_language = draft["language"]
+
+    if not spans:
+        result = draft
+        cascade_info["mode"] = "draft"
+    elif refine_seconds / duration > settings.CASCADE_MAX_REFINE_RATIO:
+        # 大部分音频都不可信，直接用大模型整体重转
+        result = transcribe(wav_path, final_model, refine_language, _stage_progress(70.0, 0.3))
+        cascade_info["mode"] = "full"
+    else:
+        pieces, time_map, position = [], [], 0.0
+        gap = np.zeros(int(SPAN_GAP_SECONDS * sample_rate), dtype=np.int16)
+        for start, end in spans:
+            first, last = int(start * sample_rate), int(end * sample_rate)
+            pieces.extend([samples[first:last], gap])
+            time_map.append((position, first / sample_rate, (last - first) / sample_rate))
+            position += (last - first + len(gap)) / sample_rate
+        refine_path = Path(work_dir or Path(wav_path).parent) / f"{Path(wav_path).stem}_refine.wav"
+        write_pcm16_wav(refine_path, np.concatenate(pieces), sample_rate)
+        try:
+            refined = transcribe(str(refine_path), final_model, refine_language, _stage_progress(70.0, 0.3))
+        finally:
+            refine_path.unlink(missing_ok=True)
+
+        refined_segments = remap_segments(refined.get("segments", []), time_map)
+        segments = splice_segments(draft.get("segments", []), refined_segments, spans)
+        result = {**draft, "segments": segments, "text": " ".join(segment["text"] for segment in segments)}
+        cascade_info["mode"] = "spliced"
+
+    if progress_callback:
+        progress_callback({"percent": 100.0, "audio_seconds": duration, "audio_duration": duration,
+                           "elapsed": round(time.time() - start_time, 2), "realtime_factor": None})
+
+    transcription_time = time.time() - start_time
+    cascade_info["total_time"] = round(transcription_time, 2)
+    return {
+        **result,
+        "transcription_time": transcription_time,
+        "transcription_time_formatted": str(timedelta(seconds=int(transcription_time))),
+        "model": final_model,
+        "cascade": cascade_info,
+    }
@@ -0,0 +1,479 @@
+"""
+Silence-aware chunking and parallel transcription of long audio files
+"""
+import os
+import math
+import time
+import shutil
+import logging
+import tempfile
+import threading
+from queue import Queue
+from pathlib import Path
+from datetime import timedelta
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Callable
+
+import numpy as np
+
+from .config import settings
+from .audio import TARGET_SAMPLE_RATE, read_pcm16_wav, write_pcm16_wav, frame_rms_db
+from .vad import detect_speech, compact_speech, remap_segments
+from .cost_model import subprocess_timeout
+
+logger = logging.getLogger(__name__)
+
+# 静音检测的帧长（秒）和平滑窗口（帧数）
+FRAME_SECONDS = 0.02
+SMOOTHING_FRAMES = 15
+
+# 流式转录每次从解码流读取的时长（秒）
+STREAM_READ_SECONDS = 10
+
+
+def plan_chunks(samples: np.ndarray, sample_rate: int,
+                target_seconds: float = None,
+                search_seconds: float = None,
+                overlap_seconds: float = None) -> List[Dict[str, float]]:
+    """
+    Split a PCM stream into chunks whose boundaries fall on the quietest point
+    near every target boundary.
+
+    Each chunk owns [owned_start, owned_end); start/end additionally include the
+    context overlap on each side.
+    """
+    target_seconds = target_seconds or settings.CHUNK_TARGET_SECONDS
+    search_seconds = settings.CHUNK_SEARCH_SECONDS if search_seconds is None else search_seconds
+    overlap_seconds = settings.CHUNK_OVERLAP_SECONDS if overlap_seconds is None else overlap_seconds
+
+    total_seconds = len(samples) / sample_rate
+    frame_length = int(FRAME_SECONDS * sample_rate)
+    energy = frame_rms_db(samples, frame_length)
+    if len(energy) >= SMOOTHING_FRAMES:
+        # 平滑后的能量最低点代表一段持续的静音，而不是单词内部的短暂停顿
+        kernel = np.ones(SMOOTHING_FRAMES, dtype=np.float32) / SMOOTHING_FRAMES
+        energy = np.convolve(energy, kernel, mode="same")
+
+    cuts = [0.0]
+    while total_seconds - cuts[-1] > target_seconds * 1.5:
+        target = cuts[-1] + target_seconds
+        lo = int(max(cuts[-1] + target_seconds / 2, target - search_seconds) / FRAME_SECONDS)
+        hi = int(min(total_seconds, target + search_seconds) / FRAME_SECONDS)
+        window = energy[lo:hi]
+        if len(window) == 0:
+            cut = target
+        else:
+            cut = (lo + int(np.argmin(window))) * FRAME_SECONDS + FRAME_SECONDS / 2
+        cuts.append(cut)
+    cuts.append(total_seconds)
+
+    chunks = []
+    for index in range(len(cuts) - 1):
+        owned_start, owned_end = cuts[index], cuts[index + 1]
+        chunks.append({
+            "index": index,
+            "owned_start": owned_start,
+            "owned_end": owned_end,
+            "start": max(0.0, owned_start - overlap_seconds),
+            "end": min(total_seconds, owned_end + overlap_seconds),
+        })
+    return chunks
+
+
+def find_cut(samples: np.ndarray, sample_rate: int, buffer_start: float, previous_cut: float,
+             target_seconds: float, search_seconds: float) -> float:
+    """
+    plan_chunks 的增量版本：在已缓冲的音频中找 previous_cut 之后的下一个切点
+
+    samples 的第一个样本位于全局时间 buffer_start，且至少要覆盖到
+    previous_cut + target_seconds + search_seconds。
+    """
+    target = previous_cut + target_seconds
+    lo = max(previous_cut + target_seconds / 2, target - search_seconds)
+    hi = target + search_seconds
+    first = max(0, int((lo - buffer_start) * sample_rate))
+    last = max(first, int((hi - buffer_start) * sample_rate))
+    energy = frame_rms_db(samples[first:last], int(FRAME_SECONDS * sample_rate))
+    if len(energy) == 0:
+        return target
+    if len(energy) >= SMOOTHING_FRAMES:
+        kernel = np.ones(SMOOTHING_FRAMES, dtype=np.float32) / SMOOTHING_FRAMES
+        energy = np.convolve(energy, kernel, mode="same")
+    return buffer_start + first / sample_rate + int(np.argmin(energy)) * FRAME_SECONDS + FRAME_SECONDS / 2
+
+
+def shift_segments(segments: List[Dict], offset: float) -> List[Dict]:
+    """把分块内的时间戳平移到全局时间轴"""
+    shifted = []
+    for segment in segments:
+        shifted_segment = dict(segment)
+        shifted_segment["start"] = segment["start"] + offset
+        shifted_segment["end"] = segment["end"] + offset
+        shifted_segment["words"] = [
+            {**word, "start": word["start"] + offset, "end": word["end"] + offset}
+            for word in segment.get("words", [])
+        ]
+        shifted.append(shifted_segment)
+    return shifted
+
+
+def merge_chunk_segments(chunks: List[Dict[str, float]], chunk_segments: List[List[Dict]]) -> List[Dict]:
+    """
+    Merge per-chunk segments (already on the global timeline) and drop the
+    duplicates produced by the context overlap at chunk seams.
+    """
+    merged: List[Dict] = []
+    for chunk, segments in zip(chunks, chunk_segments):
+        is_last = chunk["index"] == len(chunks) - 1
+        for segment in segments:
+            midpoint = (segment["start"] + segment["end"]) / 2
+            # 重叠区的片段只保留在“拥有”该时间点的分块中
+            if midpoint < chunk["owned_start"]:
+                continue
+            if midpoint >= chunk["owned_end"] and not is_last:
+                continue
+            if merged:
+                previous = merged[-1]
+                if segment["text"] == previous["text"] and segment["start"] < previous["end"]:
+                    continue
+                if segment["start"] < previous["end"]:
+                    segment = {**segment, "start": min(previous["end"], segment["end"])}
+            merged.append(segment)
+    return merged
+
+
+def _plan_parallelism(n_chunks: int, cpu_plan=None, max_workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    决定并行分块数和每个 whisper 进程的线程数
+
+    有 cpu_plan 时在该任务预留的核心内划分，每个进程分到一组互不重叠的核心；
+    否则按CPU核心数估算。max_workers 是引擎能同时运行的分块数（常驻服务的进程数）。
+    """
+    if max_workers:
+        n_chunks = min(n_chunks, max_workers)
+    if cpu_plan is not None:
+        workers = settings.CHUNK_MAX_WORKERS or max(1, cpu_plan.threads // settings.CPU_THREADS_SHORT)
+        workers = max(1, min(workers, n_chunks))
+        slots = cpu_plan.split(workers)
+        return {"workers": len(slots), "threads": slots[0].threads, "slots": slots}
+
+    cpu_count = os.cpu_count() or 1
+    workers = settings.CHUNK_MAX_WORKERS or max(1, cpu_count // 2)
+    workers = max(1, min(workers, n_chunks))
+    threads = max(1, cpu_count // workers)
+    return {"workers": workers, "threads": threads, "slots": []}
+
+
+def _chunk_options(options: Dict[str, Any], model_name: Optional[str], seconds: float, workers: int) -> Dict[str, Any]:
+    """
+    Engine options for one chunk
+
+    A chunk runs with 1/workers of the threads, so its time says nothing
+    about a full run: it is not recorded as the model's real-time factor,
+    and the full-run factor is scaled by workers for its subprocess timeout.
+    """
+    chunk_options = {**options, "record_rtf": False}
+    if "timeout" not in options:
+        chunk_options["timeout"] = subprocess_timeout(model_name or settings.MODEL_NAME, seconds) * workers
+    return chunk_options
+
+
+def transcribe_chunked(wav_path: str, engine, model_name: str = None,
+                       language: str = None, task_type: str = None,
+                       work_dir: Optional[str] = None,
+                       progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                       cpu_plan=None, **options) -> Dict[str, Any]:
+    """
+    Transcribe a normalized 16 kHz WAV by splitting it at silences and running
+    the chunks concurrently. Extra options are passed to engine.transcribe().
+
+    Each chunk runs in its own whisper.cpp process; the pool threads only wait
+    on those processes, so parallelism is process-level even inside a
+    daemonic Celery worker that cannot fork a multiprocessing pool.
+    """
+    start_time = time.time()
+    samples, sample_rate = read_pcm16_wav(wav_path)
+    chunks = plan_chunks(samples, sample_rate)
+    parallelism = _plan_parallelism(len(chunks), cpu_plan, engine.capabilities().get("max_parallel_chunks"))
+    # 空闲的核心组：分块开始时取出，结束后放回，同一时刻每组核心只运行一个进程
+    free_slots: Queue = Queue()
+    for slot in parallelism["slots"]:
+        free_slots.put(slot)
+
+    logger.info(f"✂️ Split {len(samples) / sample_rate:.1f}s audio into {len(chunks)} chunks, "
+                f"{parallelism['workers']} workers x {parallelism['threads']} threads")
+
+    own_work_dir = work_dir is None
+    chunk_dir = Path(work_dir or tempfile.mkdtemp(prefix="audio2sub_chunks_"))
+    chunk_dir.mkdir(parents=True, exist_ok=True)
+
+    # 汇总各分块的进度：已处理音频秒数之和 / 总音频秒数
+    total_audio = sum(chunk["end"] - chunk["start"] for chunk in chunks)
+    chunk_processed: Dict[int, float] = {}
+    progress_lock = threading.Lock()
+
+    def _report_progress(index: int, processed_seconds: float):
+        if not progress_callback:
+            return
+        with progress_lock:
+            chunk_processed[index] = processed_seconds
+            processed = sum(chunk_processed.values())
+        elapsed = time.time() - start_time
+        progress_callback({
+            "percent": round(min(100.0, processed / total_audio * 100), 1) if total_audio else 100.0,
+            "audio_seconds": round(processed, 2),
+            "audio_duration": total_audio,
+            "elapsed": round(elapsed, 2),
+            "realtime_factor": round(elapsed / processed, 3) if processed > 0 else None,
+        })
+
+    def _transcribe_chunk(chunk: Dict[str, float]) -> Dict[str, Any]:
+        chunk_path = chunk_dir / f"chunk_{chunk['index']:04d}.wav"
+        first = int(chunk["start"] * sample_rate)
+        last = int(chunk["end"] * sample_rate)
+        chunk_length = (last - first) / sample_rate
+        write_pcm16_wav(chunk_path, samples[first:last], sample_rate)
+
+        def _chunk_progress(info: Dict[str, Any]):
+            seconds = info.get("audio_seconds") or chunk_length * info.get("percent", 0) / 100
+            _report_progress(chunk["index"], min(chunk_length, seconds))
+
+        # 每个分块独立的输出目录：并行的 whisper 进程输出前缀不会互相覆盖，不依赖引擎如何命名输出文件
+        output_dir = chunk_dir / f"chunk_{chunk['index']:04d}"
+        output_dir.mkdir(parents=True, exist_ok=True)
+        slot = free_slots.get() if parallelism["slots"] else None
+        try:
+            result = engine.transcribe(
+                str(chunk_path),
+                model_name=model_name,
+                language=language,
+                task_type=task_type,
+                threads=slot.threads if slot else parallelism["threads"],
+                output_dir=str(output_dir),
+                progress_callback=_chunk_progress if progress_callback else None,
+                affinity=slot.affinity if slot else None,
+                **_chunk_options(options, model_name, chunk_length, parallelism["workers"]),
+            )
+            _report_progress(chunk["index"], chunk_length)
+            return result
+        finally:
+            if slot is not None:
+                free_slots.put(slot)
+            chunk_path.unlink(missing_ok=True)
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    try:
+        with ThreadPoolExecutor(max_workers=parallelism["workers"]) as executor:
+            chunk_results = list(executor.map(_transcribe_chunk, chunks))
+    finally:
+        if own_work_dir:
+            shutil.rmtree(chunk_dir, ignore_errors=True)
+
+    chunk_segments = [
+        shift_segments(result.get("segments", []), chunk["start"])
+        for chunk, result in zip(chunks, chunk_results)
+    ]
+    segments = merge_chunk_segments(chunks, chunk_segments)
+
+    languages = Counter(r.get("language", "unknown") for r in chunk_results)
+    transcription_duration = time.time() - start_time
+    logger.info(f"Chunked transcription completed in {transcription_duration:.2f} seconds")
+
+    return {
+        "text": " ".join(seg["text"] for seg in segments),
+        "segments": segments,
+        "transcription_time": transcription_duration,
+        "transcription_time_formatted": str(timedelta(seconds=int(transcription_duration))),
+        "language": languages.most_common(1)[0][0] if languages else "unknown",
+        "chunks": len(chunks),
+        "engine": getattr(engine, "name", None),
+        "realtime_factor": round(transcription_duration / total_audio, 3) if total_audio else None,
+    }
+
+
+def transcribe_stream(stream, engine, model_name: str = None, language: str = None, task_type: str = None,
+                      total_seconds: Optional[float] = None, work_dir: Optional[str] = None,
+                      progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                      cpu_plan=None, first_chunk_hook: Optional[Callable[[np.ndarray], Dict[str, Any]]] = None,
+                      **options) -> Dict[str, Any]:
+    """
+    Transcribe a 16 kHz PCM stream (audio_stream.FFmpegPCMStream) while it is still decoding
+
+    As soon as enough audio has arrived, a chunk is cut at the quietest point
+    near CHUNK_TARGET_SECONDS (the same rule as plan_chunks), run through VAD
+    and handed to the engine as PCM. At most `workers` chunks are in flight;
+    beyond that the reader stops and the ring buffer holds ffmpeg back, so
+    memory stays bounded for multi-hour inputs. first_chunk_hook(samples) runs
+    once before the first chunk is transcribed and may return overrides for
+    language / model_name (language detection, .en routing).
+    """
+    start_time = time.time()
+    sample_rate = TARGET_SAMPLE_RATE
+    target_seconds = settings.CHUNK_TARGET_SECONDS
+    search_seconds = settings.CHUNK_SEARCH_SECONDS
+    overlap_seconds = settings.CHUNK_OVERLAP_SECONDS
+    # 剩余音频不足 1.5 个目标时长时作为最后一块（与 plan_chunks 相同）；否则要缓冲到切点搜索区和重叠区之后
+    lookahead_seconds = max(target_seconds * 1.5, target_seconds + search_seconds + overlap_seconds)
+
+    expected_chunks = 1
+    if engine.capabilities().get("parallel_chunks"):
+        expected_chunks = math.ceil(total_seconds / target_seconds) if total_seconds else os.cpu_count() or 1
+    parallelism = _plan_parallelism(max(1, expected_chunks), cpu_plan, engine.capabilities().get("max_parallel_chunks"))
+    free_slots: Queue = Queue()
+    for slot in parallelism["slots"]:
+        free_slots.put(slot)
+    in_flight = threading.BoundedSemaphore(parallelism["workers"])
+
+    own_work_dir = work_dir is None
+    chunk_dir = Path(work_dir or tempfile.mkdtemp(prefix="audio2sub_stream_"))
+    chunk_dir.mkdir(parents=True, exist_ok=True)
+
+    run_options = {"model_name": model_name, "language": language}
+    chunk_processed: Dict[int, float] = {}
+    speech_seconds: Dict[int, float] = {}
+    progress_lock = threading.Lock()
+
+    def _report_progress(index: int, processed_seconds: float):
+        if not progress_callback:
+            return
+        with progress_lock:
+            chunk_processed[index] = processed_seconds
+            processed = sum(chunk_processed.values())
+        elapsed = time.time() - start_time
+        progress_callback({
+            "percent": round(min(100.0, processed / total_seconds * 100), 1) if total_seconds else 0.0,
+            "audio_seconds": round(processed, 2),
+            "audio_duration": total_seconds,
+            "elapsed": round(elapsed, 2),
+            "realtime_factor": round(elapsed / processed, 3) if processed > 0 else None,
+        })
+
+    def _transcribe_chunk(chunk: Dict[str, float], samples: np.ndarray) -> Dict[str, Any]:
+        chunk_length = len(samples) / sample_rate
+        try:
+            audio, time_map = samples, []
+            if settings.VAD_ENABLED:
+                # 每个分块单独做 VAD：整段音频此时还没有解码完
+                spans = detect_speech(samples, sample_rate)
+                speech_seconds[chunk["index"]] = sum(end - start for start, end in spans)
+                if not spans:
+                    return {"segments": [], "language": None}
+                if speech_seconds[chunk["index"]] / chunk_length < settings.VAD_MAX_SPEECH_RATIO:
+                    audio, time_map = compact_speech(samples, sample_rate, spans)
+            audio_length = len(audio) / sample_rate
+
+            def _chunk_progress(info: Dict[str, Any]):
+                seconds = info.get("audio_seconds") or audio_length * info.get("percent", 0) / 100
+                _report_progress(chunk["index"], min(chunk_length, seconds * chunk_length / audio_length))
+
+            # 每个分块独立的输出目录：非 PCM 引擎的临时 WAV 和 whisper 输出前缀不会互相覆盖
+            output_dir = chunk_dir / f"chunk_{chunk['index']:04d}"
+            output_dir.mkdir(parents=True, exist_ok=True)
+            slot = free_slots.get() if parallelism["slots"] else None
+            try:
+                result = engine.transcribe(
+                    audio,
+                    model_name=run_options["model_name"],
+                    language=run_options["language"],
+                    task_type=task_type,
+                    threads=slot.threads if slot else parallelism["threads"],
+                    output_dir=str(output_dir),
+                    progress_callback=_chunk_progress if progress_callback else None,
+                    affinity=slot.affinity if slot else None,
+                    **_chunk_options(options, run_options["model_name"], audio_length, parallelism["workers"]),
+                )
+            finally:
+                if slot is not None:
+                    free_slots.put(slot)
+                shutil.rmtree(output_dir, ignore_errors=True)
+            result["segments"] = shift_segments(remap_segments(result.get("segments", []), time_map), chunk["start"])
+            return result
+        finally:
+            _report_progress(chunk["index"], chunk_length)
+            in_flight.release()
+
+    chunks: List[Dict[str, float]] = []
+    futures = []
+    buffer = np.zeros(0, dtype=np.int16)
+    buffer_start = 0.0  # buffer[0] 的全局时间（秒）
+    cut = 0.0
+    block = STREAM_READ_SECONDS * sample_rate
+    executor = ThreadPoolExecutor(max_workers=parallelism["workers"])
+    try:
+        finished = False
+        while not finished:
+            data = stream.read(block)
+            eof = len(data) < block
+            if len(data):
+                buffer = np.concatenate((buffer, data))
+            buffered_end = buffer_start + len(buffer) / sample_rate
+
+            while True:
+                remaining = buffered_end - cut
+                if not eof and remaining <= lookahead_seconds:
+                    break
+                is_last = eof and remaining <= target_seconds * 1.5
+                if is_last and remaining <= 0:
+                    finished = True
+                    break
+                end = buffered_end if is_last else find_cut(buffer, sample_rate, buffer_start, cut,
+                                                            target_seconds, search_seconds)
+                chunk = {
+                    "index": len(chunks),
+                    "owned_start": cut,
+                    "owned_end": end,
+                    "start": max(0.0, cut - overlap_seconds),
+                    "end": min(buffered_end, end + overlap_seconds),
+                }
+                first = int(round((chunk["start"] - buffer_start) * sample_rate))
+                last = int(round((chunk["end"] - buffer_start) * sample_rate))
+                samples = buffer[first:last].copy()
+
+                if first_chunk_hook is not None and not chunks:
+                    run_options.update(first_chunk_hook(samples) or {})
+                chunks.append(chunk)
+
+                for future in futures:
+                    if future.done() and future.exception() is not None:
+                        raise future.exception()
+                in_flight.acquire()
+                futures.append(executor.submit(_transcribe_chunk, chunk, samples))
+                logger.info(f"✂️ Streaming chunk {chunk['index']}: {chunk['start']:.1f}s - {chunk['end']:.1f}s "
+                            f"(decoded {buffered_end:.1f}s so far)")
+
+                # 下一个分块只需要从 cut - overlap 开始的样本
+                cut = end
+                drop = max(0, int(round((cut - overlap_seconds - buffer_start) * sample_rate)))
+                buffer = buffer[drop:]
+                buffer_start += drop / sample_rate
+                if is_last:
+                    finished = True
+                    break
+        chunk_results = [future.result() for future in futures]
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        if own_work_dir:
+            shutil.rmtree(chunk_dir, ignore_errors=True)
+
+    segments = merge_chunk_segments(chunks, [result.get("segments", []) for result in chunk_results])
+    total_audio = chunks[-1]["owned_end"] if chunks else 0.0
+    languages = Counter(r["language"] for r in chunk_results if r.get("language") not in (None, "unknown"))
+    transcription_duration = time.time() - start_time
+    logger.info(f"Streaming transcription of {total_audio:.1f}s in {len(chunks)} chunks "
+                f"completed in {transcription_duration:.2f} seconds")
+
+    return {
+        "text": " ".join(seg["text"] for seg in segments),
+        "segments": segments,
+        "transcription_time": transcription_duration,
+        "transcription_time_formatted": str(timedelta(seconds=int(transcription_duration))),
+        "language": languages.most_common(1)[0][0] if languages else "unknown",
+        "chunks": len(chunks),
+        "engine": getattr(engine, "name", None),
+        "model": run_options["model_name"],
+        "streamed": True,
+        "decoded_seconds": round(total_audio, 2),
+        "speech_seconds": round(sum(speech_seconds.values()), 2) if settings.VAD_ENABLED else None,
+        "realtime_factor": round(transcription_duration / total_audio, 3) if total_audio else None,
+    }
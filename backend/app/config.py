@@ -1,6 +1,7 @@
 from pydantic_settings import BaseSettings
 from typing import List, Optional, Dict, Any
 import os
+import json
 import platform
 import multiprocessing
 import subprocess
@@ -8,9 +9,17 @@ import shutil
 import logging
 import logging
 
+from .capabilities import get_capability_cache
+
 # 全局logger
 logger = logging.getLogger(__name__)
 
+# 影响主机探测结果的环境变量，变化时重新探测
+HOST_DETECTION_ENV = [
+    "DEPLOYMENT_MODE", "WHISPER_DEVICE", "HOST_WHISPER_CPP_PATH", "HOST_MODEL_PATH",
+    "DOCKER_ENV", "NVIDIA_VISIBLE_DEVICES", "PATH",
+]
+
 class Settings(BaseSettings):
     APP_NAME: str = "Audio2Sub Backend"
     DEBUG: bool = True
@@ -78,6 +87,7 @@ class Settings(BaseSettings):
     _whisper_path: Optional[str] = None
     _model_path: Optional[str] = None
     _device_type: Optional[str] = None
+    _host_profile: Optional[Dict[str, Any]] = None
     _initialized: bool = False
     
     def model_post_init(self, __context):
@@ -97,17 +107,12 @@ class Settings(BaseSettings):
     def _detect_and_configure(self):
         """Detect system environment and configure automatically"""
         try:
-            # Detect deployment mode
-            self._deployment_mode = self._detect_deployment_mode()
-            
-            # Detect optimal device
-            self._device_type = self._get_optimal_device()
-            
-            # Find whisper executable
-            self._whisper_path = self._find_whisper_executable()
-            
-            # Find model file
-            self._model_path = self._find_model_file()
+            # 探测结果缓存在主机级文件中，只有 whisper 可执行文件或相关环境变量变化时才重新探测
+            detected = self._cached_host_detection()
+            self._deployment_mode = detected["deployment_mode"]
+            self._device_type = detected["device"]
+            self._whisper_path = detected["whisper_path"]
+            self._model_path = detected["model_path"]
             
             # Apply detected configuration
             self._apply_configuration()
@@ -121,6 +126,35 @@ class Settings(BaseSettings):
         except Exception as e:
             logger.warning(f"自动配置失败，使用默认配置: {e}")
     
+    def _probe_host(self) -> Dict[str, Any]:
+        """实际执行的探测（路径扫描、设备检测），结果由 _cached_host_detection 缓存"""
+        return {
+            "deployment_mode": self._detect_deployment_mode(),
+            "device": self._get_optimal_device(),
+            "whisper_path": self._find_whisper_executable(),
+            "model_path": self._find_model_file(),
+        }
+    
+    def _cached_host_detection(self) -> Dict[str, Any]:
+        """从能力缓存读取主机探测结果，未命中时探测一次并写入缓存"""
+        cache = get_capability_cache(self.CAPABILITIES_CACHE_PATH)
+        key = {
+            "env": {name: os.getenv(name) for name in HOST_DETECTION_ENV},
+            "cwd": os.getcwd(),  # 搜索路径中包含相对路径
+            "dockerenv": os.path.exists('/.dockerenv'),
+        }
+        options = dict(
+            key=key,
+            binaries=lambda data: [data["whisper_path"]] if data.get("whisper_path") else [],
+            is_negative=lambda data: not data.get("whisper_path") or not data.get("model_path"),
+        )
+        detected = cache.get("host", self._probe_host, **options)
+        if detected.get("model_path") and not os.path.isfile(detected["model_path"]):
+            # 缓存中的模型文件已被删除
+            cache.invalidate("host")
+            detected = cache.get("host", self._probe_host, **options)
+        return detected
+    
     def _detect_deployment_mode(self) -> str:
         """智能检测部署模式"""
         # 检查环境变量强制设置
@@ -302,7 +336,144 @@ class Settings(BaseSettings):
     class Config:
         env_file = ".env"
     WHISPER_BEAM_SIZE: int = 5  # Beam size for beam search
-    
+
+    # Transcription engine (see app/engines.py): whisper_cpp, openai_whisper, transformers
+    TRANSCRIPTION_ENGINE: str = "whisper_cpp"  # worker 默认引擎，请求中可以单独指定
+
+    # Whisper.cpp engine mode
+    # cli: 每个任务启动一次 whisper-cli（每次都要重新加载模型）
+    # server: 每个模型保持常驻的 whisper-server 进程，任务直接发送给已加载模型的进程
+    WHISPER_ENGINE_MODE: str = "cli"
+    WHISPER_SERVER_PATH: str = ""  # 为空时自动在 whisper-cli 同目录或 PATH 中查找 whisper-server
+    WHISPER_SERVER_HOST: str = "127.0.0.1"
+    WHISPER_SERVER_INSTANCES: int = 1  # 每个模型最多常驻的进程数
+    WHISPER_SERVER_IDLE_TIMEOUT: int = 600  # 空闲多少秒后关闭常驻进程
+    WHISPER_SERVER_STARTUP_TIMEOUT: int = 120  # 等待模型加载完成的最长时间（秒）
+    WHISPER_SERVER_STATE_DIR: str = "~/.audio2sub/whisper-server"  # 主机级进程注册表和日志目录
+
+    # Long audio chunking settings
+    CHUNKING_ENABLED: bool = True  # 长音频在静音处切分并行转录
+    CHUNKING_MIN_DURATION: int = 600  # 超过该时长（秒）的音频才切分
+    CHUNK_TARGET_SECONDS: int = 300  # 目标分块时长（秒）
+    CHUNK_SEARCH_SECONDS: int = 30  # 在目标切点前后多少秒内寻找静音
+    CHUNK_OVERLAP_SECONDS: float = 1.0  # 分块两侧额外保留的上下文（秒），接缝处去重
+    CHUNK_MAX_WORKERS: int = 0  # 并行分块数，0 = 按CPU核心数自动
+
+    # Voice activity detection settings
+    VAD_ENABLED: bool = True  # 转录前去掉静音段，只转录语音区间
+    VAD_FRAME_MS: int = 30  # 分析帧长（毫秒）
+    VAD_ENERGY_MARGIN_DB: float = 12.0  # 高于底噪多少 dB 视为语音
+    VAD_MIN_ENERGY_DB: float = -55.0  # 低于该能量（dBFS）一律视为静音
+    VAD_MIN_SPEECH_MS: int = 250  # 短于该时长的语音片段被丢弃
+    VAD_MIN_SILENCE_MS: int = 600  # 短于该时长的停顿被合并进语音
+    VAD_PADDING_MS: int = 200  # 语音区间两侧保留的余量
+    VAD_MAX_SPEECH_RATIO: float = 0.9  # 语音占比超过该值时不生成压缩音频
+
+    # Per-job scratch workspace settings
+    SCRATCH_DIR: str = ""  # 磁盘临时目录，为空时使用系统临时目录
+    SCRATCH_PREFER_TMPFS: bool = True  # 内存充足时优先使用 tmpfs（内存盘）
+    SCRATCH_TMPFS_PATH: str = "/dev/shm"
+    SCRATCH_TMPFS_MIN_FREE_MB: int = 1024  # 使用 tmpfs 后至少保留的可用内存（MB）
+
+    # Progress reporting settings
+    PROGRESS_MIN_INTERVAL: float = 2.0  # 两次进度写入结果后端的最小间隔（秒）
+    PROGRESS_MIN_DELTA: float = 1.0  # 进度至少变化多少百分点才写入
+
+    # Duration-aware timeouts and time limits
+    WHISPER_DEFAULT_TIMEOUT: int = 300  # 无法获知音频时长时 whisper 子进程的超时（秒）
+    TIMEOUT_SAFETY_FACTOR: float = 3.0  # 超时 = 预估耗时 × 安全系数
+    TIMEOUT_MIN_SECONDS: int = 60  # 子进程超时下限（秒）
+    TIMEOUT_MODEL_LOAD_SECONDS: int = 30  # 预估中计入的模型加载开销（秒）
+    TASK_TIME_LIMIT_MIN: int = 300  # 单个任务软时间限制的额外余量（秒）
+    TASK_TIME_LIMIT_MAX: int = 6 * 3600  # 单个任务软时间限制上限（秒）
+    RTF_EWMA_ALPHA: float = 0.2  # 实测实时率的滑动平均系数
+
+    # CPU planning (WHISPER_THREADS = 0 时按拓扑和空闲核心为每个任务规划线程数)
+    CPU_THREADS_PER_JOB: int = 4  # 中等时长音频的线程数，也用于推算 worker 并发数
+    CPU_THREADS_SHORT: int = 2  # 短音频线程数（多个任务可以并行）
+    CPU_THREADS_LONG: int = 8  # 长音频线程数
+    CPU_SHORT_CLIP_SECONDS: int = 120  # 不超过该时长（秒）视为短音频
+    CPU_LONG_CLIP_SECONDS: int = 1200  # 不短于该时长（秒）视为长音频
+    CPU_AFFINITY_ENABLED: bool = False  # 把 whisper 进程绑定到分配的物理核心上
+    CPU_LEDGER_DIR: str = "~/.audio2sub/cpu"  # 主机级核心预留表目录
+    WORKER_CONCURRENCY: int = 0  # Celery worker 并发数，0 = 按物理核心数自动
+    WORKER_MAX_TASKS_PER_CHILD: int = 10  # worker 子进程处理多少个任务后重启（0 = 不重启，内存中的模型缓存可以一直保留）
+    HOST_PROFILE_PATH: str = "~/.audio2sub/host_profile.json"  # python -m app.autotune 生成的主机配置
+    CAPABILITIES_CACHE_PATH: str = "~/.audio2sub/capabilities.json"  # 主机能力探测缓存（可执行文件、设备、支持的参数）
+
+    # Model store settings
+    MODELS_DIR: str = "models"  # 下载的模型文件目录
+    MODEL_DISK_BUDGET_GB: float = 8.0  # 模型目录的磁盘预算，超出时按 LRU 淘汰（0 = 不限制）
+    MODEL_EVICTION_MIN_IDLE: int = 3600  # 最近多少秒内用过的模型不会被淘汰
+    MODEL_WARM_THRESHOLD: float = 0.9  # 页缓存中的比例达到该值视为 warm
+    MODEL_PREWARM: bool = True  # worker 启动和任务开始时预读模型到页缓存
+    MODEL_MIRROR_URL: str = ""  # 模型镜像或对等节点地址（如 http://peer:8000/models/files），优先于 Hugging Face
+    MODEL_MIRROR_ONLY: bool = False  # 只从镜像下载，不回退到 Hugging Face
+    MODEL_SERVE_PEERS: bool = False  # 通过 /models/files/ 向其他节点提供本机模型文件
+    MODEL_DOWNLOAD_CONNECTIONS: int = 8  # 并行 Range 请求数
+    MODEL_DOWNLOAD_RANGE_MB: int = 16  # 每个 Range 分片大小（MB），也是断点续传的粒度
+    MODEL_DOWNLOAD_TIMEOUT: int = 60  # 单次连接/读取超时（秒）
+    MODEL_DOWNLOAD_RETRIES: int = 3  # 每个分片的重试次数
+
+    # In-memory model cache (openai_whisper engine)
+    WHISPER_MODEL_CACHE_MB: int = 0  # 常驻内存的模型总大小上限（MB），0 = 可用内存的一半
+    WHISPER_MODEL_CACHE_PREFETCH: bool = True  # 根据队列中排队的任务提前加载模型
+    WHISPER_MODEL_CACHE_LOOKAHEAD: int = 20  # 预取时查看的排队任务数
+
+    # Transformers engine batching
+    TRANSFORMERS_BATCH_SIZE: int = 8  # 每次前向计算最多处理的 30 秒窗口数
+    TRANSFORMERS_BATCH_WAIT_MS: int = 50  # 凑批时最多等待多久（毫秒）
+    TRANSFORMERS_WINDOW_SECONDS: int = 20  # 目标窗口时长（秒），在附近的停顿处切分
+
+    # Cascade mode: draft with the requested model, re-decode low-confidence spans with a larger one
+    CASCADE_MODEL: str = ""  # 默认的级联大模型（空 = 关闭，请求中的 cascade_model 可单独开启）
+    CASCADE_CONFIDENCE_THRESHOLD: float = 0.6  # 片段平均单词概率低于该值（或任一单词低于一半）时重转
+    CASCADE_SPAN_PADDING: float = 1.0  # 重转区间两侧额外带上的上下文（秒）
+    CASCADE_MAX_REFINE_RATIO: float = 0.5  # 需要重转的比例超过该值时，直接用大模型转录整个文件
+
+    # Media metadata cache
+    MEDIA_INFO_CACHE_TTL: int = 7 * 24 * 3600  # 按内容哈希缓存探测结果的时间（秒）
+
+    # Content-addressed result cache (same audio + decode parameters → cached subtitles)
+    RESULT_CACHE_ENABLED: bool = True  # 命中时 /upload/ 直接返回结果，不进入 Celery 队列
+    RESULT_CACHE_DIR: str = "cache/results"  # API 与 worker 共享的缓存目录
+    RESULT_CACHE_MAX_MB: int = 512  # 缓存目录上限，超出后按最近使用时间淘汰
+
+    # Decoded-audio cache (normalized 16 kHz mono WAV per content hash, reused by re-runs)
+    AUDIO_CACHE_ENABLED: bool = True
+    AUDIO_CACHE_DIR: str = "cache/audio"  # 与上传目录在同一台机器上，worker 之间共享
+    AUDIO_CACHE_MAX_MB: int = 4096  # 超出后按最近使用时间淘汰（1 小时音频约 110 MB）
+    AUDIO_CACHE_MIN_IDLE: int = 3600  # 最近多少秒内用过的音频不会被淘汰（可能仍有任务在读）
+
+    # Single-flight: identical uploads while a job is queued or running attach to it instead of re-running
+    SINGLE_FLIGHT_ENABLED: bool = True
+    SINGLE_FLIGHT_LEASE_SECONDS: int = 3600  # 租约在任务时间限制之外的余量（覆盖排队时间），worker 异常退出时到期释放
+
+    # Streaming decode (ffmpeg → pipe → ring buffer → chunks, no intermediate WAV)
+    STREAM_DECODE_ENABLED: bool = True  # 视频和非 WAV 音频边解码边转录
+    STREAM_BUFFER_SECONDS: int = 60  # 解码环形缓冲区容量（秒），写满时 ffmpeg 暂停
+
+    # Language-detection pre-pass for language=auto
+    LANGUAGE_DETECT_ENABLED: bool = True  # language=auto 时先检测语言，主转录使用明确的语言
+    LANGUAGE_DETECT_MODEL: str = "tiny"  # 检测使用的模型（必须是多语言模型）
+    LANGUAGE_DETECT_WINDOWS: int = 3  # 按 VAD 选取的语音窗口数
+    LANGUAGE_DETECT_WINDOW_SECONDS: float = 8.0  # 每个窗口的时长（总长应在 30 秒以内）
+    LANGUAGE_DETECT_MIN_PROBABILITY: float = 0.5  # 低于该概率时保持 auto
+    LANGUAGE_DETECT_ROUTE_EN: bool = True  # 英文音频改用对应的 .en 模型
+    LANGUAGE_DETECT_CACHE_TTL: int = 30 * 24 * 3600  # 按内容哈希缓存检测结果的时间（秒）
+
+    # Two-tier jobs: instant draft subtitles before the requested model finishes
+    DRAFT_MODEL: str = "tiny"  # 草稿字幕使用的模型
+    DRAFT_ENABLED: bool = False  # /upload/ 未指定 draft 字段时是否生成草稿字幕
+
+    # Synthetic engine / scripts/fake_whisper_cli.py (load testing without models)
+    SYNTHETIC_RTF_SCALE: float = 1.0  # 模拟耗时相对各模型典型实时率的倍数
+    SYNTHETIC_CPU_FRACTION: float = 1.0  # 模拟期间忙等占用 CPU 的比例（0–1）
+    SYNTHETIC_MEMORY_SCALE: float = 1.0  # 模拟常驻内存相对各模型典型占用的倍数
+    SYNTHETIC_FAILURE_RATE: float = 0.0  # 模拟失败的比例（按输入确定，可复现）
+    SYNTHETIC_LOAD_SECONDS: float = 0.5  # 模拟的模型加载时间（秒）
+    SYNTHETIC_SEED: int = 0  # 生成文本的随机种子
+
     # Subtitle generation settings
     MAX_SUBTITLE_DURATION: int = 4  # Maximum duration for a single subtitle entry (seconds)
     MAX_WORDS_PER_SUBTITLE: int = 8  # Maximum number of words per subtitle entry
@@ -313,6 +484,9 @@ class Settings(BaseSettings):
 
     # File upload and results directories
     UPLOAD_DIR: str = "uploads"
+    MAX_UPLOAD_MB: int = 4096  # 单个上传文件的大小上限，超出返回 413（0 为不限制）
+    UPLOAD_SESSION_CHUNK_MB: int = 16  # 可续传上传的默认分块大小
+    UPLOAD_SESSION_TTL: int = 24 * 3600  # 可续传上传会话无活动后保留的时间（秒）
     RESULTS_DIR: str = "results"
 
     class Config:
@@ -356,6 +530,9 @@ class Settings(BaseSettings):
             self.WHISPER_PROCESSORS = config["processors"]
             self.WHISPER_COMPUTE_TYPE = config["compute_type"]
         
+        # 有实测的主机配置时，用它代替上面的经验值
+        self._apply_host_profile()
+        
         # 根据部署模式调整路径
         self._adjust_paths_for_deployment()
     
@@ -440,11 +617,41 @@ class Settings(BaseSettings):
             }
         else:  # CPU
             return {
-                "threads": 0,  # 使用所有核心
+                "threads": 0,  # 由 cpu_planner 按物理核心和空闲容量为每个任务规划
                 "processors": min(cpu_count, 4),  # 限制最大进程数
                 "compute_type": "int8"  # CPU优化
             }
     
+    def _apply_host_profile(self):
+        """加载 autotune 生成的主机配置，覆盖线程数和并发数（环境变量中显式设置的除外）"""
+        profile_path = os.path.expanduser(self.HOST_PROFILE_PATH)
+        if not os.path.isfile(profile_path):
+            return
+        try:
+            with open(profile_path, "r", encoding="utf-8") as f:
+                profile = json.load(f)
+            recommended = profile["recommended"]
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"主机配置文件无效，使用默认配置: {profile_path} ({e})")
+            return
+        
+        self._host_profile = profile
+        overrides = {
+            "CPU_THREADS_PER_JOB": recommended.get("threads"),
+            "CPU_THREADS_LONG": recommended.get("long_threads"),
+            "WORKER_CONCURRENCY": recommended.get("worker_concurrency"),
+        }
+        for field, value in overrides.items():
+            if value and field not in self.model_fields_set:
+                setattr(self, field, int(value))
+        logger.info(f"已加载主机配置 {profile_path}: threads={self.CPU_THREADS_PER_JOB}, "
+                    f"long_threads={self.CPU_THREADS_LONG}, worker_concurrency={self.WORKER_CONCURRENCY}")
+    
+    @property
+    def host_profile(self) -> Optional[Dict[str, Any]]:
+        """autotune 生成的主机配置（不存在时为 None）"""
+        return self._host_profile
+    
     def _adjust_paths_for_deployment(self):
         """根据部署模式调整路径"""
         if self.DEPLOYMENT_MODE == "hybrid":
@@ -458,13 +665,13 @@ class Settings(BaseSettings):
                 self.MODEL_PATH = host_model_path
         
         elif self.DEPLOYMENT_MODE == "native":
-            # 本地模式 - 自动检测whisper命令路径
-            whisper_path = self._find_whisper_executable()
+            # 本地模式 - 使用（缓存的）自动检测结果
+            whisper_path = self._whisper_path
             if whisper_path:
                 self.WHISPER_CPP_PATH = whisper_path
             
             # 本地模式下尝试找到模型文件
-            model_path = self._find_model_file()
+            model_path = self._model_path
             if model_path:
                 self.MODEL_PATH = model_path
         
@@ -0,0 +1,112 @@
+"""
+Duration-based cost estimates, subprocess deadlines and Celery time limits
+"""
+import re
+import logging
+from typing import Dict, Optional
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+RTF_KEY = "whisper:rtf"
+
+# 进程内缓存的实测实时率，避免每次估算都访问 Redis
+_rtf_cache: Dict[str, float] = {}
+
+# 没有实测数据时，各引擎相对 whisper.cpp 的耗时倍数（CPU 上的经验值）
+ENGINE_RELATIVE_COST = {
+    "whisper_cpp": 1.0,
+    "openai_whisper": 4.0,
+    "transformers": 3.0,
+}
+
+
+def _rtf_key(model_name: str, engine: Optional[str] = None) -> str:
+    """Redis 中实时率的字段名；whisper.cpp 沿用单独的模型名，其他引擎加前缀"""
+    if engine in (None, "whisper_cpp"):
+        return model_name
+    return f"{engine}:{model_name}"
+
+
+def default_realtime_factor(model_name: str, engine: Optional[str] = None) -> float:
+    """
+    默认实时率（处理耗时 / 音频时长）：优先使用 autotune 在本机测得的值，
+    否则根据 SUPPORTED_MODELS 中的相对速度（如 "~16x"）推算
+    """
+    relative_cost = ENGINE_RELATIVE_COST.get(engine or "whisper_cpp", 1.0)
+    profile = settings.host_profile or {}
+    measured = profile.get("recommended", {}).get("per_model", {}).get(model_name, {}).get("realtime_factor")
+    if measured:
+        return float(measured) * relative_cost
+    speed = settings.SUPPORTED_MODELS.get(model_name, {}).get("speed", "")
+    match = re.search(r"([\d.]+)x", speed)
+    if match and float(match.group(1)) > 0:
+        return relative_cost / float(match.group(1))
+    return relative_cost
+
+
+def get_realtime_factor(model_name: str, engine: Optional[str] = None) -> float:
+    """优先使用 Redis 中记录的实测实时率，没有记录时使用默认值"""
+    key = _rtf_key(model_name, engine)
+    try:
+        from .redis_store import get_redis_client
+        value = get_redis_client().hget(RTF_KEY, key)
+        if value is not None:
+            _rtf_cache[key] = float(value)
+    except Exception as e:
+        logger.debug(f"Could not read measured RTF for {key}: {e}")
+    return _rtf_cache.get(key, default_realtime_factor(model_name, engine))
+
+
+def record_realtime_factor(model_name: str, realtime_factor: float, engine: Optional[str] = None):
+    """用指数滑动平均更新模型的实测实时率"""
+    if realtime_factor <= 0:
+        return
+    key = _rtf_key(model_name, engine)
+    previous = get_realtime_factor(model_name, engine)
+    alpha = settings.RTF_EWMA_ALPHA
+    updated = previous * (1 - alpha) + realtime_factor * alpha if key in _rtf_cache else realtime_factor
+    _rtf_cache[key] = updated
+    try:
+        from .redis_store import get_redis_client
+        get_redis_client().hset(RTF_KEY, key, f"{updated:.4f}")
+    except Exception as e:
+        logger.debug(f"Could not store measured RTF for {key}: {e}")
+
+
+def estimate_processing_seconds(model_name: str, duration: Optional[float],
+                                engine: Optional[str] = None) -> Optional[float]:
+    """预估转录耗时（秒）：时长 × 实时率 + 模型加载开销"""
+    if not duration:
+        return None
+    return duration * get_realtime_factor(model_name, engine) + settings.TIMEOUT_MODEL_LOAD_SECONDS
+
+
+def subprocess_timeout(model_name: str, duration: Optional[float]) -> float:
+    """whisper 子进程的超时时间，未知时长时使用固定的默认值"""
+    estimate = estimate_processing_seconds(model_name, duration)
+    if estimate is None:
+        return settings.WHISPER_DEFAULT_TIMEOUT
+    return max(settings.TIMEOUT_MIN_SECONDS, estimate * settings.TIMEOUT_SAFETY_FACTOR)
+
+
+def celery_time_limits(model_name: str, duration: Optional[float], engine: Optional[str] = None) -> Dict[str, int]:
+    """单个任务的 Celery 软/硬时间限制（用于 apply_async）"""
+    estimate = estimate_processing_seconds(model_name, duration, engine)
+    if estimate is None:
+        return {}
+    # 额外留出解码、VAD 和字幕生成的时间
+    soft_limit = estimate * settings.TIMEOUT_SAFETY_FACTOR + settings.TASK_TIME_LIMIT_MIN
+    soft_limit = int(min(soft_limit, settings.TASK_TIME_LIMIT_MAX))
+    return {"soft_time_limit": soft_limit, "time_limit": soft_limit + 300}
+
+
+def estimate_job(model_name: str, duration: Optional[float], engine: Optional[str] = None) -> Dict[str, Optional[float]]:
+    """供 API 和调度使用的任务成本信息"""
+    estimate = estimate_processing_seconds(model_name, duration, engine)
+    return {
+        "duration": duration,
+        "expected_cost": round(estimate, 1) if estimate is not None else None,
+        "realtime_factor": round(get_realtime_factor(model_name, engine), 4),
+    }
@@ -0,0 +1,303 @@
+"""
+CPU topology-aware thread and affinity planning for whisper.cpp jobs
+"""
+import os
+import json
+import time
+import uuid
+import fcntl
+import logging
+from pathlib import Path
+from functools import lru_cache
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+SYS_CPU_DIR = Path("/sys/devices/system/cpu")
+SYS_NODE_DIR = Path("/sys/devices/system/node")
+
+
+def _parse_cpu_list(text: str) -> List[int]:
+    """解析 "0-3,8,10-11" 形式的 CPU 列表"""
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+@lru_cache(maxsize=1)
+def cpu_topology() -> Dict[str, Any]:
+    """
+    Physical cores and NUMA nodes of the CPUs this process may run on.
+
+    Each physical core is represented by its lowest-numbered logical CPU;
+    SMT siblings are not counted, because whisper.cpp gains little from
+    hyper-threads and loses a lot when two threads share one core.
+    """
+    try:
+        allowed = sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        allowed = list(range(os.cpu_count() or 1))
+
+    cores: Dict[int, List[int]] = {}  # 代表 CPU -> 同一物理核心上的所有逻辑 CPU
+    seen = set()
+    for cpu in allowed:
+        if cpu in seen:
+            continue
+        siblings_file = SYS_CPU_DIR / f"cpu{cpu}" / "topology" / "thread_siblings_list"
+        try:
+            siblings = [c for c in _parse_cpu_list(siblings_file.read_text()) if c in allowed]
+        except (OSError, ValueError):
+            siblings = [cpu]
+        siblings = siblings or [cpu]
+        seen.update(siblings)
+        cores[min(siblings)] = siblings
+
+    nodes: Dict[int, List[int]] = {}
+    if SYS_NODE_DIR.is_dir():
+        for node_dir in sorted(SYS_NODE_DIR.glob("node[0-9]*")):
+            try:
+                node_cpus = set(_parse_cpu_list((node_dir / "cpulist").read_text()))
+            except (OSError, ValueError):
+                continue
+            node_cores = [core for core in cores if core in node_cpus]
+            if node_cores:
+                nodes[int(node_dir.name[4:])] = node_cores
+    if not nodes:
+        nodes = {0: list(cores)}
+
+    return {
+        "logical_cpus": len(allowed),
+        "physical_cores": len(cores),
+        "cores": cores,
+        "numa_nodes": nodes,
+    }
+
+
+def recommended_worker_concurrency() -> int:
+    """按物理核心数推算 Celery worker 并发数（每个任务平均使用 CPU_THREADS_PER_JOB 个核心）"""
+    physical_cores = cpu_topology()["physical_cores"]
+    return max(1, physical_cores // max(1, settings.CPU_THREADS_PER_JOB))
+
+
+class CpuPlan:
+    """Thread count and optional CPU set reserved for one whisper job"""
+
+    def __init__(self, threads: int, cpus: List[int], numa_node: Optional[int], reason: str,
+                 free_cores: int, load: float, reservation_id: Optional[str] = None):
+        self.threads = threads
+        self.cpus = cpus
+        self.numa_node = numa_node
+        self.reason = reason
+        self.free_cores = free_cores
+        self.load = load
+        self.reservation_id = reservation_id
+
+    @property
+    def affinity(self) -> Optional[List[int]]:
+        """启用绑核时返回要绑定的 CPU 列表（包含 SMT 兄弟线程），否则为 None"""
+        if not settings.CPU_AFFINITY_ENABLED or not self.cpus:
+            return None
+        cores = cpu_topology()["cores"]
+        return sorted(cpu for core in self.cpus for cpu in cores.get(core, [core]))
+
+    def split(self, parts: int) -> List["CpuPlan"]:
+        """把预留的核心平均分给多个并行进程（长音频分块转录）"""
+        parts = max(1, min(parts, self.threads))
+        plans = []
+        for index in range(parts):
+            cpus = self.cpus[index::parts]
+            threads = max(1, self.threads // parts)
+            plans.append(CpuPlan(threads, cpus, self.numa_node, self.reason, self.free_cores, self.load))
+        return plans
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "threads": self.threads,
+            "cpus": self.cpus,
+            "pinned": self.affinity is not None,
+            "numa_node": self.numa_node,
+            "free_cores": self.free_cores,
+            "load": round(self.load, 2),
+            "reason": self.reason,
+        }
+
+
+class CpuPlanner:
+    """
+    Decides per-job whisper thread counts from the host topology and the
+    capacity that is actually free.
+
+    Reservations are recorded in a host-wide ledger guarded by flock, so all
+    Celery worker children (and chunk sub-processes) see each other's cores
+    and the host is not oversubscribed.
+    """
+
+    def __init__(self):
+        self.state_dir = Path(settings.CPU_LEDGER_DIR).expanduser()
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        self.ledger_file = self.state_dir / "cpu-ledger.json"
+
+    @contextmanager
+    def _locked_ledger(self):
+        """以独占锁读写主机级核心预留表"""
+        with open(self.state_dir / "cpu-ledger.lock", "a+") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                ledger = {}
+                if self.ledger_file.exists():
+                    try:
+                        ledger = json.loads(self.ledger_file.read_text() or "{}")
+                    except json.JSONDecodeError:
+                        logger.warning(f"Corrupted CPU ledger, resetting: {self.ledger_file}")
+                        ledger = {}
+                # 移除已退出进程的预留
+                ledger = {key: entry for key, entry in ledger.items() if _pid_alive(entry["pid"])}
+                yield ledger
+                tmp_file = self.ledger_file.with_suffix(".tmp")
+                tmp_file.write_text(json.dumps(ledger, indent=2))
+                os.replace(tmp_file, self.ledger_file)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def desired_threads(audio_duration: Optional[float]) -> int:
+        """
+        短音频用较少线程（可以多个任务并行），长音频用较多线程
+        （whisper.cpp 超过 8 线程后收益很小）
+        """
+        if audio_duration is None:
+            return settings.CPU_THREADS_PER_JOB
+        if audio_duration <= settings.CPU_SHORT_CLIP_SECONDS:
+            return settings.CPU_THREADS_SHORT
+        if audio_duration >= settings.CPU_LONG_CLIP_SECONDS:
+            return settings.CPU_THREADS_LONG
+        return settings.CPU_THREADS_PER_JOB
+
+    def plan(self, audio_duration: Optional[float] = None, parallel: int = 1,
+             ledger: Optional[Dict[str, Any]] = None) -> CpuPlan:
+        """
+        Pick a thread count and a set of physical cores for a job.
+
+        parallel 是该任务内部并行的 whisper 进程数（分块转录），每个进程至少分到
+        CPU_THREADS_SHORT 个线程。
+        """
+        topology = cpu_topology()
+        ledger = ledger or {}
+        reserved = {core for entry in ledger.values() for core in entry["cpus"]}
+        reserved_threads = sum(entry["threads"] for entry in ledger.values())
+
+        # 不在预留表中的负载（其他程序、未经规划的进程）也要扣除
+        try:
+            load = os.getloadavg()[0]
+        except OSError:
+            load = 0.0
+        external_load = max(0.0, load - reserved_threads)
+        free_by_ledger = [core for core in topology["cores"] if core not in reserved]
+        free_capacity = max(0, min(len(free_by_ledger), round(topology["physical_cores"] - external_load - reserved_threads)))
+
+        desired = self.desired_threads(audio_duration)
+        if parallel > 1:
+            desired = max(desired, parallel * settings.CPU_THREADS_SHORT)
+        threads = max(1, min(desired, free_capacity))
+        if free_capacity == 0:
+            reason = "host saturated, running single-threaded"
+        elif threads < desired:
+            reason = f"capped by free capacity ({free_capacity} of {topology['physical_cores']} cores)"
+        else:
+            reason = f"sized for {'unknown' if audio_duration is None else f'{audio_duration:.0f}s'} audio"
+
+        # 优先在空闲核心最多的 NUMA 节点上分配，避免跨节点访问内存
+        numa_node = None
+        cpus: List[int] = []
+        if free_by_ledger:
+            free_per_node = {
+                node: [core for core in node_cores if core not in reserved]
+                for node, node_cores in topology["numa_nodes"].items()
+            }
+            numa_node = max(free_per_node, key=lambda node: len(free_per_node[node]))
+            cpus = free_per_node[numa_node][:threads]
+            if len(cpus) < threads:
+                # 单个节点放不下时再从其他节点补足
+                others = [core for core in free_by_ledger if core not in cpus]
+                cpus += others[:threads - len(cpus)]
+                numa_node = None
+
+        return CpuPlan(threads, cpus, numa_node, reason, free_capacity, load)
+
+    @contextmanager
+    def reserve(self, audio_duration: Optional[float] = None, parallel: int = 1, job_id: str = ""):
+        """规划并在预留表中登记核心，任务结束后释放"""
+        if settings.WHISPER_THREADS > 0:
+            # 显式配置了线程数时不做规划
+            yield CpuPlan(settings.WHISPER_THREADS, [], None, "fixed by WHISPER_THREADS", 0, 0.0)
+            return
+
+        reservation_id = uuid.uuid4().hex
+        with self._locked_ledger() as ledger:
+            plan = self.plan(audio_duration, parallel=parallel, ledger=ledger)
+            plan.reservation_id = reservation_id
+            ledger[reservation_id] = {
+                "pid": os.getpid(),
+                "job_id": job_id,
+                "threads": plan.threads,
+                "cpus": plan.cpus,
+                "since": time.time(),
+            }
+        logger.info(f"🧮 CPU plan for {job_id or 'job'}: {plan.threads} threads on cores {plan.cpus} "
+                    f"(node {plan.numa_node}, load {plan.load:.2f}) - {plan.reason}")
+        try:
+            yield plan
+        finally:
+            with self._locked_ledger() as ledger:
+                ledger.pop(reservation_id, None)
+
+    def status(self) -> Dict[str, Any]:
+        """当前拓扑和预留情况（用于健康检查和排查吞吐问题）"""
+        topology = cpu_topology()
+        with self._locked_ledger() as ledger:
+            reservations = list(ledger.values())
+        try:
+            load = os.getloadavg()
+        except OSError:
+            load = (0.0, 0.0, 0.0)
+        return {
+            "logical_cpus": topology["logical_cpus"],
+            "physical_cores": topology["physical_cores"],
+            "numa_nodes": {str(node): cores for node, cores in topology["numa_nodes"].items()},
+            "load_average": [round(value, 2) for value in load],
+            "reserved_threads": sum(entry["threads"] for entry in reservations),
+            "reservations": reservations,
+            "worker_concurrency": settings.WORKER_CONCURRENCY or recommended_worker_concurrency(),
+        }
+
+
+# Global instance
+cpu_planner = None
+
+
+def get_cpu_planner() -> CpuPlanner:
+    """Get global CPU planner instance"""
+    global cpu_planner
+    if cpu_planner is None:
+        cpu_planner = CpuPlanner()
+    return cpu_planner
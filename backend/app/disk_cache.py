@@ -0,0 +1,95 @@
+"""
+Size-bounded content-addressed directories shared by the API and workers
+
+Entries live under <cache_dir>/<key[:2]>/<key><SUFFIX>; a read refreshes
+the entry's mtime, and eviction removes the oldest entries until the
+directory fits in max_bytes. ResultCache and AudioCache build their
+get / put on top of this.
+"""
+import os
+import time
+import fcntl
+import logging
+from pathlib import Path
+from typing import Dict, Any, List, Iterable
+
+logger = logging.getLogger(__name__)
+
+
+class DiskLRUCache:
+    """
+    Sharded cache directory with least-recently-used eviction
+
+    Eviction holds an flock so concurrent API and worker processes do not
+    race, never removes the keys it is told to keep, and leaves entries
+    used within the last min_idle seconds alone (another process may still
+    be reading them), even if the directory stays over budget.
+    """
+
+    SUFFIX = ""
+
+    def __init__(self, cache_dir: str, max_bytes: int, min_idle: int = 0):
+        self.cache_dir = Path(cache_dir).expanduser()
+        self.max_bytes = max_bytes
+        self.min_idle = min_idle
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}{self.SUFFIX}"
+
+    def _touch(self, path: Path) -> bool:
+        try:
+            os.utime(path)  # 最近使用时间，供 LRU 淘汰
+            return True
+        except OSError:
+            return False
+
+    def _entries(self) -> List[os.DirEntry]:
+        entries = []
+        for shard in os.scandir(self.cache_dir):
+            if shard.is_dir():
+                entries.extend(entry for entry in os.scandir(shard.path) if entry.name.endswith(self.SUFFIX))
+        return entries
+
+    def evict(self, keep: Iterable[str] = ()):
+        """删除最久未使用的条目，直到总大小不超过上限（keep 中的键和 min_idle 秒内用过的条目除外）"""
+        if not self.max_bytes or not self.cache_dir.exists():
+            return
+        protected = {f"{key}{self.SUFFIX}" for key in keep}
+        with open(self.cache_dir / ".lock", "a+") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                entries = []
+                for entry in self._entries():
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.name, entry.path))
+                total = sum(size for _, size, _, _ in entries)
+                for mtime, size, name, path in sorted(entries):
+                    if total <= self.max_bytes:
+                        break
+                    if name in protected or now - mtime < self.min_idle:
+                        continue
+                    try:
+                        os.remove(path)
+                        total -= size
+                        logger.info(f"🧹 Evicted cache entry {name[:12]} from {self.cache_dir}")
+                    except OSError:
+                        pass
+                if total > self.max_bytes:
+                    logger.debug(f"{self.cache_dir} is {total} bytes, over budget with only recently used entries")
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def status(self) -> Dict[str, Any]:
+        if not self.cache_dir.exists():
+            return {"entries": 0, "bytes": 0, "max_bytes": self.max_bytes}
+        sizes = []
+        for entry in self._entries():
+            try:
+                sizes.append(entry.stat().st_size)
+            except OSError:
+                pass
+        return {"entries": len(sizes), "bytes": sum(sizes), "max_bytes": self.max_bytes}
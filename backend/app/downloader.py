@@ -0,0 +1,278 @@
+"""
+Resumable parallel-range downloads for model files
+"""
+import os
+import re
+import json
+import time
+import fcntl
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List, Set
+
+import requests
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+READ_BUFFER = 1024 * 1024
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+class DownloadError(RuntimeError):
+    """Raised when a file cannot be downloaded or fails verification"""
+
+
+class RangeNotSupported(DownloadError):
+    """The server advertised Accept-Ranges but answered a range request with the whole file"""
+
+
+def _probe(session: requests.Session, url: str) -> Dict[str, Any]:
+    """
+    HEAD 请求获取大小、是否支持 Range 以及校验和
+
+    Hugging Face 的 resolve 地址先 302 到 CDN，LFS 文件的 SHA-256 在第一跳的
+    X-Linked-Etag 头里，所以要查看重定向链上的每个响应。
+    """
+    response = session.head(url, allow_redirects=True, timeout=settings.MODEL_DOWNLOAD_TIMEOUT)
+    response.raise_for_status()
+    info = {"url": response.url, "size": None, "ranges": False, "sha256": None, "etag": None}
+    for hop in list(response.history) + [response]:
+        headers = hop.headers
+        linked_etag = headers.get("x-linked-etag", "").strip('"')
+        if SHA256_PATTERN.match(linked_etag):
+            info["sha256"] = linked_etag
+        if headers.get("x-linked-size") and info["size"] is None:
+            info["size"] = int(headers["x-linked-size"])
+    headers = response.headers
+    if headers.get("content-length") and not headers.get("content-encoding"):
+        info["size"] = int(headers["content-length"])
+    info["ranges"] = headers.get("accept-ranges", "").lower() == "bytes"
+    info["etag"] = headers.get("etag")
+    return info
+
+
+def _sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(4 * READ_BUFFER), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class RangeDownload:
+    """
+    Downloads one file with several HTTP range requests in parallel.
+
+    Ranges are written in place with pwrite into a preallocated `.part` file;
+    finished range indices are recorded in a `.part.json` sidecar, so an
+    interrupted download resumes where it stopped instead of starting over.
+    """
+
+    def __init__(self, url: str, dest: Path, info: Dict[str, Any], connections: int, range_size: int):
+        self.url = info["url"]
+        self.original_url = url
+        self.dest = dest
+        self.size = info["size"]
+        self.etag = info["etag"]
+        self.connections = connections
+        self.range_size = range_size
+        self.part_file = dest.with_name(dest.name + ".part")
+        self.state_file = dest.with_name(dest.name + ".part.json")
+        self._state_lock = threading.Lock()
+        self._done: Set[int] = set()
+        self._downloaded = 0
+        self._last_log = 0.0
+
+    @property
+    def n_ranges(self) -> int:
+        return (self.size + self.range_size - 1) // self.range_size
+
+    def _load_state(self):
+        """读取断点信息；文件大小、ETag 或分片大小变化时从头开始"""
+        if not (self.part_file.exists() and self.state_file.exists()):
+            return
+        try:
+            state = json.loads(self.state_file.read_text())
+        except (OSError, ValueError):
+            return
+        if (state.get("size") == self.size and state.get("etag") == self.etag
+                and state.get("range_size") == self.range_size
+                and self.part_file.stat().st_size == self.size):
+            self._done = set(state.get("done", []))
+            self._downloaded = sum(self._range_length(index) for index in self._done)
+            logger.info(f"Resuming {self.dest.name}: {self._downloaded / 1024 / 1024:.0f} MB already downloaded")
+
+    def _save_state(self):
+        tmp_file = self.state_file.with_suffix(".tmp")
+        tmp_file.write_text(json.dumps({
+            "url": self.original_url,
+            "size": self.size,
+            "etag": self.etag,
+            "range_size": self.range_size,
+            "done": sorted(self._done),
+        }))
+        os.replace(tmp_file, self.state_file)
+
+    def _range_length(self, index: int) -> int:
+        return min(self.range_size, self.size - index * self.range_size)
+
+    def _fetch_range(self, index: int, fd: int, session_factory):
+        start = index * self.range_size
+        end = start + self._range_length(index) - 1
+        session = session_factory()
+        for attempt in range(settings.MODEL_DOWNLOAD_RETRIES + 1):
+            offset = start
+            try:
+                with session.get(self.url, headers={"Range": f"bytes={start}-{end}"}, stream=True,
+                                 timeout=settings.MODEL_DOWNLOAD_TIMEOUT) as response:
+                    if response.status_code == 200:
+                        raise RangeNotSupported(f"{self.url} ignored the range request (HTTP 200)")
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        raise DownloadError(f"unexpected response to range request (HTTP {response.status_code})")
+                    for chunk in response.iter_content(chunk_size=READ_BUFFER):
+                        os.pwrite(fd, chunk, offset)
+                        offset += len(chunk)
+                if offset != end + 1:
+                    raise DownloadError(f"range {start}-{end} ended at {offset}")
+                break
+            except RangeNotSupported:
+                raise
+            except (requests.RequestException, DownloadError) as e:
+                if attempt >= settings.MODEL_DOWNLOAD_RETRIES:
+                    raise
+                logger.warning(f"Range {index} of {self.dest.name} failed ({e}), retrying")
+                time.sleep(min(10, 2 ** attempt))
+
+        with self._state_lock:
+            self._done.add(index)
+            self._downloaded += end - start + 1
+            self._save_state()
+            now = time.time()
+            if now - self._last_log > 5:
+                self._last_log = now
+                logger.info(f"Download progress {self.dest.name}: {self._downloaded / self.size * 100:.1f}%")
+
+    def run(self):
+        self._load_state()
+        pending = [index for index in range(self.n_ranges) if index not in self._done]
+
+        fd = os.open(self.part_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != self.size:
+                os.ftruncate(fd, self.size)
+            local = threading.local()
+
+            def session_factory() -> requests.Session:
+                if not hasattr(local, "session"):
+                    local.session = requests.Session()
+                return local.session
+
+            with ThreadPoolExecutor(max_workers=max(1, min(self.connections, len(pending) or 1))) as executor:
+                futures = [executor.submit(self._fetch_range, index, fd, session_factory) for index in pending]
+                for future in futures:
+                    future.result()
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def _stream_download(session: requests.Session, url: str, part_file: Path):
+    """服务器不支持 Range 时的单连接下载（无法断点续传）"""
+    with session.get(url, stream=True, timeout=settings.MODEL_DOWNLOAD_TIMEOUT) as response:
+        response.raise_for_status()
+        with open(part_file, "wb") as f:
+            for chunk in response.iter_content(chunk_size=READ_BUFFER):
+                f.write(chunk)
+
+
+def download_file(url: str, dest: Path, expected_sha256: Optional[str] = None,
+                  connections: Optional[int] = None) -> str:
+    """
+    Download url to dest and return its SHA-256.
+
+    Uses parallel range requests when the server supports them, resumes from
+    an earlier partial download, and verifies the checksum (the expected one,
+    or the one advertised by the server) before moving the file into place.
+    Concurrent callers on the same host wait for a single download via flock.
+    """
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    connections = connections or settings.MODEL_DOWNLOAD_CONNECTIONS
+    range_size = settings.MODEL_DOWNLOAD_RANGE_MB * 1024 * 1024
+
+    with open(dest.with_name(dest.name + ".lock"), "a+") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if dest.exists():
+                # 另一个 worker 刚刚下载完成
+                return _sha256_file(dest)
+
+            start_time = time.time()
+            session = requests.Session()
+            info = _probe(session, url)
+            expected = expected_sha256 or info["sha256"]
+            download = RangeDownload(url, dest, info, connections, range_size)
+
+            if info["size"] and info["ranges"]:
+                logger.info(f"Downloading {dest.name} ({info['size'] / 1024 / 1024:.0f} MB) "
+                            f"with {connections} connections from {info['url']}")
+                try:
+                    download.run()
+                except RangeNotSupported as e:
+                    # 声明支持 Range 却返回整个文件（部分代理和镜像如此），改用单连接
+                    logger.warning(f"{e}; downloading {dest.name} on a single connection")
+                    download.state_file.unlink(missing_ok=True)
+                    _stream_download(session, url, download.part_file)
+            else:
+                logger.info(f"Downloading {dest.name} on a single connection from {info['url']}")
+                _stream_download(session, url, download.part_file)
+
+            if info["size"] and download.part_file.stat().st_size != info["size"]:
+                raise DownloadError(f"size mismatch for {dest.name}: "
+                                    f"{download.part_file.stat().st_size} != {info['size']}")
+            digest = _sha256_file(download.part_file)
+            if expected and digest != expected:
+                # 校验失败的数据不能用于续传
+                download.part_file.unlink(missing_ok=True)
+                download.state_file.unlink(missing_ok=True)
+                raise DownloadError(f"checksum mismatch for {dest.name}: {digest} != {expected}")
+
+            os.replace(download.part_file, dest)
+            download.state_file.unlink(missing_ok=True)
+            elapsed = time.time() - start_time
+            size_mb = dest.stat().st_size / 1024 / 1024
+            logger.info(f"Downloaded {dest.name}: {size_mb:.0f} MB in {elapsed:.1f}s "
+                        f"({size_mb / max(elapsed, 1e-6):.1f} MB/s), sha256 {digest[:12]}…"
+                        f"{'' if expected else ' (unverified: no checksum available)'}")
+            return digest
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def model_sources(filename: str, upstream_url: str) -> List[str]:
+    """下载地址列表：配置了镜像（或对等节点）时优先使用，失败后回退到上游"""
+    sources = []
+    if settings.MODEL_MIRROR_URL:
+        sources.append(f"{settings.MODEL_MIRROR_URL.rstrip('/')}/{filename}")
+    if not settings.MODEL_MIRROR_ONLY or not sources:
+        sources.append(upstream_url)
+    return sources
+
+
+def download_model_file(filename: str, upstream_url: str, dest: Path,
+                        expected_sha256: Optional[str] = None) -> str:
+    """依次尝试镜像和上游地址下载模型文件，返回 SHA-256"""
+    errors = []
+    for url in model_sources(filename, upstream_url):
+        try:
+            return download_file(url, dest, expected_sha256=expected_sha256)
+        except Exception as e:
+            logger.warning(f"Download of {filename} from {url} failed: {e}")
+            errors.append(f"{url}: {e}")
+    raise DownloadError("; ".join(errors))
@@ -0,0 +1,492 @@
+"""
+Pluggable transcription engines behind one interface
+
+Every engine takes a file path or a 16 kHz mono PCM buffer and returns the
+same structure:
+
+    {
+        "text": str,
+        "segments": [{"start", "end", "text", "words": [{"start", "end", "word", "probability"}]}],
+        "language": str,
+        "transcription_time": float,
+        "transcription_time_formatted": str,
+        "engine": str,
+        "model": str,
+    }
+
+The engine is picked per request (transcription_params["engine"]) or per
+worker (TRANSCRIPTION_ENGINE).
+"""
+import time
+import logging
+import tempfile
+import importlib.util
+import importlib.metadata
+from pathlib import Path
+from datetime import timedelta
+from typing import Optional, Dict, Any, List, Union, Type
+
+import numpy as np
+
+from .config import settings
+from .audio import TARGET_SAMPLE_RATE, write_pcm16_wav, read_pcm16_wav, is_normalized_wav
+from .cost_model import estimate_processing_seconds, record_realtime_factor
+from .micro_batch import MicroBatcher
+
+logger = logging.getLogger(__name__)
+
+AudioInput = Union[str, Path, np.ndarray]
+
+
+def normalize_segments(segments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """统一片段结构：秒为单位的 float 时间戳、去掉首尾空白、丢弃空文本"""
+    normalized = []
+    for segment in segments:
+        text = (segment.get("text") or "").strip()
+        if not text:
+            continue
+        start = float(segment.get("start") or 0.0)
+        end = float(segment.get("end") if segment.get("end") is not None else start)
+        normalized.append({
+            "start": start,
+            "end": max(start, end),
+            "text": text,
+            "words": [
+                {
+                    "start": float(word.get("start") or 0.0),
+                    "end": float(word.get("end") or 0.0),
+                    "word": (word.get("word") or "").strip(),
+                    "probability": float(word.get("probability", 1.0)),
+                }
+                for word in segment.get("words", [])
+            ],
+        })
+    return normalized
+
+
+class TranscriptionEngine:
+    """
+    Base class for transcription engines
+
+    Subclasses implement is_available(), load() and _transcribe(); the base
+    class handles PCM/path conversion, timing, result normalization and
+    real-time-factor bookkeeping so results are comparable across engines.
+    """
+
+    name: str = ""
+    accepts_pcm: bool = False  # 是否可以直接处理内存中的 PCM 数组
+
+    @classmethod
+    def is_available(cls) -> bool:
+        raise NotImplementedError
+
+    def load(self, model_name: Optional[str] = None):
+        """加载（或预热）模型"""
+        raise NotImplementedError
+
+    def capabilities(self) -> Dict[str, Any]:
+        """引擎支持的功能，供路由和 /engines 使用"""
+        return {
+            "pcm_input": self.accepts_pcm,
+            "word_timestamps": False,
+            "translate": True,
+            "progress": False,
+            "parallel_chunks": False,
+            "max_parallel_chunks": None,  # 同时运行的分块数上限（None 为不限制）
+            "threads": False,
+            "confidence": False,  # 结果中的单词带有可信的 probability（级联模式依赖）
+            "models": list(settings.SUPPORTED_MODELS.keys()),
+        }
+
+    def version(self) -> str:
+        """引擎实现的版本，作为结果缓存键的一部分（升级引擎后旧结果自动失效）"""
+        return self.name
+
+    def cost(self, model_name: str, duration: Optional[float]) -> Optional[float]:
+        """预估处理 duration 秒音频的耗时（秒）"""
+        return estimate_processing_seconds(model_name, duration, self.name)
+
+    def transcribe(self, audio: AudioInput, model_name: Optional[str] = None, language: Optional[str] = None,
+                   task_type: Optional[str] = None, **options) -> Dict[str, Any]:
+        """
+        Transcribe a file path or a 16 kHz mono PCM buffer (int16 or float32)
+
+        options 是引擎相关的可选参数（threads、output_dir、progress_callback、
+        affinity、timeout、record_rtf），引擎不支持的参数会被忽略。
+        """
+        final_model_name = model_name or settings.MODEL_NAME
+        start_time = time.time()
+        temp_dir = None
+        try:
+            if isinstance(audio, np.ndarray) and not self.accepts_pcm:
+                temp_dir = tempfile.TemporaryDirectory(prefix=f"audio2sub_{self.name}_", dir=options.get("output_dir"))
+                audio_path = Path(temp_dir.name) / "input.wav"
+                write_pcm16_wav(audio_path, audio, TARGET_SAMPLE_RATE)
+                audio = str(audio_path)
+            elif isinstance(audio, Path):
+                audio = str(audio)
+
+            result = self._transcribe(audio, final_model_name, language, task_type, **options)
+        finally:
+            if temp_dir is not None:
+                temp_dir.cleanup()
+
+        transcription_time = time.time() - start_time
+        duration = self._audio_duration(audio)
+        if duration and options.get("record_rtf", True) and not result.get("_records_rtf"):
+            record_realtime_factor(final_model_name, transcription_time / duration, self.name)
+        result.pop("_records_rtf", None)
+
+        result.update({
+            "segments": normalize_segments(result.get("segments", [])),
+            "transcription_time": result.get("transcription_time", transcription_time),
+            "transcription_time_formatted": str(timedelta(seconds=int(result.get("transcription_time", transcription_time)))),
+            "language": result.get("language") or "unknown",
+            "engine": self.name,
+            "model": final_model_name,
+        })
+        result["text"] = result.get("text") or " ".join(seg["text"] for seg in result["segments"])
+        return result
+
+    def _transcribe(self, audio: Union[str, np.ndarray], model_name: str, language: Optional[str],
+                    task_type: Optional[str], **options) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def detect_language(self, audio_path: str, model_name: str) -> Dict[str, Any]:
+        """
+        Spoken language of a short clip: {"language", "probability"}
+
+        默认实现用 language=auto 转录整段（片段很短），引擎有专门的检测方式时覆盖。
+        """
+        result = self.transcribe(audio_path, model_name, language="auto", task_type="transcribe")
+        return {"language": result.get("language"), "probability": None}
+
+    @staticmethod
+    def _audio_duration(audio: Union[str, np.ndarray]) -> Optional[float]:
+        if isinstance(audio, np.ndarray):
+            return len(audio) / TARGET_SAMPLE_RATE
+        if is_normalized_wav(audio):
+            from .audio import wav_duration
+            return wav_duration(audio)
+        return None
+
+
+# 引擎注册表：名称 -> 引擎类
+ENGINES: Dict[str, Type[TranscriptionEngine]] = {}
+
+
+def register_engine(engine_class: Type[TranscriptionEngine]) -> Type[TranscriptionEngine]:
+    """注册引擎（可作为装饰器使用）"""
+    ENGINES[engine_class.name] = engine_class
+    return engine_class
+
+
+@register_engine
+class WhisperCppEngine(TranscriptionEngine):
+    """whisper.cpp through WhisperManager (CLI or persistent whisper-server)"""
+
+    name = "whisper_cpp"
+
+    def __init__(self):
+        from .whisper_manager import get_whisper_manager
+        self.manager = get_whisper_manager()
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return True  # whisper.cpp 缺失时 WhisperManager 自己会退化为模拟结果
+
+    def load(self, model_name: Optional[str] = None):
+        model_name = model_name or settings.MODEL_NAME
+        self.manager._download_model(model_name)
+        self.manager.prefetch_model(model_name)
+
+    def capabilities(self) -> Dict[str, Any]:
+        capabilities = super().capabilities()
+        # CLI 模式每个分块是独立的进程；常驻服务模式下分块只能分给 WHISPER_SERVER_INSTANCES 个进程
+        server_instances = settings.WHISPER_SERVER_INSTANCES if self.manager.whisper_server_path else None
+        capabilities.update({
+            "word_timestamps": True,
+            "progress": self.manager.supports("-pp"),
+            "parallel_chunks": server_instances is None or server_instances > 1,
+            "max_parallel_chunks": server_instances,
+            "threads": True,
+            "confidence": self.manager.supports("-ojf"),
+            "engine_mode": settings.WHISPER_ENGINE_MODE,
+            "binary": self.manager.whisper_cpp_path,
+        })
+        return capabilities
+
+    def version(self) -> str:
+        from .capabilities import file_fingerprint
+        binary = self.manager.whisper_cpp_path or self.manager.whisper_server_path
+        fingerprint = file_fingerprint(binary, with_hash=False) if binary else None
+        if fingerprint is None:
+            return "whisper.cpp:mock"  # 没有 whisper.cpp 时输出模拟结果
+        return f"whisper.cpp:{fingerprint['size']}:{fingerprint['mtime_ns']}"
+
+    def _transcribe(self, audio, model_name, language, task_type, **options):
+        result = self.manager.transcribe(audio, model_name=model_name, language=language, task_type=task_type,
+                                         **options)
+        # WhisperManager 已按模型记录实时率（也用于子进程超时）
+        result["_records_rtf"] = True
+        return result
+
+    def detect_language(self, audio_path: str, model_name: str) -> Dict[str, Any]:
+        if self.manager.whisper_cpp_path and self.manager.supports("-dl"):
+            return self.manager.detect_language(audio_path, model_name)
+        return super().detect_language(audio_path, model_name)
+
+
+@register_engine
+class OpenAIWhisperEngine(TranscriptionEngine):
+    """openai-whisper (PyTorch) through whisper_manager_new.WhisperManager"""
+
+    name = "openai_whisper"
+    accepts_pcm = True
+
+    def __init__(self):
+        from .whisper_manager_new import get_whisper_manager as get_openai_whisper_manager
+        self.manager = get_openai_whisper_manager()
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return importlib.util.find_spec("whisper") is not None
+
+    def load(self, model_name: Optional[str] = None):
+        self.manager.load_model(model_name)
+
+    def capabilities(self) -> Dict[str, Any]:
+        capabilities = super().capabilities()
+        capabilities["word_timestamps"] = True
+        capabilities["confidence"] = settings.WHISPER_WORD_TIMESTAMPS
+        capabilities["model_cache"] = self.manager.model_cache.status()
+        return capabilities
+
+    def version(self) -> str:
+        return f"openai-whisper:{importlib.metadata.version('openai-whisper')}"
+
+    def _transcribe(self, audio, model_name, language, task_type, **options):
+        if isinstance(audio, np.ndarray):
+            audio = _to_float32(audio)
+        return self.manager.transcribe(audio, model_name=model_name, language=language, task_type=task_type)
+
+
+def _to_float32(samples: np.ndarray) -> np.ndarray:
+    if samples.dtype == np.int16:
+        return samples.astype(np.float32) / 32768.0
+    return samples.astype(np.float32, copy=False)
+
+
+@register_engine
+class TransformersEngine(TranscriptionEngine):
+    """
+    Hugging Face transformers automatic-speech-recognition pipeline
+
+    Audio is cut at pauses into windows that fit Whisper's 30 s context. The
+    windows of one file, and of other jobs transcribed concurrently in the
+    same process (thread pool workers), are collected by a MicroBatcher and
+    run as batched forward passes; each window's timestamps are shifted back
+    by its offset in the source audio.
+    """
+
+    name = "transformers"
+    accepts_pcm = True
+
+    def __init__(self):
+        self._pipelines: Dict[str, Any] = {}
+        self.batcher = MicroBatcher(self._run_batch, max_batch_size=settings.TRANSFORMERS_BATCH_SIZE,
+                                    max_wait=settings.TRANSFORMERS_BATCH_WAIT_MS / 1000,
+                                    name="transformers-batcher")
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return all(importlib.util.find_spec(module) is not None for module in ("torch", "transformers"))
+
+    @staticmethod
+    def hub_model_id(model_name: str) -> str:
+        """whisper.cpp 模型名映射到 Hugging Face 模型 ID（已是完整 ID 时原样返回）"""
+        return model_name if "/" in model_name else f"openai/whisper-{model_name}"
+
+    def load(self, model_name: Optional[str] = None):
+        model_name = model_name or settings.MODEL_NAME
+        if model_name in self._pipelines:
+            return self._pipelines[model_name]
+
+        import torch
+        from transformers import pipeline
+
+        device, torch_dtype = "cpu", torch.float32
+        if torch.cuda.is_available():
+            device, torch_dtype = "cuda:0", torch.float16
+        elif torch.backends.mps.is_available() and torch.backends.mps.is_built():
+            device, torch_dtype = "mps", torch.float16
+
+        logger.info(f"Loading transformers pipeline {self.hub_model_id(model_name)} on {device}")
+        self._pipelines[model_name] = pipeline(
+            "automatic-speech-recognition",
+            model=self.hub_model_id(model_name),
+            torch_dtype=torch_dtype,
+            device=device,
+            model_kwargs={"attn_implementation": "eager"},  # Use eager attention for stability
+        )
+        return self._pipelines[model_name]
+
+    def capabilities(self) -> Dict[str, Any]:
+        capabilities = super().capabilities()
+        capabilities["batching"] = {
+            "max_batch_size": self.batcher.max_batch_size,
+            "max_wait_ms": settings.TRANSFORMERS_BATCH_WAIT_MS,
+            **self.batcher.stats,
+        }
+        return capabilities
+
+    def version(self) -> str:
+        return f"transformers:{importlib.metadata.version('transformers')}"
+
+    def _run_batch(self, key, windows: List[np.ndarray]) -> List[Dict[str, Any]]:
+        """一次前向计算处理一批窗口（同一模型、语言和任务）"""
+        model_name, language, task_type = key
+        asr = self.load(model_name)
+        generate_kwargs = {"task": task_type}
+        if language != "auto":
+            generate_kwargs["language"] = language
+
+        start = time.time()
+        outputs = asr([{"raw": window, "sampling_rate": TARGET_SAMPLE_RATE} for window in windows],
+                      batch_size=len(windows), return_timestamps=True, generate_kwargs=generate_kwargs)
+        audio_seconds = sum(len(window) for window in windows) / TARGET_SAMPLE_RATE
+        logger.info(f"Transformers batch of {len(windows)} windows ({audio_seconds:.0f}s audio) "
+                    f"in {time.time() - start:.2f}s")
+        return outputs
+
+    def _transcribe(self, audio, model_name, language, task_type, **options):
+        from .chunking import plan_chunks, shift_segments, merge_chunk_segments
+
+        if isinstance(audio, str):
+            if not is_normalized_wav(audio):
+                raise RuntimeError(f"Transformers engine expects 16 kHz mono PCM WAV input: {audio}")
+            audio, _ = read_pcm16_wav(audio)
+        samples = _to_float32(np.asarray(audio))
+
+        final_language = language or settings.WHISPER_LANGUAGE
+        final_task_type = task_type or settings.WHISPER_TASK
+
+        # 在停顿处切成不超过 Whisper 30 秒上下文的窗口（最后一个窗口最长 1.5 倍目标时长）
+        window_seconds = settings.TRANSFORMERS_WINDOW_SECONDS
+        windows = plan_chunks(samples, TARGET_SAMPLE_RATE, target_seconds=window_seconds,
+                              search_seconds=window_seconds / 5, overlap_seconds=0.0)
+        pcm_windows = [
+            samples[int(w["start"] * TARGET_SAMPLE_RATE):int(w["end"] * TARGET_SAMPLE_RATE)] for w in windows
+        ]
+        outputs = self.batcher.map((model_name, final_language, final_task_type), pcm_windows)
+
+        window_segments = []
+        for window, output in zip(windows, outputs):
+            segments = []
+            for chunk in output.get("chunks", []):
+                start, end = chunk.get("timestamp", (0.0, None))
+                start = start or 0.0
+                segments.append({"start": start, "end": end if end is not None else start + 1.0,
+                                 "text": chunk.get("text", "").strip(), "words": []})
+            if not segments and output.get("text", "").strip():
+                segments.append({"start": 0.0, "end": window["end"] - window["start"],
+                                 "text": output["text"].strip(), "words": []})
+            window_segments.append(shift_segments(segments, window["start"]))
+
+        segments = merge_chunk_segments(windows, window_segments)
+        return {"text": " ".join(seg["text"] for seg in segments if seg["text"]), "segments": segments,
+                "language": final_language, "windows": len(windows)}
+
+
+@register_engine
+class SyntheticEngine(TranscriptionEngine):
+    """
+    Deterministic synthetic transcription with configurable cost (app/synthetic.py)
+
+    For load-testing the whole pipeline without models. To exercise the
+    whisper.cpp subprocess path instead, point WHISPER_CPP_PATH at
+    scripts/fake_whisper_cli.py.
+    """
+
+    name = "synthetic"
+    accepts_pcm = True
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return True
+
+    def load(self, model_name: Optional[str] = None):
+        pass
+
+    @staticmethod
+    def profile():
+        from .synthetic import SyntheticProfile, PROFILE_FIELDS
+        return SyntheticProfile.from_mapping({key: getattr(settings, key) for key in PROFILE_FIELDS})
+
+    def capabilities(self) -> Dict[str, Any]:
+        capabilities = super().capabilities()
+        capabilities.update({"word_timestamps": True, "progress": True, "confidence": True})
+        return capabilities
+
+    def cost(self, model_name: str, duration: Optional[float]) -> Optional[float]:
+        return self.profile().processing_seconds(model_name, duration) if duration else None
+
+    def version(self) -> str:
+        return f"synthetic:{self.profile().seed}"
+
+    def _transcribe(self, audio, model_name, language, task_type, **options):
+        from .progress import WhisperProgressParser
+        from .synthetic import input_key, simulate_work, synthetic_transcription
+
+        duration = self._audio_duration(audio)
+        if duration is None:
+            raise RuntimeError(f"Synthetic engine expects 16 kHz mono PCM WAV input: {audio}")
+        profile = self.profile()
+        key = input_key(audio, model_name)
+
+        progress_callback = options.get("progress_callback")
+        parser = WhisperProgressParser(audio_duration=duration, callback=progress_callback)
+        simulate_work(profile.processing_seconds(model_name, duration), profile.cpu_fraction,
+                      profile.memory_bytes(model_name),
+                      progress=(lambda fraction: parser.feed(f"progress = {int(fraction * 100)}%"))
+                      if progress_callback else None)
+        if profile.should_fail(key):
+            raise RuntimeError(f"Synthetic failure (SYNTHETIC_FAILURE_RATE={profile.failure_rate})")
+
+        result = synthetic_transcription(key, duration, model_name, language=language or settings.WHISPER_LANGUAGE,
+                                         translate=(task_type or settings.WHISPER_TASK) == "translate",
+                                         full=True, seed=profile.seed)
+        segments = []
+        for segment in result["transcription"]:
+            segments.append({
+                "start": segment["offsets"]["from"] / 1000, "end": segment["offsets"]["to"] / 1000,
+                "text": segment["text"],
+                "words": [{"start": token["offsets"]["from"] / 1000, "end": token["offsets"]["to"] / 1000,
+                           "word": token["text"], "probability": token["p"]} for token in segment["tokens"]],
+            })
+        return {"segments": segments, "language": result["result"]["language"]}
+
+
+# 每个进程内的引擎实例
+_engine_instances: Dict[str, TranscriptionEngine] = {}
+
+
+def get_engine(name: Optional[str] = None) -> TranscriptionEngine:
+    """Get (and create on first use) the engine instance for name, default TRANSCRIPTION_ENGINE"""
+    name = name or settings.TRANSCRIPTION_ENGINE
+    engine_class = ENGINES.get(name)
+    if engine_class is None:
+        raise ValueError(f"Unknown transcription engine: {name}. Available: {list(ENGINES)}")
+    if name not in _engine_instances:
+        if not engine_class.is_available():
+            raise RuntimeError(f"Transcription engine {name} is not installed on this worker")
+        _engine_instances[name] = engine_class()
+    return _engine_instances[name]
+
+
+def available_engines() -> Dict[str, Dict[str, Any]]:
+    """所有已注册引擎及其在本进程中是否可用"""
+    return {
+        name: {"available": engine_class.is_available(), "default": name == settings.TRANSCRIPTION_ENGINE}
+        for name, engine_class in ENGINES.items()
+    }
@@ -0,0 +1,142 @@
+"""
+Language-detection pre-pass: identify the spoken language on a few speech
+windows with the smallest model, so the main run gets an explicit -l
+"""
+import json
+import time
+import logging
+import tempfile
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+import numpy as np
+
+from .config import settings
+from .audio import TARGET_SAMPLE_RATE, read_pcm16_wav, write_pcm16_wav
+from .vad import detect_speech
+
+logger = logging.getLogger(__name__)
+
+# Redis 中按内容哈希缓存的检测结果
+LANGUAGE_CACHE_PREFIX = "whisper:language:"
+
+# 拼接检测窗口时插入的静音（秒）
+WINDOW_GAP_SECONDS = 0.2
+
+
+def detection_windows(spans: List[Tuple[float, float]], windows: int = None,
+                      window_seconds: float = None) -> List[Tuple[float, float]]:
+    """
+    Pick up to `windows` speech windows spread evenly over the file
+
+    Speech spans are cut into windows of at most window_seconds; windows
+    shorter than a second are ignored unless nothing else is available.
+    """
+    windows = windows or settings.LANGUAGE_DETECT_WINDOWS
+    window_seconds = window_seconds or settings.LANGUAGE_DETECT_WINDOW_SECONDS
+
+    candidates: List[Tuple[float, float]] = []
+    for start, end in spans:
+        position = start
+        while position < end:
+            candidates.append((position, min(end, position + window_seconds)))
+            position += window_seconds
+    long_enough = [window for window in candidates if window[1] - window[0] >= 1.0]
+    candidates = long_enough or candidates
+    if len(candidates) <= windows:
+        return candidates
+    picks = sorted(set(int(round(i)) for i in np.linspace(0, len(candidates) - 1, windows)))
+    return [candidates[i] for i in picks]
+
+
+def detection_clip(samples: np.ndarray, sample_rate: int,
+                   spans: Optional[List[Tuple[float, float]]] = None) -> np.ndarray:
+    """把检测窗口拼成一段音频（默认 3 × 8 秒，在 whisper 的 30 秒检测窗口内）"""
+    spans = detect_speech(samples, sample_rate) if spans is None else spans
+    gap = np.zeros(int(WINDOW_GAP_SECONDS * sample_rate), dtype=samples.dtype)
+    pieces = []
+    for start, end in detection_windows(spans):
+        pieces.extend([samples[int(start * sample_rate):int(end * sample_rate)], gap])
+    return np.concatenate(pieces[:-1]) if pieces else np.zeros(0, dtype=samples.dtype)
+
+
+def _cached_language(content_key: str) -> Optional[Dict[str, Any]]:
+    try:
+        from .redis_store import get_redis_client
+        cached = get_redis_client().get(LANGUAGE_CACHE_PREFIX + content_key)
+        return json.loads(cached) if cached else None
+    except Exception as e:
+        logger.debug(f"Could not read cached language for {content_key}: {e}")
+        return None
+
+
+def _store_language(content_key: str, detection: Dict[str, Any]):
+    try:
+        from .redis_store import get_redis_client
+        get_redis_client().set(LANGUAGE_CACHE_PREFIX + content_key, json.dumps(detection),
+                               ex=settings.LANGUAGE_DETECT_CACHE_TTL or None)
+    except Exception as e:
+        logger.debug(f"Could not cache language for {content_key}: {e}")
+
+
+def detect_language(audio: Union[str, Path, np.ndarray], engine_name: Optional[str] = None,
+                    content_key: Optional[str] = None, spans: Optional[List[Tuple[float, float]]] = None,
+                    work_dir: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Detect the language of a normalized WAV (or 16 kHz PCM), cached per content hash
+
+    Returns {"language", "probability", "model", "cached", "detect_time"};
+    language is None when there is no speech. spans are VAD spans on the
+    audio's time axis when the caller already has them.
+    """
+    if content_key:
+        cached = _cached_language(content_key)
+        if cached:
+            logger.info(f"🌐 Language for {content_key[:12]} from cache: {cached['language']}")
+            return {**cached, "cached": True, "detect_time": 0.0}
+
+    from .engines import get_engine
+
+    start_time = time.time()
+    model_name = settings.LANGUAGE_DETECT_MODEL
+    if isinstance(audio, np.ndarray):
+        samples, sample_rate, stem = audio, TARGET_SAMPLE_RATE, "stream"
+    else:
+        (samples, sample_rate), stem = read_pcm16_wav(audio), Path(audio).stem
+    clip = detection_clip(samples, sample_rate, spans)
+    if len(clip) == 0:
+        return {"language": None, "probability": None, "model": model_name, "cached": False, "detect_time": 0.0}
+
+    default_dir = tempfile.gettempdir() if isinstance(audio, np.ndarray) else Path(audio).parent
+    clip_path = Path(work_dir or default_dir) / f"{stem}_language.wav"
+    write_pcm16_wav(clip_path, clip, sample_rate)
+    try:
+        detection = get_engine(engine_name).detect_language(str(clip_path), model_name)
+    finally:
+        clip_path.unlink(missing_ok=True)
+
+    detection = {"language": detection["language"], "probability": detection.get("probability"), "model": model_name}
+    detect_time = time.time() - start_time
+    logger.info(f"🌐 Detected language {detection['language']} (p = {detection['probability']}) "
+                f"on {len(clip) / sample_rate:.1f}s of speech with {model_name} in {detect_time:.2f}s")
+    if content_key and detection["language"] not in (None, "", "unknown"):
+        _store_language(content_key, detection)
+    return {**detection, "cached": False, "detect_time": round(detect_time, 2)}
+
+
+def is_confident(detection: Optional[Dict[str, Any]]) -> bool:
+    """检测结果是否足够可信，可以替代 auto（没有概率的引擎视为可信）"""
+    if not detection or detection.get("language") in (None, "", "unknown", "auto"):
+        return False
+    probability = detection.get("probability")
+    return probability is None or probability >= settings.LANGUAGE_DETECT_MIN_PROBABILITY
+
+
+def route_model(model_name: str, language: Optional[str], task_type: Optional[str] = None) -> str:
+    """英文音频改用更快的 .en 模型（SUPPORTED_MODELS 中存在时）"""
+    if not settings.LANGUAGE_DETECT_ROUTE_EN or language != "en" or task_type == "translate":
+        return model_name
+    if model_name.endswith(".en"):
+        return model_name
+    english_model = f"{model_name}.en"
+    return english_model if english_model in settings.SUPPORTED_MODELS else model_name
@@ -1,18 +1,32 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Form, Request, Header
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-import shutil
-import os
+from fastapi.concurrency import run_in_threadpool
+import re
+import anyio
 import uuid
 from pathlib import Path
 from typing import Optional, List
 import logging
 
 from .config import settings
-from .tasks import create_transcription_task, create_batch_transcription_task
+from .tasks import (
+    create_transcription_task, create_batch_transcription_task, cached_transcription_result, submit_transcription,
+    abandon_lost_leader, LEADER_LOST_STATES
+)
+from .single_flight import flight_of
+from .uploads import save_upload, write_chunk, streaming_upload_route
+from .upload_sessions import get_upload_sessions, content_key, UploadSessionConflict, UploadChecksumMismatch
+from .result_cache import cache_key, engine_version, get_result_cache
+from .media_info import get_media_info, sidecar_path
+from .capabilities import file_fingerprint
+from .cost_model import estimate_job, celery_time_limits
+from .cpu_planner import get_cpu_planner
+from .model_store import get_model_store
+from .engines import ENGINES, available_engines
 from .models import (
     ModelSize, LanguageCode, OutputFormat, 
-    TranscriptionResponse, ModelInfo, ModelsListResponse,
+    TranscriptionResponse, ModelInfo, ModelsListResponse, UploadSessionResponse,
     BatchTranscriptionRequest, BatchTranscriptionResponse, 
     BatchTaskStatus, BatchResultSummary, BatchTaskInfo
 )
@@ -39,6 +53,154 @@ UPLOAD_DIR = Path("uploads")
 RESULTS_DIR = Path("results")
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+# 上传的文件边接收边写入 UPLOAD_DIR，不经过 Starlette 的临时文件
+app.router.route_class = streaming_upload_route(UPLOAD_DIR)
+
+# 无法获知媒体时长时，按模型大小使用的预估处理时间（秒）
+ESTIMATED_TIMES = {
+    "tiny": 30, "tiny.en": 30,
+    "base": 60, "base.en": 60,
+    "small": 120, "small.en": 120,
+    "medium": 300, "medium.en": 300,
+    "large-v1": 600, "large-v2": 600, "large-v3": 600,
+    "large-v3-turbo": 150
+}
+
+def plan_transcription_job(file_path: Path, model_name: str, engine: Optional[str] = None,
+                           cascade_model: Optional[str] = None, content_hash: Optional[str] = None) -> dict:
+    """
+    上传后探测一次媒体时长，计算预估耗时和 Celery 时间限制
+    
+    探测结果（含内容哈希）随任务一起下发并写入 sidecar / Redis，worker 不需要再次探测。
+    content_hash 为保存时已计算的哈希，未提供时读取文件计算。
+    """
+    try:
+        content_hash = content_hash or (file_fingerprint(str(file_path)) or {}).get("sha256")
+        media_info = get_media_info(file_path, content_hash)
+    except Exception as e:
+        logger.warning(f"Could not probe {file_path}: {e}")
+        media_info = None
+    
+    duration = media_info.get("duration") if media_info else None
+    estimate = estimate_job(model_name, duration, engine)
+    estimated_time = (
+        int(estimate["expected_cost"]) if estimate["expected_cost"] is not None
+        else ESTIMATED_TIMES.get(model_name, 120)
+    )
+    return {
+        "media_info": media_info,
+        "media_duration": duration,
+        "expected_cost": estimate["expected_cost"],
+        "estimated_time": estimated_time,
+        # 级联模式最坏情况下要用大模型重转整个文件，时间限制按大模型计算
+        "time_limits": celery_time_limits(cascade_model or model_name, duration, engine),
+    }
+
+def validate_engine(engine: Optional[str]) -> str:
+    """校验请求指定的转录引擎，未指定时使用 TRANSCRIPTION_ENGINE"""
+    engine = engine or settings.TRANSCRIPTION_ENGINE
+    if engine not in ENGINES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的引擎: {engine}. 支持的引擎: {list(ENGINES)}"
+        )
+    return engine
+
+def validate_cascade_model(cascade_model: Optional[str]) -> Optional[str]:
+    """校验级联模式的大模型，未指定时使用 CASCADE_MODEL（为空则不启用）"""
+    cascade_model = cascade_model or settings.CASCADE_MODEL or None
+    if cascade_model and cascade_model not in settings.SUPPORTED_MODELS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的级联模型: {cascade_model}. 支持的模型: {list(settings.SUPPORTED_MODELS.keys())}"
+        )
+    return cascade_model
+
+def lookup_cached_result(content_hash: str, transcription_params: dict) -> Optional[dict]:
+    """
+    入队前查询结果缓存（引擎版本由 worker 写入 Redis，还没有 worker 上报时视为未命中）
+    """
+    if not settings.RESULT_CACHE_ENABLED or transcription_params.get("no_cache"):
+        return None
+    engine = transcription_params["engine"]
+    version = engine_version(engine)
+    if not version:
+        return None
+    key = cache_key(content_hash, transcription_params["model"], transcription_params["language"],
+                    transcription_params["task"], engine, version, transcription_params.get("cascade_model"))
+    return get_result_cache().get(key)
+
+def build_transcription_params(model: ModelSize, language: LanguageCode, output_format: OutputFormat, task: str,
+                               engine: Optional[str], cascade_model: Optional[str], draft: Optional[bool],
+                               no_cache: bool) -> dict:
+    """校验上传表单中的转录参数，返回下发给任务的 transcription_params"""
+    # 验证模型是否支持
+    if model.value not in settings.SUPPORTED_MODELS:
+        raise HTTPException(
+            status_code=400, 
+            detail=f"不支持的模型: {model.value}. 支持的模型: {list(settings.SUPPORTED_MODELS.keys())}"
+        )
+    
+    return {
+        "model": model.value,
+        "language": language.value,
+        "output_format": output_format.value,
+        "task": task,
+        "engine": validate_engine(engine),
+        "cascade_model": validate_cascade_model(cascade_model),
+        "draft": settings.DRAFT_ENABLED if draft is None else draft,
+        "no_cache": no_cache
+    }
+
+async def dispatch_transcription(file_path: Path, file_id: str, original_filename: str, transcription_params: dict,
+                                 content_hash: Optional[str]) -> TranscriptionResponse:
+    """已保存的上传文件：命中结果缓存时直接返回，否则探测、预估并提交转录任务"""
+    model_name = transcription_params["model"]
+    
+    # 相同音频和解码参数已有结果时直接返回，不进入 Celery 队列
+    cached = await run_in_threadpool(lookup_cached_result, content_hash, transcription_params)
+    if cached:
+        try:
+            result = await run_in_threadpool(cached_transcription_result, cached, original_filename, file_id,
+                                             transcription_params["output_format"], transcription_params)
+            task_id = str(uuid.uuid4())
+            create_transcription_task.backend.store_result(task_id, result, "SUCCESS")
+        except Exception as e:
+            logger.warning(f"Could not serve {original_filename} from result cache, queueing instead: {e}")
+        else:
+            file_path.unlink(missing_ok=True)
+            return TranscriptionResponse(
+                task_id=task_id,
+                file_id=file_id,
+                message=f"相同文件已使用 {result['transcription_params']['model']} 模型转录过，直接返回缓存结果",
+                model_used=result["transcription_params"]["model"],
+                estimated_time=0,
+                media_duration=result["media_duration"],
+                expected_cost=0,
+                cached=True
+            )
+
+    # 探测时长并预估成本（ffprobe 是阻塞调用，放到线程池执行）
+    job_plan = await run_in_threadpool(plan_transcription_job, file_path, model_name,
+                                       transcription_params["engine"], transcription_params["cascade_model"], content_hash)
+
+    # Create a task for Celery with dynamic parameters
+    # 相同文件和参数的任务正在排队或运行时不再入队，返回的任务 ID 由该任务完成时一并写入结果
+    task_result, leader_task_id = await run_in_threadpool(
+        submit_transcription, str(file_path), file_id, original_filename, transcription_params,
+        job_plan["media_info"], job_plan["time_limits"]
+    )
+
+    return TranscriptionResponse(
+        task_id=task_result.id,
+        file_id=file_id,
+        message=(f"相同文件正在使用 {model_name} 模型转录，已合并到任务 {leader_task_id}" if leader_task_id
+                 else f"文件已上传，开始使用 {model_name} 模型进行转录"),
+        model_used=model_name,
+        estimated_time=job_plan["estimated_time"],
+        media_duration=job_plan["media_duration"],
+        expected_cost=job_plan["expected_cost"]
+    )
 
 @app.get("/")
 async def root():
@@ -49,8 +211,10 @@ async def root():
         "description": "Audio transcription service using whisper.cpp",
         "endpoints": {
             "upload": "/upload/",
+            "resumable_upload": "/uploads/",
             "batch_upload": "/batch-upload/",
             "models": "/models/",
+            "engines": "/engines/",
             "status": "/status/{task_id}",
             "batch_status": "/batch-status/{batch_id}",
             "batch_result": "/batch-result/{batch_id}",
@@ -97,14 +261,37 @@ async def health_check():
         deployment_info = {
             "mode": settings.DEPLOYMENT_MODE,
             "device": settings.WHISPER_DEVICE,
-            "model": settings.MODEL_NAME
+            "model": settings.MODEL_NAME,
+            "engine_mode": settings.WHISPER_ENGINE_MODE
         }
         
+        # CPU 拓扑和当前核心预留（用于核对线程规划）
+        try:
+            cpu_status = get_cpu_planner().status()
+        except Exception as e:
+            cpu_status = {"error": str(e)}
+        
+        # openai_whisper 引擎的内存模型缓存命中率（所有 worker 汇总）
+        try:
+            from .redis_store import model_cache_stats
+            model_cache = model_cache_stats()
+        except Exception as e:
+            model_cache = {"error": str(e)}
+        
+        # 转录结果缓存的条目数和占用
+        try:
+            result_cache = get_result_cache().status() if settings.RESULT_CACHE_ENABLED else {"enabled": False}
+        except Exception as e:
+            result_cache = {"error": str(e)}
+        
         return {
             "status": "healthy" if "connected" in redis_status else "partial",
             "config": config_status,
             "redis": redis_status,
             "deployment": deployment_info,
+            "cpu": cpu_status,
+            "model_cache": model_cache,
+            "result_cache": result_cache,
             "version": "0.1.0"
         }
     except Exception as e:
@@ -124,7 +311,11 @@ async def upload_file_for_transcription(
     model: ModelSize = Form(default=ModelSize.BASE),
     language: LanguageCode = Form(default=LanguageCode.AUTO),
     output_format: OutputFormat = Form(default=OutputFormat.BOTH),
-    task: str = Form(default="transcribe")
+    task: str = Form(default="transcribe"),
+    engine: Optional[str] = Form(default=None),
+    cascade_model: Optional[str] = Form(default=None),
+    draft: Optional[bool] = Form(default=None),
+    no_cache: bool = Form(default=False)
 ):
     """
     上传音频/视频文件进行转录
@@ -134,14 +325,14 @@ async def upload_file_for_transcription(
     - **language**: 音频语言代码 (auto, zh, en, ja, ko, 等)
     - **output_format**: 输出格式 (srt, vtt, both)
     - **task**: 任务类型 (transcribe 或 translate)
+    - **engine**: 转录引擎 (whisper_cpp, openai_whisper, transformers)，默认使用服务端配置
+    - **cascade_model**: 级联模式的大模型 (可选)，先用 model 转录，只把低置信度片段交给大模型重转
+    - **draft**: 先用 DRAFT_MODEL 快速生成草稿字幕 (*.draft.srt / *.draft.vtt)，通过 /status 的 draft 字段获取
+    - **no_cache**: 跳过结果缓存重新转录 (新结果仍会写入缓存)
     """
-    # 验证模型是否支持
-    if model.value not in settings.SUPPORTED_MODELS:
-        raise HTTPException(
-            status_code=400, 
-            detail=f"不支持的模型: {model.value}. 支持的模型: {list(settings.SUPPORTED_MODELS.keys())}"
-        )
-    
+    transcription_params = build_transcription_params(model, language, output_format, task, engine, cascade_model,
+                                                      draft, no_cache)
+
     if not file.filename:
         raise HTTPException(status_code=400, detail="No file name provided")
 
@@ -155,47 +346,148 @@ async def upload_file_for_transcription(
     file_path = UPLOAD_DIR / saved_filename
 
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        content_hash = await save_upload(file, file_path)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Could not save file: {e}")
     finally:
         file.file.close()
 
-    # 准备转录参数
-    transcription_params = {
-        "model": model.value,
-        "language": language.value,
-        "output_format": output_format.value,
-        "task": task
-    }
+    return await dispatch_transcription(file_path, file_id, original_filename, transcription_params, content_hash)
 
-    # Create a task for Celery with dynamic parameters
-    task_result = create_transcription_task.delay(
-        str(file_path), 
-        file_id, 
-        original_filename,
-        transcription_params
+def upload_session_response(session: dict) -> UploadSessionResponse:
+    sessions = get_upload_sessions()
+    missing = sessions.missing_ranges(session)
+    return UploadSessionResponse(
+        upload_id=session["upload_id"],
+        filename=session["filename"],
+        size=session["size"],
+        chunk_size=session["chunk_size"],
+        chunk_count=sessions.chunk_count(session),
+        received=[list(span) for span in sessions.received_ranges(session)],
+        missing=[list(span) for span in missing],
+        complete=not missing
     )
 
-    # 预估处理时间（基于模型大小）
-    estimated_times = {
-        "tiny": 30, "tiny.en": 30,
-        "base": 60, "base.en": 60,
-        "small": 120, "small.en": 120,
-        "medium": 300, "medium.en": 300,
-        "large-v1": 600, "large-v2": 600, "large-v3": 600,
-        "large-v3-turbo": 150
-    }
-    estimated_time = estimated_times.get(model.value, 120)
+def get_upload_session_or_404(upload_id: str) -> dict:
+    session = get_upload_sessions().get(upload_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Upload session {upload_id} not found")
+    return session
 
-    return TranscriptionResponse(
-        task_id=task_result.id,
-        file_id=file_id,
-        message=f"文件已上传，开始使用 {model.value} 模型进行转录",
-        model_used=model.value,
-        estimated_time=estimated_time
-    )
+@app.post("/uploads/", response_model=UploadSessionResponse, tags=["Resumable Upload"])
+async def create_upload_session(
+    filename: str = Form(...),
+    size: int = Form(...),
+    chunk_size: Optional[int] = Form(default=None),
+    checksum: Optional[str] = Form(default=None)
+):
+    """
+    创建可续传上传会话
+    
+    - **filename**: 原始文件名
+    - **size**: 文件总字节数
+    - **chunk_size**: 分块大小 (字节，默认 UPLOAD_SESSION_CHUNK_MB)
+    - **checksum**: 可选，按顺序拼接各分块 SHA-256 摘要后的 SHA-256，finalize 时校验
+    
+    之后用 `PUT /uploads/{upload_id}?offset=N` 并行上传各分块，`GET /uploads/{upload_id}` 查询已收到的区间，
+    全部收到后 `POST /uploads/{upload_id}/finalize` 开始转录。
+    """
+    original_filename = Path(filename).name
+    if not original_filename:
+        raise HTTPException(status_code=400, detail="No file name provided")
+    if size <= 0:
+        raise HTTPException(status_code=400, detail="File size must be positive")
+    if settings.MAX_UPLOAD_MB and size > settings.MAX_UPLOAD_MB * 1024 * 1024:
+        raise HTTPException(status_code=413, detail=f"{original_filename} exceeds the {settings.MAX_UPLOAD_MB} MB upload limit")
+    chunk_size = chunk_size or settings.UPLOAD_SESSION_CHUNK_MB * 1024 * 1024
+    if not 1024 * 1024 <= chunk_size <= 1024 * 1024 * 1024:
+        raise HTTPException(status_code=400, detail="Chunk size must be between 1 MB and 1 GB")
+
+    session = await run_in_threadpool(get_upload_sessions().create, original_filename, size, chunk_size, checksum)
+    return upload_session_response(session)
+
+@app.put("/uploads/{upload_id}", response_model=UploadSessionResponse, tags=["Resumable Upload"])
+async def put_upload_chunk(upload_id: str, offset: int, request: Request,
+                           x_chunk_sha256: Optional[str] = Header(default=None)):
+    """
+    上传一个分块：请求体为原始字节，offset 为分块起始位置 (chunk_size 的整数倍)
+    
+    分块可以并行、乱序、重复上传；长度不对 (400)、与 X-Chunk-SHA256 不一致 (422) 或中途失败的分块
+    保持缺失，即使之前已成功上传过，需要重新上传。
+    """
+    sessions = get_upload_sessions()
+    session = get_upload_session_or_404(upload_id)
+    if offset < 0 or offset >= session["size"] or offset % session["chunk_size"]:
+        raise HTTPException(status_code=400,
+                            detail=f"Offset must be a multiple of {session['chunk_size']} below {session['size']}")
+    index = offset // session["chunk_size"]
+
+    # 写入开始时先丢弃该分块的旧摘要，只有写入完整且校验通过才重新记录
+    token = await run_in_threadpool(sessions.begin_chunk, upload_id, index)
+    if token is None:
+        raise HTTPException(status_code=404, detail=f"Upload session {upload_id} not found")
+    recorded = None
+    try:
+        digest = await write_chunk(request, sessions.part_path(session), offset, sessions.chunk_length(session, index))
+        if x_chunk_sha256 and x_chunk_sha256.lower() != digest:
+            raise HTTPException(status_code=422, detail=f"Chunk at offset {offset} does not match X-Chunk-SHA256")
+        recorded = digest
+    except FileNotFoundError:
+        # 分块文件已被 finalize 改名或被 DELETE 删除
+        raise HTTPException(status_code=404, detail=f"Upload session {upload_id} not found")
+    finally:
+        with anyio.CancelScope(shield=True):
+            session = await run_in_threadpool(sessions.end_chunk, upload_id, index, token, recorded)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Upload session {upload_id} not found")
+    return upload_session_response(session)
+
+@app.get("/uploads/{upload_id}", response_model=UploadSessionResponse, tags=["Resumable Upload"])
+async def get_upload_session(upload_id: str):
+    """查询已收到和缺失的字节区间（断线后据此续传）"""
+    return upload_session_response(get_upload_session_or_404(upload_id))
+
+@app.post("/uploads/{upload_id}/finalize", response_model=TranscriptionResponse, tags=["Resumable Upload"])
+async def finalize_upload_session(
+    upload_id: str,
+    model: ModelSize = Form(default=ModelSize.BASE),
+    language: LanguageCode = Form(default=LanguageCode.AUTO),
+    output_format: OutputFormat = Form(default=OutputFormat.BOTH),
+    task: str = Form(default="transcribe"),
+    engine: Optional[str] = Form(default=None),
+    cascade_model: Optional[str] = Form(default=None),
+    draft: Optional[bool] = Form(default=None),
+    no_cache: bool = Form(default=False)
+):
+    """
+    完成上传并开始转录（参数同 /upload/）
+    
+    分块文件直接改名为上传文件，校验值由各分块摘要得出，不需要再读取文件。
+    """
+    transcription_params = build_transcription_params(model, language, output_format, task, engine, cascade_model,
+                                                      draft, no_cache)
+    sessions = get_upload_sessions()
+    session = get_upload_session_or_404(upload_id)
+    file_path = UPLOAD_DIR / f"{upload_id}{session['extension']}"
+    try:
+        session = await run_in_threadpool(sessions.complete, upload_id, file_path)
+    except UploadSessionConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except UploadChecksumMismatch as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Upload session {upload_id} not found")
+    return await dispatch_transcription(file_path, upload_id, session["filename"], transcription_params,
+                                        content_key(session, sessions.checksum(session)))
+
+@app.delete("/uploads/{upload_id}", tags=["Resumable Upload"])
+async def delete_upload_session(upload_id: str):
+    """放弃上传会话并删除已收到的分块"""
+    if not await run_in_threadpool(get_upload_sessions().delete, upload_id):
+        raise HTTPException(status_code=404, detail=f"Upload session {upload_id} not found")
+    return {"message": f"Upload session {upload_id} deleted"}
 
 @app.get("/status/{task_id}", tags=["Transcription"])
 async def get_task_status(task_id: str):
@@ -207,6 +499,26 @@ async def get_task_status(task_id: str):
                 'state': task_result.state,
                 'status': 'Pending...'
             }
+            # 合并到相同任务的请求：完成前报告领头任务的进度
+            flight = flight_of(task_id)
+            if flight:
+                leader_task_id, key = flight
+                leader_result = create_transcription_task.AsyncResult(leader_task_id)
+                leader_info = leader_result.info
+                if leader_result.state in LEADER_LOST_STATES:
+                    # 领头任务被杀或被撤销时不会为跟随任务写入结果
+                    response = {
+                        'state': 'FAILURE',
+                        'status': await run_in_threadpool(abandon_lost_leader, task_id, leader_task_id, key,
+                                                          leader_result.state),
+                    }
+                elif isinstance(leader_info, dict) and leader_info.get('progress') is not None:
+                    response = {
+                        'state': 'PROGRESS',
+                        'status': leader_info.get('status', 'Processing...'),
+                        'progress': leader_info['progress']
+                    }
+                response['attached_to'] = leader_task_id
         elif task_result.state == 'FAILURE':
             # Handle failure state more safely
             try:
@@ -241,6 +553,10 @@ async def get_task_status(task_id: str):
                         'status': status,
                         'progress': progress
                     }
+                    # 转录阶段的实时进度（已处理音频秒数、实时率）
+                    for key in ('audio_seconds_processed', 'audio_duration', 'realtime_factor', 'draft'):
+                        if info.get(key) is not None:
+                            response[key] = info[key]
                 else:
                     response = {
                         'state': task_result.state,
@@ -277,20 +593,37 @@ async def get_result_file(file_id: str, filename: str):
     elif safe_filename.endswith(".vtt"):
         media_type = "text/vtt"
 
+    # 草稿字幕会被最终版本取代，不允许缓存；最终版本不再变化
+    is_draft = ".draft." in safe_filename
+    headers = {
+        "Cache-Control": "no-store" if is_draft else "public, max-age=86400",
+        "X-Subtitle-Version": "draft" if is_draft else "final",
+    }
+
     from fastapi.responses import FileResponse
-    return FileResponse(path=file_path, filename=safe_filename, media_type=media_type)
+    return FileResponse(path=file_path, filename=safe_filename, media_type=media_type, headers=headers)
 
 @app.get("/models/", response_model=ModelsListResponse, tags=["Models"])
 async def get_supported_models():
-    """获取支持的模型列表"""
+    """获取支持的模型列表（包括本机是否已下载、是否已在页缓存中）"""
+    try:
+        store_status = await run_in_threadpool(get_model_store().status)
+    except Exception as e:
+        logger.warning(f"Could not read model store status: {e}")
+        store_status = {}
+    
     models = []
     for model_name, model_info in settings.SUPPORTED_MODELS.items():
+        local_info = store_status.get(model_name, {})
         models.append(ModelInfo(
             name=model_name,
             size=model_info["size"],
             speed=model_info["speed"],
             accuracy=model_info["accuracy"],
-            use_case=model_info["use_case"]
+            use_case=model_info["use_case"],
+            downloaded=local_info.get("downloaded"),
+            warm=local_info.get("warm"),
+            resident_fraction=local_info.get("resident_fraction")
         ))
     
     return ModelsListResponse(
@@ -298,6 +631,48 @@ async def get_supported_models():
         default_model=settings.MODEL_NAME
     )
 
+@app.get("/engines/", tags=["Models"])
+async def get_engines():
+    """
+    已注册的转录引擎
+
+    available 反映 API 进程中是否安装了对应依赖；worker 的环境可能不同，
+    不可用的引擎在 worker 上会以任务失败的形式报告。
+    """
+    return {
+        "engines": available_engines(),
+        "default_engine": settings.TRANSCRIPTION_ENGINE
+    }
+
+@app.api_route("/models/files/{filename}", methods=["GET", "HEAD"], tags=["Models"])
+async def get_model_file(filename: str):
+    """
+    向其他节点提供本机已校验的模型文件（MODEL_SERVE_PEERS=true 时启用）
+
+    支持 Range 请求，其他节点把 MODEL_MIRROR_URL 指向这里即可并行下载；
+    X-Linked-Etag 头携带 SHA-256，下载方据此校验。
+    """
+    if not settings.MODEL_SERVE_PEERS:
+        raise HTTPException(status_code=404, detail="Model file serving is disabled")
+    
+    match = re.fullmatch(r"ggml-(.+)\.bin", filename)
+    if not match or match.group(1) not in settings.SUPPORTED_MODELS:
+        raise HTTPException(status_code=404, detail="Unknown model file")
+    
+    model_name = match.group(1)
+    store = get_model_store()
+    model_path = store.model_path(model_name)
+    if not model_path.exists() or not await run_in_threadpool(store.verify, model_name, model_path):
+        raise HTTPException(status_code=404, detail="Model not available on this node")
+    
+    headers = {}
+    digest = await run_in_threadpool(store.checksum, model_name)
+    if digest:
+        headers["X-Linked-Etag"] = f'"{digest}"'
+    
+    from fastapi.responses import FileResponse
+    return FileResponse(path=model_path, filename=filename, media_type="application/octet-stream", headers=headers)
+
 # Placeholder for WebSocket endpoint for real-time progress (optional)
 # @app.websocket("/ws/progress/{task_id}")
 # async def websocket_progress(websocket: WebSocket, task_id: str):
@@ -313,6 +688,8 @@ async def batch_upload_files_for_transcription(
     language: LanguageCode = Form(default=LanguageCode.AUTO),
     output_format: OutputFormat = Form(default=OutputFormat.BOTH),
     task: str = Form(default="transcribe"),
+    engine: Optional[str] = Form(default=None),
+    cascade_model: Optional[str] = Form(default=None),
     concurrent_limit: int = Form(default=3)
 ):
     """
@@ -323,6 +700,8 @@ async def batch_upload_files_for_transcription(
     - **language**: 音频语言代码 (auto, zh, en, ja, ko, 等)
     - **output_format**: 输出格式 (srt, vtt, both)
     - **task**: 任务类型 (transcribe 或 translate)
+    - **engine**: 转录引擎 (whisper_cpp, openai_whisper, transformers)，默认使用服务端配置
+    - **cascade_model**: 级联模式的大模型 (可选)
     - **concurrent_limit**: 并发处理文件数量限制 (1-10)
     """
     if not files:
@@ -338,6 +717,9 @@ async def batch_upload_files_for_transcription(
             detail=f"不支持的模型: {model.value}. 支持的模型: {list(settings.SUPPORTED_MODELS.keys())}"
         )
     
+    engine = validate_engine(engine)
+    cascade_model = validate_cascade_model(cascade_model)
+    
     # 验证并发限制
     if concurrent_limit < 1 or concurrent_limit > 10:
         raise HTTPException(status_code=400, detail="Concurrent limit must be between 1 and 10")
@@ -345,17 +727,12 @@ async def batch_upload_files_for_transcription(
     batch_id = str(uuid.uuid4())
     file_infos = []
     task_infos = []
-    
-    # 预估处理时间
-    estimated_times = {
-        "tiny": 30, "tiny.en": 30,
-        "base": 60, "base.en": 60,
-        "small": 120, "small.en": 120,
-        "medium": 300, "medium.en": 300,
-        "large-v1": 600, "large-v2": 600, "large-v3": 600,
-        "large-v3-turbo": 150
-    }
-    single_file_time = estimated_times.get(model.value, 120)
+
+    def discard_saved_files():
+        """某个文件失败时，删除本批次已经保存的文件"""
+        for info in file_infos:
+            Path(info['file_path']).unlink(missing_ok=True)
+            sidecar_path(Path(info['file_path'])).unlink(missing_ok=True)
     
     # 处理每个文件
     for file in files:
@@ -370,14 +747,19 @@ async def batch_upload_files_for_transcription(
         file_path = UPLOAD_DIR / saved_filename
         
         try:
-            # 保存文件
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+            # 保存文件（同时计算内容哈希）；批量任务的缓存命中由 worker 处理
+            content_hash = await save_upload(file, file_path)
+            
+            job_plan = await run_in_threadpool(plan_transcription_job, file_path, model.value, engine, cascade_model,
+                                               content_hash)
                 
             file_infos.append({
                 'file_id': file_id,
                 'original_filename': original_filename,
-                'file_path': str(file_path)
+                'file_path': str(file_path),
+                'media_info': job_plan['media_info'],
+                'time_limits': job_plan['time_limits'],
+                'estimated_time': job_plan['estimated_time']
             })
             
             task_infos.append(BatchTaskInfo(
@@ -386,13 +768,16 @@ async def batch_upload_files_for_transcription(
                 task_id="",  # 将在批量任务中生成
                 status="PENDING",
                 progress=0,
-                estimated_time=single_file_time
+                estimated_time=job_plan['estimated_time']
             ))
             
         except Exception as e:
             # 清理已保存的文件
-            if file_path.exists():
-                os.remove(file_path)
+            file_path.unlink(missing_ok=True)
+            sidecar_path(file_path).unlink(missing_ok=True)
+            discard_saved_files()
+            if isinstance(e, HTTPException):
+                raise
             raise HTTPException(status_code=500, detail=f"Could not save file {file.filename}: {e}")
         finally:
             file.file.close()
@@ -405,7 +790,9 @@ async def batch_upload_files_for_transcription(
         "model": model.value,
         "language": language.value,
         "output_format": output_format.value,
-        "task": task
+        "task": task,
+        "engine": engine,
+        "cascade_model": cascade_model
     }
     
     # 准备批量任务信息
@@ -419,10 +806,10 @@ async def batch_upload_files_for_transcription(
     # 创建批量处理任务
     batch_task_result = create_batch_transcription_task.delay(batch_info)
     
-    # 计算总预估时间（考虑并发）
+    # 计算总预估时间（考虑并发）：按各文件预估耗时均摊到并发槽位，且不少于最长的单个文件
     total_files = len(file_infos)
-    parallel_groups = (total_files + concurrent_limit - 1) // concurrent_limit
-    estimated_total_time = parallel_groups * single_file_time
+    file_times = [info['estimated_time'] for info in file_infos]
+    estimated_total_time = max(max(file_times), (sum(file_times) + concurrent_limit - 1) // concurrent_limit)
     
     return BatchTranscriptionResponse(
         batch_id=batch_id,
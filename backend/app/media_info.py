@@ -0,0 +1,159 @@
+"""
+Media probing with ffprobe (via ffmpeg-python)
+
+Each upload is probed once: the result is stored in a sidecar JSON next to
+the file and, when the content hash is known, in Redis, so the API, the
+estimators and the worker all reuse the same metadata.
+"""
+import os
+import json
+import logging
+from pathlib import Path
+from typing import Dict, Any, Optional, Union
+
+import ffmpeg
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+SIDECAR_SUFFIX = ".probe.json"
+# Redis 中按内容哈希缓存的探测结果
+MEDIA_INFO_PREFIX = "media:info:"
+
+
+def _to_float(value, default: float = 0.0) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _to_int(value, default: int = 0) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def probe_media(path: Union[str, Path]) -> Dict[str, Any]:
+    """
+    Probe a media file once and return the fields later stages need
+
+    Returns:
+        duration: 时长（秒）
+        has_audio: 是否包含音频流
+        format_name / bit_rate / size: 容器信息
+        streams: 每个流的类型、编码、声道、采样率和时长
+    """
+    probe = ffmpeg.probe(str(path))
+    fmt = probe.get("format", {})
+    streams = []
+    for stream in probe.get("streams", []):
+        streams.append({
+            "index": stream.get("index"),
+            "codec_type": stream.get("codec_type"),
+            "codec_name": stream.get("codec_name"),
+            "channels": _to_int(stream.get("channels")),
+            "channel_layout": stream.get("channel_layout"),
+            "sample_rate": _to_int(stream.get("sample_rate")),
+            "bit_rate": _to_int(stream.get("bit_rate")),
+            "duration": _to_float(stream.get("duration")),
+            "default": bool(stream.get("disposition", {}).get("default")),
+            "language": stream.get("tags", {}).get("language"),
+        })
+
+    duration = _to_float(fmt.get("duration"))
+    if not duration:
+        duration = max((s["duration"] for s in streams), default=0.0)
+
+    return {
+        "duration": duration,
+        "has_audio": any(s["codec_type"] == "audio" for s in streams),
+        "format_name": fmt.get("format_name"),
+        "bit_rate": _to_int(fmt.get("bit_rate")),
+        "size": _to_int(fmt.get("size")),
+        "streams": streams,
+    }
+
+
+def sidecar_path(path: Union[str, Path]) -> Path:
+    """探测结果的 sidecar 文件：<上传文件名>.probe.json"""
+    path = Path(path)
+    return path.with_name(path.name + SIDECAR_SUFFIX)
+
+
+def _cached_by_hash(content_hash: str) -> Optional[Dict[str, Any]]:
+    try:
+        from .redis_store import get_redis_client
+        cached = get_redis_client().get(MEDIA_INFO_PREFIX + content_hash)
+        return json.loads(cached) if cached else None
+    except Exception as e:
+        logger.debug(f"Could not read cached media info for {content_hash}: {e}")
+        return None
+
+
+def _store_by_hash(content_hash: str, media_info: Dict[str, Any]):
+    try:
+        from .redis_store import get_redis_client
+        get_redis_client().set(MEDIA_INFO_PREFIX + content_hash, json.dumps(media_info),
+                               ex=settings.MEDIA_INFO_CACHE_TTL or None)
+    except Exception as e:
+        logger.debug(f"Could not cache media info for {content_hash}: {e}")
+
+
+def get_media_info(path: Union[str, Path], content_hash: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Media info for an upload, probing it at most once per content
+
+    Lookup order: sidecar next to the file (valid while size and mtime match),
+    Redis by content hash, then ffprobe. The result carries content_hash when
+    it is known, so later stages can key their own caches on it.
+    """
+    path = Path(path)
+    stat = path.stat()
+    sidecar = sidecar_path(path)
+    try:
+        cached = json.loads(sidecar.read_text(encoding="utf-8"))
+        if cached.get("size") == stat.st_size and cached.get("mtime_ns") == stat.st_mtime_ns:
+            media_info = cached["media_info"]
+            if content_hash and not media_info.get("content_hash"):
+                media_info["content_hash"] = content_hash
+            return media_info
+    except (OSError, ValueError, KeyError):
+        pass
+
+    media_info = _cached_by_hash(content_hash) if content_hash else None
+    if media_info is None:
+        media_info = probe_media(path)
+        if content_hash:
+            _store_by_hash(content_hash, media_info)
+    else:
+        logger.info(f"Media info for {path.name} from cache ({content_hash[:12]})")
+    media_info = {**media_info, "content_hash": content_hash}
+
+    # 先写临时文件再替换，并发读取时不会读到半个 JSON
+    temp = sidecar.with_name(sidecar.name + ".tmp")
+    try:
+        temp.write_text(json.dumps({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                                    "media_info": media_info}), encoding="utf-8")
+        os.replace(temp, sidecar)
+    except OSError as e:
+        logger.debug(f"Could not write {sidecar}: {e}")
+    return media_info
+
+
+def select_audio_stream(media_info: Optional[Dict[str, Any]]) -> Optional[int]:
+    """
+    要转录的音频流在所有音频流中的序号（ffmpeg -map 0:a:N）
+
+    只有一个音频流时返回 None（交给 ffmpeg 默认选择）；多个时优先标记为
+    default 的流（通常是主音轨而不是解说音轨），否则选第一个。
+    """
+    audio_streams = [s for s in (media_info or {}).get("streams", []) if s.get("codec_type") == "audio"]
+    if len(audio_streams) < 2:
+        return None
+    for position, stream in enumerate(audio_streams):
+        if stream.get("default"):
+            return position
+    return 0
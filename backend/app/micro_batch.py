@@ -0,0 +1,106 @@
+"""
+Micro-batching: collect requests from concurrent callers into batched calls
+"""
+import time
+import logging
+import threading
+from queue import Queue, Empty
+from concurrent.futures import Future
+from typing import Callable, Hashable, List, Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Groups items submitted from any number of threads into batches for process_batch
+
+    A batch is dispatched when it reaches max_batch_size or when its oldest
+    item has waited max_wait seconds, so a lone request is delayed by at most
+    max_wait. Items with different keys (model, language, task) never share a
+    batch. process_batch(key, items) must return one result per item, in
+    order; an exception fails every item of that batch.
+    """
+
+    def __init__(self, process_batch: Callable[[Hashable, List[Any]], List[Any]],
+                 max_batch_size: int = 8, max_wait: float = 0.05, name: str = "micro-batcher"):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self.name = name
+        self._queue: "Queue[Tuple[Hashable, Any, Future, float]]" = Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+        self.stats: Dict[str, int] = {"batches": 0, "items": 0, "max_batch": 0}
+
+    def _ensure_thread(self):
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def submit(self, key: Hashable, item: Any) -> Future:
+        """提交一个请求，返回 Future（结果在所属批次处理完后可用）"""
+        future: Future = Future()
+        self._queue.put((key, item, future, time.monotonic()))
+        self._ensure_thread()
+        return future
+
+    def map(self, key: Hashable, items: List[Any]) -> List[Any]:
+        """提交多个请求并等待全部结果（例如一个长文件的所有分块）"""
+        futures = [self.submit(key, item) for item in items]
+        return [future.result() for future in futures]
+
+    def _run(self):
+        # 每个 key 一个待发批次：[(item, future)], 最早请求的入队时间
+        pending: Dict[Hashable, List[Tuple[Any, Future]]] = {}
+        oldest: Dict[Hashable, float] = {}
+        while True:
+            timeout = None
+            if oldest:
+                timeout = max(0.0, min(oldest.values()) + self.max_wait - time.monotonic())
+            try:
+                key, item, future, queued_at = self._queue.get(timeout=timeout)
+                pending.setdefault(key, []).append((item, future))
+                oldest.setdefault(key, queued_at)
+                # 把已在队列中的请求一并取出，避免逐个等待
+                while True:
+                    try:
+                        key, item, future, queued_at = self._queue.get_nowait()
+                    except Empty:
+                        break
+                    pending.setdefault(key, []).append((item, future))
+                    oldest.setdefault(key, queued_at)
+            except Empty:
+                pass
+
+            now = time.monotonic()
+            for key in list(pending):
+                batch = pending[key]
+                if len(batch) < self.max_batch_size and now - oldest[key] < self.max_wait:
+                    continue
+                dispatch, rest = batch[:self.max_batch_size], batch[self.max_batch_size:]
+                if rest:
+                    pending[key] = rest
+                    oldest[key] = now
+                else:
+                    del pending[key]
+                    del oldest[key]
+                self._dispatch(key, dispatch)
+
+    def _dispatch(self, key: Hashable, batch: List[Tuple[Any, Future]]):
+        items = [item for item, _ in batch]
+        self.stats["batches"] += 1
+        self.stats["items"] += len(items)
+        self.stats["max_batch"] = max(self.stats["max_batch"], len(items))
+        try:
+            results = self.process_batch(key, items)
+            if len(results) != len(items):
+                raise RuntimeError(f"{self.name}: batch returned {len(results)} results for {len(items)} items")
+        except Exception as e:
+            logger.error(f"{self.name}: batch of {len(items)} failed: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
@@ -0,0 +1,336 @@
+"""
+On-disk whisper.cpp model store: integrity manifest, page-cache warming and LRU eviction
+"""
+import os
+import json
+import mmap
+import time
+import fcntl
+import ctypes
+import ctypes.util
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List, Iterable
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+HASH_BLOCK_SIZE = 4 * 1024 * 1024
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    return _libc
+
+
+def sha256_file(path: Path) -> str:
+    """流式计算文件的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def page_cache_fraction(path: Path) -> Optional[float]:
+    """
+    用 mincore(2) 统计文件有多少比例已在页缓存中（不支持的平台返回 None）
+    """
+    try:
+        size = path.stat().st_size
+        if size == 0:
+            return 0.0
+        libc = _get_libc()
+        page_size = mmap.PAGESIZE
+        pages = (size + page_size - 1) // page_size
+        with open(path, "rb") as f:
+            # ACCESS_COPY 映射可写（写时复制），才能取到缓冲区地址；这里只读不写
+            mapped = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_COPY)
+            try:
+                buffer = (ctypes.c_char * size).from_buffer(mapped)
+                try:
+                    vec = (ctypes.c_ubyte * pages)()
+                    if libc.mincore(ctypes.c_void_p(ctypes.addressof(buffer)), ctypes.c_size_t(size), vec) != 0:
+                        return None
+                    resident = sum(byte & 1 for byte in vec)
+                finally:
+                    del buffer
+            finally:
+                mapped.close()
+        return resident / pages
+    except (OSError, AttributeError, ValueError, TypeError):
+        return None
+
+
+class ModelStore:
+    """
+    Tracks downloaded models in a flock-guarded manifest (size, sha256, last use),
+    verifies them before use, warms the page cache for models about to run and
+    keeps the models directory within MODEL_DISK_BUDGET_GB by evicting the
+    least recently used files.
+    """
+
+    def __init__(self, models_dir: Path):
+        self.models_dir = Path(models_dir)
+        self.models_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest_file = self.models_dir / MANIFEST_FILE
+        self._warming: Dict[str, threading.Thread] = {}
+        self._hashing: Dict[str, threading.Thread] = {}
+        self._warming_lock = threading.Lock()
+
+    @staticmethod
+    def model_filename(model_name: str) -> str:
+        return f"ggml-{model_name}.bin"
+
+    def model_path(self, model_name: str) -> Path:
+        return self.models_dir / self.model_filename(model_name)
+
+    @contextmanager
+    def _locked_manifest(self):
+        """以独占锁读写模型清单（同一主机的所有 worker 共享）"""
+        with open(self.models_dir / "manifest.lock", "a+") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                manifest = {}
+                if self.manifest_file.exists():
+                    try:
+                        manifest = json.loads(self.manifest_file.read_text() or "{}")
+                    except json.JSONDecodeError:
+                        logger.warning(f"Corrupted model manifest, rebuilding: {self.manifest_file}")
+                        manifest = {}
+                yield manifest
+                tmp_file = self.manifest_file.with_suffix(".tmp")
+                tmp_file.write_text(json.dumps(manifest, indent=2))
+                os.replace(tmp_file, self.manifest_file)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def register(self, model_name: str, path: Optional[Path] = None, sha256: Optional[str] = None,
+                 source: str = "download", defer_hash: bool = False):
+        """
+        记录模型文件的大小和校验和
+
+        未提供校验和时现场计算；defer_hash=True 时先只记录大小和 mtime，
+        SHA-256 在后台线程中计算（不阻塞任务，同时把模型读入页缓存）。
+        """
+        path = Path(path or self.model_path(model_name))
+        stat = path.stat()
+        digest = sha256 or (None if defer_hash else sha256_file(path))
+        with self._locked_manifest() as manifest:
+            manifest[model_name] = {
+                "file": str(path),
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "sha256": digest,
+                "source": source,
+                "verified_at": time.time(),
+                "last_used": time.time(),
+                "use_count": manifest.get(model_name, {}).get("use_count", 0),
+            }
+        if digest is None:
+            logger.info(f"Registered model {model_name}: {stat.st_size / 1024 / 1024:.1f} MB, hashing in background")
+            self._hash_async(model_name, path)
+            return
+        logger.info(f"Registered model {model_name}: {stat.st_size / 1024 / 1024:.1f} MB, sha256 {digest[:12]}…")
+
+    def _hash_async(self, model_name: str, path: Path):
+        with self._warming_lock:
+            running = self._hashing.get(model_name)
+            if running is not None and running.is_alive():
+                return
+            thread = threading.Thread(target=self._hash_quietly, args=(model_name, path), daemon=True)
+            self._hashing[model_name] = thread
+            thread.start()
+
+    def _hash_quietly(self, model_name: str, path: Path):
+        """计算延后的 SHA-256；计算期间文件又被替换时丢弃结果"""
+        try:
+            stat = path.stat()
+            digest = sha256_file(path)
+            with self._locked_manifest() as manifest:
+                entry = manifest.get(model_name)
+                if (entry and entry.get("file") == str(path) and entry["size"] == stat.st_size
+                        and entry["mtime"] == stat.st_mtime and path.stat().st_mtime == stat.st_mtime):
+                    entry.update({"sha256": digest, "verified_at": time.time()})
+            logger.info(f"Model {model_name} sha256 {digest[:12]}…")
+        except Exception as e:
+            logger.warning(f"Could not hash model {model_name}: {e}")
+
+    def verify(self, model_name: str, path: Optional[Path] = None, deep: bool = False) -> bool:
+        """
+        Check a model file against the manifest.
+
+        The quick check compares size and mtime; a full SHA-256 pass runs when
+        deep=True or when a downloaded file changed on disk. Files that are not
+        in the manifest yet (copied in by hand, mounted), and such files that
+        were replaced since they were registered, are registered again with
+        their SHA-256 computed in the background, so a legitimately updated
+        mount does not fail every job until the manifest is edited.
+        """
+        path = Path(path or self.model_path(model_name))
+        if not path.exists():
+            return False
+        stat = path.stat()
+        with self._locked_manifest() as manifest:
+            entry = manifest.get(model_name)
+        if entry is None or entry.get("file") != str(path):
+            self.register(model_name, path, source="existing", defer_hash=True)
+            return True
+
+        changed = stat.st_size != entry["size"] or stat.st_mtime != entry["mtime"]
+        if changed and entry.get("source") != "download":
+            logger.info(f"Model file {path} changed on disk, registering it again")
+            self.register(model_name, path, source=entry.get("source", "existing"), defer_hash=True)
+            return True
+        if stat.st_size != entry["size"]:
+            logger.error(f"Model {model_name} size mismatch: {stat.st_size} != {entry['size']}")
+            return False
+        if not (deep or changed):
+            if not entry.get("sha256"):
+                self._hash_async(model_name, path)  # 上次后台计算没有完成（例如 worker 子进程已退出）
+            return True
+        digest = sha256_file(path)
+        if entry.get("sha256") and digest != entry["sha256"]:
+            logger.error(f"Model {model_name} checksum mismatch: {digest} != {entry['sha256']}")
+            return False
+        with self._locked_manifest() as manifest:
+            if model_name in manifest:
+                manifest[model_name].update({"mtime": stat.st_mtime, "sha256": digest, "verified_at": time.time()})
+        return True
+
+    def checksum(self, model_name: str) -> Optional[str]:
+        """清单中记录的 SHA-256"""
+        with self._locked_manifest() as manifest:
+            entry = manifest.get(model_name)
+        return entry["sha256"] if entry else None
+
+    def remove(self, model_name: str):
+        """删除模型文件和清单记录"""
+        with self._locked_manifest() as manifest:
+            entry = manifest.pop(model_name, None)
+        path = Path(entry["file"]) if entry else self.model_path(model_name)
+        if path.parent == self.models_dir:
+            path.unlink(missing_ok=True)
+
+    def touch(self, model_name: str):
+        """记录一次使用（LRU 依据）"""
+        with self._locked_manifest() as manifest:
+            if model_name in manifest:
+                manifest[model_name]["last_used"] = time.time()
+                manifest[model_name]["use_count"] = manifest[model_name].get("use_count", 0) + 1
+
+    def warm(self, model_name: str, path: Optional[Path] = None):
+        """
+        Ask the kernel to read the whole model into the page cache.
+
+        posix_fadvise(WILLNEED) starts asynchronous readahead; madvise on an
+        mmap of the file covers platforms without fadvise. Either way whisper.cpp
+        then loads the model from memory instead of from disk.
+        """
+        path = Path(path or self.model_path(model_name))
+        if not path.exists():
+            return
+        start = time.time()
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            if size and hasattr(mmap, "MADV_WILLNEED"):
+                with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mapped:
+                    mapped.madvise(mmap.MADV_WILLNEED)
+        logger.info(f"🔥 Warming page cache for model {model_name} ({size / 1024 / 1024:.0f} MB, "
+                    f"{time.time() - start:.2f}s to issue readahead)")
+
+    def warm_async(self, model_name: str, path: Optional[Path] = None):
+        """在后台线程中预热（例如在 ffmpeg 解码音频的同时读取模型）"""
+        with self._warming_lock:
+            running = self._warming.get(model_name)
+            if running is not None and running.is_alive():
+                return
+            thread = threading.Thread(target=self._warm_quietly, args=(model_name, path), daemon=True)
+            self._warming[model_name] = thread
+            thread.start()
+
+    def _warm_quietly(self, model_name: str, path: Optional[Path]):
+        try:
+            self.warm(model_name, path)
+        except Exception as e:
+            logger.warning(f"Could not warm model {model_name}: {e}")
+
+    def enforce_budget(self, keep: Iterable[str] = ()) -> List[str]:
+        """
+        超出磁盘预算时按最近使用时间淘汰模型；keep 中的模型、默认模型和最近
+        MODEL_EVICTION_MIN_IDLE 秒内用过的模型不会被淘汰
+        """
+        budget = int(settings.MODEL_DISK_BUDGET_GB * 1024 ** 3)
+        if budget <= 0:
+            return []
+        protected = set(keep) | {settings.MODEL_NAME}
+        now = time.time()
+        evicted = []
+        with self._locked_manifest() as manifest:
+            local = {
+                name: entry for name, entry in manifest.items()
+                if Path(entry["file"]).parent == self.models_dir and Path(entry["file"]).exists()
+            }
+            total = sum(entry["size"] for entry in local.values())
+            for name, entry in sorted(local.items(), key=lambda item: item[1].get("last_used", 0)):
+                if total <= budget:
+                    break
+                if name in protected or now - entry.get("last_used", 0) < settings.MODEL_EVICTION_MIN_IDLE:
+                    continue
+                Path(entry["file"]).unlink(missing_ok=True)
+                manifest.pop(name, None)
+                total -= entry["size"]
+                evicted.append(name)
+        if evicted:
+            logger.info(f"🗑️ Evicted models to stay within {settings.MODEL_DISK_BUDGET_GB} GB: {evicted}")
+        elif total > budget:
+            logger.warning(f"Model cache uses {total / 1024 ** 3:.1f} GB, above the "
+                           f"{settings.MODEL_DISK_BUDGET_GB} GB budget, but every model is in use")
+        return evicted
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        """每个模型是否已下载、是否在页缓存中（warm），供路由和 /models 使用"""
+        with self._locked_manifest() as manifest:
+            entries = dict(manifest)
+        result = {}
+        for model_name in settings.SUPPORTED_MODELS:
+            entry = entries.get(model_name)
+            path = Path(entry["file"]) if entry else self.model_path(model_name)
+            on_disk = path.exists()
+            resident = page_cache_fraction(path) if on_disk else None
+            result[model_name] = {
+                "downloaded": on_disk,
+                "size_bytes": path.stat().st_size if on_disk else None,
+                "verified": entry is not None,
+                "last_used": entry.get("last_used") if entry else None,
+                "resident_fraction": round(resident, 3) if resident is not None else None,
+                "warm": resident is not None and resident >= settings.MODEL_WARM_THRESHOLD,
+            }
+        return result
+
+    def warm_models(self) -> List[str]:
+        """已在页缓存中的模型（首个任务无需从磁盘读取）"""
+        return [name for name, info in self.status().items() if info["warm"]]
+
+
+# Global instance
+model_store = None
+
+
+def get_model_store(models_dir: Optional[Path] = None) -> ModelStore:
+    """Get global model store instance"""
+    global model_store
+    if model_store is None:
+        model_store = ModelStore(models_dir or Path(settings.MODELS_DIR))
+    return model_store
@@ -66,6 +66,20 @@ class TranscriptionResponse(BaseModel):
     message: str = Field(description="响应消息")
     model_used: str = Field(description="使用的模型")
     estimated_time: Optional[int] = Field(description="预估处理时间（秒）")
+    media_duration: Optional[float] = Field(default=None, description="媒体时长（秒）")
+    expected_cost: Optional[float] = Field(default=None, description="按实测实时率预估的转录耗时（秒）")
+    cached: bool = Field(default=False, description="结果来自结果缓存，任务已完成（未进入队列）")
+
+class UploadSessionResponse(BaseModel):
+    """可续传上传会话"""
+    upload_id: str = Field(description="上传会话ID，完成后即为 file_id")
+    filename: str = Field(description="原始文件名")
+    size: int = Field(description="文件总字节数")
+    chunk_size: int = Field(description="分块大小（字节），PUT 的 offset 必须是它的整数倍")
+    chunk_count: int = Field(description="分块数量")
+    received: List[List[int]] = Field(description="已收到的字节区间 [start, end)")
+    missing: List[List[int]] = Field(description="尚未收到的字节区间 [start, end)")
+    complete: bool = Field(description="所有分块均已收到，可以 finalize")
 
 class ModelInfo(BaseModel):
     """模型信息"""
@@ -74,6 +88,9 @@ class ModelInfo(BaseModel):
     speed: str = Field(description="相对速度")
     accuracy: str = Field(description="准确度描述")
     use_case: str = Field(description="适用场景")
+    downloaded: Optional[bool] = Field(default=None, description="模型文件是否已在本机")
+    warm: Optional[bool] = Field(default=None, description="模型是否已在页缓存中")
+    resident_fraction: Optional[float] = Field(default=None, description="页缓存中的比例")
 
 class ModelsListResponse(BaseModel):
     """模型列表响应"""
@@ -0,0 +1,113 @@
+"""
+Live progress parsed from whisper.cpp output
+"""
+import re
+import time
+import logging
+import threading
+from typing import Callable, Dict, Any, Optional
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# whisper-cli -pp: "whisper_print_progress_callback: progress =  45%"
+PROGRESS_PATTERN = re.compile(r"progress\s*=\s*(\d+)%")
+# 每个识别出的片段: "[00:01:02.340 --> 00:01:05.000]  text"
+SEGMENT_PATTERN = re.compile(r"^\[(\d+):(\d+):(\d+(?:\.\d+)?)\s*-->\s*(\d+):(\d+):(\d+(?:\.\d+)?)\]")
+
+ProgressCallback = Callable[[Dict[str, Any]], None]
+
+
+def _to_seconds(hours: str, minutes: str, seconds: str) -> float:
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+class WhisperProgressParser:
+    """
+    Turns whisper.cpp stdout/stderr lines into progress updates.
+
+    Both the -pp percentage lines and the per-segment timestamp lines are
+    used; whichever is further ahead wins, so progress never moves backwards.
+    """
+
+    def __init__(self, audio_duration: Optional[float] = None, callback: Optional[ProgressCallback] = None):
+        self.audio_duration = audio_duration
+        self.callback = callback
+        self.start_time = time.time()
+        self.percent = 0.0
+        self.audio_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def feed(self, line: str):
+        """处理一行输出（可能来自 stdout 或 stderr 的读取线程）"""
+        changed = False
+        with self._lock:
+            match = PROGRESS_PATTERN.search(line)
+            if match:
+                percent = float(match.group(1))
+                if percent > self.percent:
+                    self.percent = percent
+                    if self.audio_duration:
+                        self.audio_seconds = max(self.audio_seconds, self.audio_duration * percent / 100)
+                    changed = True
+
+            match = SEGMENT_PATTERN.match(line.strip())
+            if match:
+                segment_end = _to_seconds(*match.group(4, 5, 6))
+                if segment_end > self.audio_seconds:
+                    self.audio_seconds = segment_end
+                    if self.audio_duration:
+                        self.percent = max(self.percent, min(100.0, segment_end / self.audio_duration * 100))
+                    changed = True
+
+            snapshot = self.snapshot() if changed else None
+
+        if snapshot and self.callback:
+            try:
+                self.callback(snapshot)
+            except Exception as e:
+                logger.warning(f"Progress callback failed: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """当前进度：百分比、已处理音频秒数和实时率（处理耗时 / 音频时长）"""
+        elapsed = time.time() - self.start_time
+        return {
+            "percent": round(self.percent, 1),
+            "audio_seconds": round(self.audio_seconds, 2),
+            "audio_duration": self.audio_duration,
+            "elapsed": round(elapsed, 2),
+            "realtime_factor": round(elapsed / self.audio_seconds, 3) if self.audio_seconds > 0 else None,
+        }
+
+
+class ThrottledProgress:
+    """
+    Rate-limits progress updates so Celery result-backend writes stay cheap.
+
+    An update is forwarded when at least min_interval seconds passed since the
+    last one and the percentage moved by at least min_delta, or when the job
+    reaches 100%.
+    """
+
+    def __init__(self, callback: ProgressCallback, min_interval: float = None, min_delta: float = None):
+        self.callback = callback
+        self.min_interval = settings.PROGRESS_MIN_INTERVAL if min_interval is None else min_interval
+        self.min_delta = settings.PROGRESS_MIN_DELTA if min_delta is None else min_delta
+        self._last_time = 0.0
+        self._last_percent = -1.0
+        self._lock = threading.Lock()
+
+    def __call__(self, info: Dict[str, Any]):
+        with self._lock:
+            now = time.time()
+            percent = info.get("percent", 0.0)
+            is_final = percent >= 100
+            if not is_final:
+                if now - self._last_time < self.min_interval:
+                    return
+                if percent - self._last_percent < self.min_delta:
+                    return
+            self._last_time = now
+            self._last_percent = percent
+        self.callback(info)
@@ -0,0 +1,76 @@
+"""
+Shared Redis connection for the small pieces of cross-process state
+(measured real-time factors, caches, leases)
+"""
+import json
+import base64
+import logging
+from typing import Optional, List, Dict, Any
+
+import redis
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+_redis_client: Optional[redis.Redis] = None
+
+# 内存模型缓存的命中/未命中计数（所有 worker 汇总）
+MODEL_CACHE_STATS_KEY = "whisper:model_cache"
+
+
+def get_redis_client() -> redis.Redis:
+    """Get or create the global Redis client"""
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis(
+            host=settings.REDIS_HOST,
+            port=settings.REDIS_PORT,
+            password=settings.REDIS_PASSWORD,
+            db=settings.REDIS_DB,
+            decode_responses=True,
+            socket_timeout=5,
+        )
+    return _redis_client
+
+
+def model_cache_stats() -> Dict[str, Any]:
+    """所有 worker 汇总的模型缓存命中/未命中次数"""
+    stats = {key: int(value) for key, value in get_redis_client().hgetall(MODEL_CACHE_STATS_KEY).items()}
+    requests = stats.get("hits", 0) + stats.get("misses", 0)
+    stats["hit_rate"] = round(stats.get("hits", 0) / requests, 3) if requests else None
+    return stats
+
+
+def queued_transcription_params(queue: str = "celery", limit: int = 100) -> List[Dict[str, Any]]:
+    """
+    Peek at transcription jobs waiting in the Celery broker queue (Redis transport)
+
+    Returns the transcription_params of queued single-file and batch tasks,
+    oldest first, without consuming the messages. Used to prepare models for
+    jobs that are about to arrive.
+    """
+    try:
+        # Redis 传输用 LPUSH 入队、BRPOP 出队，列表尾部是最早的消息
+        messages = get_redis_client().lrange(queue, -limit, -1)
+    except redis.RedisError as e:
+        logger.debug(f"Could not peek at queue {queue}: {e}")
+        return []
+
+    params = []
+    for raw in reversed(messages):
+        try:
+            message = json.loads(raw)
+            body = message["body"]
+            if message.get("properties", {}).get("body_encoding") == "base64":
+                body = base64.b64decode(body)
+            args = json.loads(body)[0]
+            task_name = message.get("headers", {}).get("task", "")
+        except (ValueError, KeyError, IndexError, TypeError):
+            continue
+        if task_name.endswith("create_transcription_task") and len(args) >= 4 and isinstance(args[3], dict):
+            params.append(args[3])
+        elif task_name.endswith("create_batch_transcription_task") and args and isinstance(args[0], dict):
+            batch_params = args[0].get("transcription_params") or {}
+            params.extend(batch_params for _ in args[0].get("file_infos", []))
+    return params
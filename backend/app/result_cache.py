@@ -0,0 +1,98 @@
+"""
+Content-addressed transcription result cache
+
+Entries are keyed by (content hash, model, language, task, engine, engine
+version, cascade model) and hold the transcription segments, so a cache
+hit can render SRT/VTT in any output format without running a model.
+The directory is shared by the API and the workers and is size-bounded
+with least-recently-used eviction.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+from typing import Optional, Dict, Any
+
+from .config import settings
+from .disk_cache import DiskLRUCache
+
+logger = logging.getLogger(__name__)
+
+# 引擎版本由 worker 写入 Redis，API 进程可能没有安装引擎，用它计算相同的缓存键
+ENGINE_VERSIONS_KEY = "whisper:engine_versions"
+
+CACHE_FORMAT = 1
+
+
+def record_engine_version(engine_name: str, version: str):
+    try:
+        from .redis_store import get_redis_client
+        get_redis_client().hset(ENGINE_VERSIONS_KEY, engine_name, version)
+    except Exception as e:
+        logger.debug(f"Could not record engine version for {engine_name}: {e}")
+
+
+def engine_version(engine_name: str) -> Optional[str]:
+    """worker 上报的引擎版本（还没有 worker 运行过该引擎时为 None）"""
+    try:
+        from .redis_store import get_redis_client
+        return get_redis_client().hget(ENGINE_VERSIONS_KEY, engine_name)
+    except Exception as e:
+        logger.debug(f"Could not read engine version for {engine_name}: {e}")
+        return None
+
+
+def cache_key(content_hash: str, model_name: str, language: str, task_type: str, engine_name: str,
+              version: str, cascade_model: Optional[str] = None) -> str:
+    fields = [CACHE_FORMAT, content_hash, model_name, language, task_type, engine_name, version, cascade_model or ""]
+    return hashlib.sha256(json.dumps(fields).encode()).hexdigest()
+
+
+class ResultCache(DiskLRUCache):
+    """
+    One JSON file per entry under RESULT_CACHE_DIR/<key[:2]>/<key>.json
+
+    A hit refreshes the entry's mtime; see DiskLRUCache for eviction.
+    """
+
+    SUFFIX = ".json"
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None):
+        super().__init__(
+            cache_dir or settings.RESULT_CACHE_DIR,
+            settings.RESULT_CACHE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+        )
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        self._touch(path)
+        logger.info(f"♻️ Result cache hit {key[:12]}")
+        return entry
+
+    def put(self, key: str, entry: Dict[str, Any]):
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            temp.write_text(json.dumps({**entry, "cached_at": time.time()}, ensure_ascii=False), encoding="utf-8")
+            os.replace(temp, path)
+        except OSError as e:
+            logger.warning(f"Could not write result cache entry {key[:12]}: {e}")
+            return
+        self.evict(keep=[key])
+
+
+_result_cache: Optional[ResultCache] = None
+
+
+def get_result_cache() -> ResultCache:
+    """Get or create the global result cache"""
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = ResultCache()
+    return _result_cache
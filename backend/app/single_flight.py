@@ -0,0 +1,130 @@
+"""
+Single-flight coalescing of identical in-flight transcription jobs
+
+The first request for (content hash, model, language, task, engine, cascade
+model) takes a Redis lease naming its Celery task id. Identical requests
+that arrive while the lease is held are appended to the lease's follower
+list instead of being queued; when the leader finishes, its worker stores a
+result for every follower task id. Because the lease lives in Redis this
+works across API replicas and batch workers. A leader that never reaches
+its cleanup (worker process killed, task revoked) is noticed by /status,
+which releases the lease and fails the followers (see abandon_flight).
+"""
+import json
+import hashlib
+import logging
+from typing import Optional, Dict, Any, List, Tuple
+
+import redis
+
+from .redis_store import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+INFLIGHT_PREFIX = "whisper:inflight:"
+# 跟随任务 → {领头任务, 租约键}，/status 用它在跟随任务完成前报告领头任务的进度
+FOLLOWER_PREFIX = "whisper:follower:"
+
+
+def flight_key(content_hash: str, model_name: str, language: str, task_type: str, engine_name: str,
+               cascade_model: Optional[str] = None) -> str:
+    fields = [content_hash, model_name, language, task_type, engine_name, cascade_model or ""]
+    return hashlib.sha256(json.dumps(fields).encode()).hexdigest()
+
+
+def join_flight(key: str, task_id: str, ttl: int, follower: Dict[str, Any]) -> Optional[str]:
+    """
+    Take the lease for key, or attach to the task that holds it
+
+    Returns None when task_id became the leader (the caller must queue it),
+    otherwise the leader's task id; follower ({task_id, file_id,
+    original_filename, output_format}) is then resolved by the leader.
+    Redis errors make the caller a leader, i.e. no coalescing.
+    """
+    client = get_redis_client()
+    lease, followers = INFLIGHT_PREFIX + key, INFLIGHT_PREFIX + key + ":followers"
+    try:
+        while True:
+            if client.set(lease, task_id, nx=True, ex=ttl):
+                return None
+            with client.pipeline() as pipe:
+                try:
+                    # 与 release_flight 互斥：租约在 WATCH 之后被释放时 EXEC 失败，重新抢租约
+                    pipe.watch(lease)
+                    leader = pipe.get(lease)
+                    if leader is None:
+                        continue
+                    pipe.multi()
+                    pipe.rpush(followers, json.dumps(follower))
+                    pipe.expire(followers, ttl)
+                    pipe.set(FOLLOWER_PREFIX + follower["task_id"], json.dumps({"leader": leader, "key": key}), ex=ttl)
+                    pipe.execute()
+                    return leader
+                except redis.WatchError:
+                    continue
+    except redis.RedisError as e:
+        logger.debug(f"Single-flight unavailable for {key[:12]}: {e}")
+        return None
+
+
+def release_flight(key: str, task_id: str) -> List[Dict[str, Any]]:
+    """释放 task_id 持有的租约，返回挂在它上面的跟随任务（租约已被其他任务接管时返回空列表）"""
+    client = get_redis_client()
+    lease, followers = INFLIGHT_PREFIX + key, INFLIGHT_PREFIX + key + ":followers"
+    try:
+        with client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(lease)
+                    leader = pipe.get(lease)
+                    if leader not in (None, task_id):
+                        pipe.unwatch()
+                        return []
+                    pipe.multi()
+                    pipe.lrange(followers, 0, -1)
+                    pipe.delete(followers, lease)
+                    attached, _ = pipe.execute()
+                    return [json.loads(follower) for follower in attached]
+                except redis.WatchError:
+                    continue
+    except redis.RedisError as e:
+        logger.warning(f"Could not release single-flight lease {key[:12]}: {e}")
+        return []
+
+
+def flight_of(task_id: str) -> Optional[Tuple[str, str]]:
+    """跟随任务所挂靠的（领头任务 ID，租约键）；不是跟随任务时为 None"""
+    try:
+        value = get_redis_client().get(FOLLOWER_PREFIX + task_id)
+    except redis.RedisError as e:
+        logger.debug(f"Could not read single-flight leader of {task_id}: {e}")
+        return None
+    if not value:
+        return None
+    try:
+        record = json.loads(value)
+        return record["leader"], record["key"]
+    except (ValueError, TypeError, KeyError):
+        return value, None  # 旧格式：只记录了领头任务 ID
+
+
+def flight_leader(task_id: str) -> Optional[str]:
+    """跟随任务所挂靠的领头任务 ID（不是跟随任务时为 None）"""
+    flight = flight_of(task_id)
+    return flight[0] if flight else None
+
+
+def abandon_flight(key: Optional[str], leader_task_id: str, follower_task_id: str) -> List[Dict[str, Any]]:
+    """
+    Release a lease whose leader ended without resolving its followers
+
+    Returns the followers that were still attached (the caller records them
+    as failed) and forgets follower_task_id's link to the leader. When the
+    leader's own cleanup already released the lease, nothing is returned.
+    """
+    followers = release_flight(key, leader_task_id) if key else []
+    try:
+        get_redis_client().delete(FOLLOWER_PREFIX + follower_task_id)
+    except redis.RedisError as e:
+        logger.debug(f"Could not forget single-flight leader of {follower_task_id}: {e}")
+    return followers
@@ -0,0 +1,209 @@
+"""
+Deterministic synthetic transcription for load testing without models
+
+Used by the `synthetic` engine (in-process) and by scripts/fake_whisper_cli.py,
+a drop-in whisper-cli replacement. Both produce whisper.cpp-shaped JSON whose
+text depends only on the input audio, model and seed, and spend time, CPU and
+memory as a function of audio duration and model, so the FastAPI → Celery →
+Redis → subtitle pipeline can be load-tested on any Linux box.
+
+This module must not import app.config: the fake CLI runs without Settings
+and reads the same SYNTHETIC_* names from the environment.
+"""
+import time
+import hashlib
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Callable, Mapping, Union
+
+import numpy as np
+
+from .audio import TARGET_SAMPLE_RATE, read_pcm16_wav
+
+# 每秒音频的处理秒数（约为 4 线程 CPU 上 whisper.cpp 的量级）
+SYNTHETIC_MODEL_RTF = {
+    "tiny": 0.04, "base": 0.08, "small": 0.2, "medium": 0.55,
+    "large-v1": 1.0, "large-v2": 1.0, "large-v3": 1.0, "large-v3-turbo": 0.3,
+}
+# 推理时的常驻内存（MB）
+SYNTHETIC_MODEL_MEMORY_MB = {
+    "tiny": 80, "base": 160, "small": 500, "medium": 1600,
+    "large-v1": 3300, "large-v2": 3300, "large-v3": 3300, "large-v3-turbo": 1700,
+}
+# token 概率 Beta(a, 1.2) 的 a：越大的模型越“自信”
+SYNTHETIC_MODEL_CONFIDENCE = {
+    "tiny": 3.0, "base": 5.0, "small": 8.0, "medium": 12.0,
+    "large-v1": 18.0, "large-v2": 20.0, "large-v3": 20.0, "large-v3-turbo": 16.0,
+}
+
+PROFILE_FIELDS = {
+    "SYNTHETIC_RTF_SCALE": float,
+    "SYNTHETIC_CPU_FRACTION": float,
+    "SYNTHETIC_MEMORY_SCALE": float,
+    "SYNTHETIC_FAILURE_RATE": float,
+    "SYNTHETIC_LOAD_SECONDS": float,
+    "SYNTHETIC_SEED": int,
+}
+
+WORDS = (
+    "the a of to and in that it is was for on are as with his they at be this from have or by one had not "
+    "but what all were when we there can an your which their said if do will each about how up out them then "
+    "she many some so these would other into has more her two like him see time could no make than first been "
+    "its who now people my made over did down only way find use may water long little very after words called "
+    "just where most know get through back much before go good new write our used me man too any day same right"
+).split()
+
+LANGUAGES = ["en", "zh", "ja", "ko", "es", "fr", "de", "ru"]
+
+ProgressCallback = Callable[[float], None]
+
+
+def _model_key(model_name: str) -> str:
+    """ggml-base.en.bin / base.en / base-q5_1 → base"""
+    name = Path(model_name).name
+    if name.startswith("ggml-"):
+        name = name[len("ggml-"):]
+    if name.endswith(".bin"):
+        name = name[:-len(".bin")]
+    for key in sorted(SYNTHETIC_MODEL_RTF, key=len, reverse=True):
+        if name.startswith(key):
+            return key
+    return "base"
+
+
+class SyntheticProfile:
+    """Cost and failure model of the synthetic engine"""
+
+    def __init__(self, rtf_scale: float = 1.0, cpu_fraction: float = 1.0, memory_scale: float = 1.0,
+                 failure_rate: float = 0.0, load_seconds: float = 0.5, seed: int = 0):
+        self.rtf_scale = rtf_scale
+        self.cpu_fraction = min(1.0, max(0.0, cpu_fraction))
+        self.memory_scale = memory_scale
+        self.failure_rate = failure_rate
+        self.load_seconds = load_seconds
+        self.seed = seed
+
+    @classmethod
+    def from_mapping(cls, values: Mapping[str, Any]) -> "SyntheticProfile":
+        """从 Settings 或环境变量（SYNTHETIC_* 同名）构建"""
+        kwargs = {}
+        for key, cast in PROFILE_FIELDS.items():
+            if values.get(key) not in (None, ""):
+                kwargs[key[len("SYNTHETIC_"):].lower()] = cast(values[key])
+        return cls(**kwargs)
+
+    def processing_seconds(self, model_name: str, duration: float) -> float:
+        return self.load_seconds + SYNTHETIC_MODEL_RTF[_model_key(model_name)] * duration * self.rtf_scale
+
+    def memory_bytes(self, model_name: str) -> int:
+        return int(SYNTHETIC_MODEL_MEMORY_MB[_model_key(model_name)] * self.memory_scale * 1024 * 1024)
+
+    def should_fail(self, key: str) -> bool:
+        """按输入确定是否失败：同一输入每次结果相同，便于复现"""
+        if self.failure_rate <= 0:
+            return False
+        digest = hashlib.sha256(f"fail:{self.seed}:{key}".encode()).digest()
+        return int.from_bytes(digest[:8], "big") / 2 ** 64 < self.failure_rate
+
+
+def input_key(audio: Union[str, Path, np.ndarray], model_name: str) -> str:
+    """
+    输入音频 + 模型的确定性标识：样本数和开头 30 秒 16-bit PCM 的哈希
+
+    同一段音频无论以 WAV 文件还是内存数组（int16 或 float32）传入，结果都相同。
+    """
+    if isinstance(audio, np.ndarray):
+        samples = audio
+        if samples.dtype != np.int16:
+            samples = np.clip(np.round(samples * 32768.0), -32768, 32767).astype(np.int16)
+    else:
+        samples, _ = read_pcm16_wav(audio)
+    digest = hashlib.sha256(_model_key(model_name).encode())
+    digest.update(str(len(samples)).encode())
+    digest.update(np.ascontiguousarray(samples[:30 * TARGET_SAMPLE_RATE], dtype="<i2").tobytes())
+    return digest.hexdigest()
+
+
+def simulate_work(seconds: float, cpu_fraction: float, memory_bytes: int,
+                  progress: Optional[ProgressCallback] = None, tick: float = 0.05):
+    """
+    Spend `seconds` of wall time holding `memory_bytes` of touched memory,
+    busy-looping for cpu_fraction of every tick and sleeping the rest.
+    """
+    page = 4096
+    footprint = bytearray(memory_bytes)
+    for offset in range(0, memory_bytes, page):
+        footprint[offset] = 1  # 写入每一页，让内存真正驻留
+
+    start = time.monotonic()
+    while True:
+        elapsed = time.monotonic() - start
+        if elapsed >= seconds:
+            break
+        slice_end = min(seconds, elapsed + tick) + start
+        busy_until = time.monotonic() + (slice_end - time.monotonic()) * cpu_fraction
+        x = 0
+        while time.monotonic() < busy_until:
+            x += 1
+        remaining = slice_end - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        if progress is not None:
+            progress(min(1.0, (time.monotonic() - start) / seconds))
+    del footprint
+
+
+def _timestamp(seconds: float) -> str:
+    ms = int(round(seconds * 1000))
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d},{ms % 1000:03d}"
+
+
+def synthetic_transcription(key: str, duration: float, model_name: str, language: str = "auto",
+                            translate: bool = False, full: bool = False, seed: int = 0) -> Dict[str, Any]:
+    """
+    whisper.cpp `-oj` 格式的结果（full=True 时附带 `-ojf` 的 token 和概率）
+
+    片段 2–6 秒，中间有短停顿；文本由固定词表按 key 确定性生成。
+    """
+    rng = np.random.default_rng(int.from_bytes(hashlib.sha256(f"{seed}:{key}".encode()).digest()[:8], "big"))
+    detected = LANGUAGES[int(rng.integers(len(LANGUAGES)))]
+    if language != "auto":
+        detected = language
+    if translate:
+        detected = "en"
+
+    transcription: List[Dict[str, Any]] = []
+    position = float(rng.uniform(0.0, 0.8))
+    while position < duration - 0.5:
+        end = min(duration, position + float(rng.uniform(2.0, 6.0)))
+        n_words = max(1, int((end - position) * rng.uniform(1.8, 3.0)))
+        words = [WORDS[int(i)] for i in rng.integers(len(WORDS), size=n_words)]
+        words[0] = words[0].capitalize()
+        text = " " + " ".join(words) + "."
+        segment = {
+            "timestamps": {"from": _timestamp(position), "to": _timestamp(end)},
+            "offsets": {"from": int(position * 1000), "to": int(end * 1000)},
+            "text": text,
+        }
+        if full:
+            step = (end - position) / n_words
+            segment["tokens"] = [
+                {
+                    "text": " " + word,
+                    "timestamps": {"from": _timestamp(position + i * step), "to": _timestamp(position + (i + 1) * step)},
+                    "offsets": {"from": int((position + i * step) * 1000), "to": int((position + (i + 1) * step) * 1000)},
+                    "id": int(rng.integers(50000)),
+                    "p": round(float(rng.beta(SYNTHETIC_MODEL_CONFIDENCE[_model_key(model_name)], 1.2)), 6),
+                    "t_dtw": -1,
+                }
+                for i, word in enumerate(words)
+            ]
+        transcription.append(segment)
+        position = end + float(rng.uniform(0.2, 1.5))
+
+    return {
+        "systeminfo": "SYNTHETIC = 1",
+        "model": {"type": _model_key(model_name), "multilingual": ".en" not in Path(model_name).name},
+        "params": {"model": model_name, "language": language, "translate": translate},
+        "result": {"language": detected},
+        "transcription": transcription,
+    }
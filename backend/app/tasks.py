@@ -1,5 +1,7 @@
 import os
 import json
+import math
+import shutil
 import logging
 from celery import Celery
 from .config import settings
@@ -10,6 +12,21 @@ import time
 from datetime import datetime, timedelta
 import requests
 from .whisper_manager import get_whisper_manager
+from .audio import is_normalized_wav, wav_duration
+from .chunking import transcribe_chunked, transcribe_stream
+from .audio_stream import FFmpegPCMStream
+from .audio_cache import audio_cache_key, get_audio_cache
+from .vad import prepare_speech_audio, remap_segments
+from .workspace import JobWorkspace
+from .progress import ThrottledProgress
+from .media_info import get_media_info, select_audio_stream, sidecar_path
+from .cost_model import estimate_job, subprocess_timeout
+from .cpu_planner import get_cpu_planner
+from .engines import get_engine
+from .cascade import transcribe_cascade
+from .language_detect import detect_language, is_confident, route_model
+from .result_cache import cache_key, get_result_cache, record_engine_version
+from .single_flight import flight_key, join_flight, release_flight, abandon_flight
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Configure logging
@@ -32,7 +49,9 @@ RESULTS_DIR = Path(settings.RESULTS_DIR)
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 RESULTS_DIR.mkdir(parents=True, exist_ok=True)
 
-def transcribe_with_whisper(audio_file_path: str, model_name: str = None, language: str = None, task_type: str = None) -> Dict[str, Any]:
+def transcribe_with_whisper(audio_file_path: str, model_name: str = None, language: str = None, task_type: str = None,
+                            work_dir: str = None, progress_callback=None, engine_name: str = None,
+                            cascade_model: str = None, media_duration: float = None) -> Dict[str, Any]:
     """
     Use OpenAI Whisper for transcription with optimized settings
     
@@ -41,6 +60,11 @@ def transcribe_with_whisper(audio_file_path: str, model_name: str = None, langua
         model_name: 模型名称 (覆盖默认配置)
         language: 语言代码 (覆盖默认配置)
         task_type: 任务类型 (覆盖默认配置)
+        work_dir: 任务工作目录 (whisper 输出和分块音频写在这里)
+        progress_callback: 转录进度回调 (解析自 whisper.cpp 输出)
+        engine_name: 转录引擎 (覆盖 TRANSCRIPTION_ENGINE，见 engines.py)
+        cascade_model: 级联模式的大模型 (可选，model_name 作为草稿模型，只重转低置信度片段，见 cascade.py)
+        media_duration: 探测得到的媒体时长 (输入不是 WAV 时用于 CPU 规划和子进程超时)
     """
     start_time = time.time()
     
@@ -54,14 +78,69 @@ def transcribe_with_whisper(audio_file_path: str, model_name: str = None, langua
         logger.info(f"Model: {final_model_name}, Language: {final_language}, Task: {final_task_type}")
         logger.info(f"Transcription started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         
-        # Get whisper manager and perform transcription with dynamic parameters
-        whisper_manager = get_whisper_manager()
-        result = whisper_manager.transcribe(
-            audio_file_path, 
-            model_name=final_model_name,
-            language=final_language,
-            task_type=final_task_type
-        )
+        # Get the transcription engine and perform transcription with dynamic parameters
+        engine = get_engine(engine_name)
+        logger.info(f"Engine: {engine.name}")
+        capabilities = engine.capabilities()
+        audio_duration = wav_duration(audio_file_path) if is_normalized_wav(audio_file_path) else None
+        use_chunking = (settings.CHUNKING_ENABLED and audio_duration is not None
+                        and capabilities["parallel_chunks"]
+                        and audio_duration >= settings.CHUNKING_MIN_DURATION)
+        parallel = math.ceil(audio_duration / settings.CHUNK_TARGET_SECONDS) if use_chunking else 1
+        parallel = min(parallel, capabilities.get("max_parallel_chunks") or parallel)
+        
+        use_cascade = bool(cascade_model) and cascade_model != final_model_name
+        if use_cascade and (audio_duration is None or not capabilities.get("confidence")):
+            # 无法判断置信度（非 WAV 输入或引擎不提供单词概率）时直接使用大模型
+            logger.warning(f"Cannot cascade with engine {engine.name} on this input, "
+                           f"transcribing with {cascade_model} instead")
+            final_model_name, use_cascade = cascade_model, False
+        
+        # 按物理核心、空闲容量和音频时长为本任务预留线程（和可选的绑核）
+        with get_cpu_planner().reserve(audio_duration or media_duration, parallel=parallel,
+                                       job_id=Path(audio_file_path).stem) as cpu_plan:
+            def _run(path: str, model: str, run_language: str, callback=None, **options) -> Dict[str, Any]:
+                if audio_duration is None and media_duration:
+                    # 原始媒体直接交给引擎时，按探测的时长计算超时
+                    options.setdefault("timeout", subprocess_timeout(model, media_duration))
+                if use_chunking and wav_duration(path) >= settings.CHUNKING_MIN_DURATION:
+                    # 长音频在静音处切分，多个 whisper 进程并行转录
+                    return transcribe_chunked(
+                        path,
+                        engine,
+                        model_name=model,
+                        language=run_language,
+                        task_type=final_task_type,
+                        work_dir=str(Path(work_dir) / "chunks") if work_dir else None,
+                        progress_callback=callback,
+                        cpu_plan=cpu_plan,
+                        **options
+                    )
+                return engine.transcribe(
+                    path,
+                    model_name=model,
+                    language=run_language,
+                    task_type=final_task_type,
+                    threads=cpu_plan.threads,
+                    output_dir=work_dir,
+                    progress_callback=callback,
+                    affinity=cpu_plan.affinity,
+                    **options
+                )
+            
+            if use_cascade:
+                result = transcribe_cascade(
+                    audio_file_path,
+                    _run,
+                    draft_model=final_model_name,
+                    final_model=cascade_model,
+                    language=None if final_language == "auto" else final_language,
+                    work_dir=work_dir,
+                    progress_callback=progress_callback
+                )
+            else:
+                result = _run(audio_file_path, final_model_name, final_language, progress_callback)
+        result["cpu_plan"] = cpu_plan.to_dict()
         
         end_time = time.time()
         total_duration = end_time - start_time
@@ -78,6 +157,67 @@ def transcribe_with_whisper(audio_file_path: str, model_name: str = None, langua
         logger.error(f"Transcription failed: {e}")
         raise
 
+def transcribe_stream_with_whisper(input_path: str, model_name: str = None, language: str = None, task_type: str = None,
+                                   media_duration: float = None, work_dir: str = None, progress_callback=None,
+                                   engine_name: str = None, first_chunk_hook=None,
+                                   audio_stream: int = None, audio_key: str = None) -> Dict[str, Any]:
+    """
+    Decode any media file with ffmpeg into a ring buffer and transcribe it chunk by chunk while it decodes
+    
+    不写中间 WAV：VAD 和分块直接作用在解码出的 PCM 上（见 audio_stream.py 和 chunking.transcribe_stream）。
+    
+    Args:
+        input_path: 原始媒体文件（视频或任意音频格式）
+        media_duration: 上传时探测的时长 (用于进度和 CPU 规划，可为空)
+        first_chunk_hook: 第一个分块转录前调用，可返回覆盖 language / model_name 的字典
+        audio_stream: 要解码的音频流序号 (ffmpeg -map 0:a:N，见 media_info.select_audio_stream)
+        audio_key: 解码音频缓存的键 (可选)，解码的同时写出 WAV，完整解码后放入缓存
+        其他参数同 transcribe_with_whisper
+    """
+    start_time = time.time()
+    final_model_name = model_name or settings.MODEL_NAME
+    final_language = language or settings.WHISPER_LANGUAGE
+    final_task_type = task_type or settings.WHISPER_TASK
+    
+    engine = get_engine(engine_name)
+    logger.info(f"🌊 Streaming decode of {input_path} into {engine.name} ({final_model_name}, {final_language})")
+    parallel = 1
+    capabilities = engine.capabilities()
+    if media_duration and capabilities["parallel_chunks"]:
+        parallel = math.ceil(media_duration / settings.CHUNK_TARGET_SECONDS)
+        parallel = min(parallel, capabilities.get("max_parallel_chunks") or parallel)
+    
+    tee_path = get_audio_cache().reserve(audio_key) if audio_key else None
+    committed = False
+    try:
+        with get_cpu_planner().reserve(media_duration, parallel=parallel, job_id=Path(input_path).stem) as cpu_plan:
+            with FFmpegPCMStream(input_path, audio_stream=audio_stream, tee_path=tee_path) as stream:
+                result = transcribe_stream(
+                    stream,
+                    engine,
+                    model_name=final_model_name,
+                    language=final_language,
+                    task_type=final_task_type,
+                    total_seconds=media_duration,
+                    work_dir=str(Path(work_dir) / "chunks") if work_dir else None,
+                    progress_callback=progress_callback,
+                    cpu_plan=cpu_plan,
+                    first_chunk_hook=first_chunk_hook
+                )
+        if tee_path is not None and stream.completed:
+            committed = get_audio_cache().commit(audio_key, tee_path) is not None
+    finally:
+        # 异常、超时或解码不完整时删除写了一半的 WAV：它不计入缓存大小，淘汰也看不到它
+        if tee_path is not None and not committed:
+            tee_path.unlink(missing_ok=True)
+    result["cpu_plan"] = cpu_plan.to_dict()
+    
+    total_duration = time.time() - start_time
+    logger.info(f"Total processing time: {total_duration:.2f} seconds")
+    result["total_processing_time"] = total_duration
+    result["total_processing_time_formatted"] = str(timedelta(seconds=int(total_duration)))
+    return result
+
 def format_timestamp(seconds):
     """Convert seconds to SRT timestamp format"""
     assert seconds >= 0, "non-negative timestamp expected"
@@ -199,18 +339,181 @@ def generate_subtitles_from_segments(segments, srt_path: Path, vtt_path: Path):
         total_generated = segment_id - 1
         logger.info(f"🎉 Generated {total_generated} subtitle entries")
 
-def safe_update_state(self, state, meta=None):
-    """Safe wrapper for update_state that works both in Celery and direct call contexts"""
+def write_subtitle_files(segments, output_dir: Path, stem: str, output_format: str,
+                         version: str = "final") -> List[dict]:
+    """
+    按 output_format 生成字幕文件：先写入临时文件，再用 os.replace 原子替换
+    
+    草稿版本写入 <stem>.draft.srt / <stem>.draft.vtt，与最终版本的文件名不同，
+    客户端和缓存不会把两者混淆；最终版本替换时也不会被读到写了一半的文件。
+    """
+    suffix = ".draft" if version == "draft" else ""
+    temp_srt = output_dir / f".{stem}{suffix}.srt.tmp"
+    temp_vtt = output_dir / f".{stem}{suffix}.vtt.tmp"
+    generate_subtitles_from_segments(segments, temp_srt, temp_vtt)
+    
+    files = []
+    for subtitle_type, temp_path in (("srt", temp_srt), ("vtt", temp_vtt)):
+        if output_format in (subtitle_type, "both"):
+            filename = f"{stem}{suffix}.{subtitle_type}"
+            path = output_dir / filename
+            os.replace(temp_path, path)
+            files.append({"type": subtitle_type, "filename": filename, "path": str(path), "version": version})
+        else:
+            temp_path.unlink(missing_ok=True)
+    return files
+
+def cached_transcription_result(entry: dict, original_filename: str, file_id: str, output_format: str,
+                                transcription_params: dict, media_duration=None, start_time: float = None) -> dict:
+    """
+    用结果缓存中的片段生成字幕文件，返回与转录任务相同结构的结果
+    
+    API（命中时不进入队列）和 worker 共用，前端无需区分结果来源。
+    """
+    start_time = start_time or time.time()
+    output_dir = RESULTS_DIR / file_id
+    output_dir.mkdir(parents=True, exist_ok=True)
+    generated_files = write_subtitle_files(entry["segments"], output_dir, Path(original_filename).stem, output_format)
+    total_time = time.time() - start_time
+    logger.info(f"♻️ Rendered subtitles for {original_filename} from stored segments in {total_time:.2f}s")
+    return {
+        "status": "Completed",
+        "files": generated_files,
+        "original_filename": original_filename,
+        "file_id": file_id,
+        "full_text": entry.get("text", ""),
+        "media_duration": media_duration if media_duration is not None else entry.get("media_duration"),
+        "cache": {"hit": True, "cached_at": entry.get("cached_at")},
+        "transcription_params": {
+            "model": entry.get("model", transcription_params.get("model")),
+            "language": entry.get("language", transcription_params.get("language")),
+            "output_format": output_format,
+            "task_type": transcription_params.get("task"),
+            "engine": entry.get("engine", transcription_params.get("engine")),
+            "cascade_model": transcription_params.get("cascade_model"),
+            "draft": False
+        },
+        "timing": {
+            "total_time": total_time,
+            "total_time_formatted": str(timedelta(seconds=int(total_time))),
+            "transcription_time": 0,
+            "subtitle_generation_time": total_time,
+            "start_time": datetime.fromtimestamp(start_time).isoformat(),
+            "end_time": datetime.now().isoformat()
+        }
+    }
+
+def submit_transcription(file_path: str, file_id: str, original_filename: str, transcription_params: dict,
+                         media_info: dict = None, time_limits: dict = None):
+    """
+    入队转录任务；相同内容和参数的任务已在排队或运行时，挂到该任务上（single-flight）
+    
+    返回 (AsyncResult, leader_task_id)。leader_task_id 不为 None 时本任务不会单独运行，
+    上传文件随即删除，领头任务完成后由其 worker 写入本任务的结果。
+    """
+    time_limits = time_limits or {}
+    task_id = str(uuid.uuid4())
+    key = None
+    content_hash = (media_info or {}).get("content_hash")
+    if settings.SINGLE_FLIGHT_ENABLED and content_hash:
+        key = flight_key(
+            content_hash,
+            transcription_params.get("model", settings.MODEL_NAME),
+            transcription_params.get("language", settings.WHISPER_LANGUAGE),
+            transcription_params.get("task", settings.WHISPER_TASK),
+            transcription_params.get("engine") or settings.TRANSCRIPTION_ENGINE,
+            transcription_params.get("cascade_model") or settings.CASCADE_MODEL or None
+        )
+        ttl = settings.SINGLE_FLIGHT_LEASE_SECONDS + time_limits.get("time_limit", 0)
+        leader_task_id = join_flight(key, task_id, ttl, {
+            "task_id": task_id,
+            "file_id": file_id,
+            "original_filename": original_filename,
+            "output_format": transcription_params.get("output_format", "both"),
+        })
+        if leader_task_id:
+            logger.info(f"🔗 {original_filename} matches in-flight task {leader_task_id}, attached as {task_id}")
+            for path in (Path(file_path), sidecar_path(file_path)):
+                path.unlink(missing_ok=True)
+            return create_transcription_task.AsyncResult(task_id), leader_task_id
+    
+    try:
+        task_result = create_transcription_task.apply_async(
+            args=[file_path, file_id, original_filename, transcription_params],
+            kwargs={"media_info": media_info, "single_flight_key": key},
+            task_id=task_id,
+            **time_limits
+        )
+    except Exception:
+        if key:
+            release_flight(key, task_id)
+        raise
+    return task_result, None
+
+def resolve_followers(task, key: str, entry: dict = None, error: str = None, transcription_params: dict = None):
+    """领头任务结束后释放租约，并为每个跟随任务写入结果（成功时按各自的文件名和格式生成字幕）"""
+    task_id = task.request.id if hasattr(task, 'request') else None
+    if not task_id:
+        return
+    followers = release_flight(key, task_id)
+    for follower in followers:
+        try:
+            if entry is not None:
+                result = cached_transcription_result(entry, follower["original_filename"], follower["file_id"],
+                                                     follower["output_format"], transcription_params or {})
+                result["cache"] = {"hit": False}
+                result["single_flight"] = {"leader_task_id": task_id}
+                task.backend.store_result(follower["task_id"], result, "SUCCESS")
+            else:
+                task.backend.store_result(follower["task_id"],
+                                          RuntimeError(error or f"Shared transcription task {task_id} failed"),
+                                          "FAILURE")
+        except Exception as e:
+            logger.warning(f"Could not resolve attached task {follower.get('task_id')}: {e}")
+    if followers:
+        logger.info(f"🔗 Resolved {len(followers)} attached task(s) from {task_id}")
+
+# 领头任务以这些状态结束时可能没有执行 finally（worker 子进程被杀、任务被撤销），跟随任务不会被写入结果
+LEADER_LOST_STATES = ("FAILURE", "REVOKED")
+
+def abandon_lost_leader(task_id: str, leader_task_id: str, key: str, leader_state: str) -> str:
+    """
+    /status 发现跟随任务 task_id 的领头任务已失败或被撤销时调用：释放租约，把仍挂在
+    上面的跟随任务（包括 task_id）记为失败，避免它们一直停在 PENDING。返回失败信息
+    """
+    message = f"Shared transcription task {leader_task_id} ended with {leader_state}"
+    followers = {follower["task_id"] for follower in abandon_flight(key, leader_task_id, task_id)}
+    backend = create_transcription_task.backend
+    for follower_task_id in followers | {task_id}:
+        # 领头任务的 finally 可能已经为 task_id 写入结果
+        if follower_task_id == task_id and task_id not in followers \
+                and create_transcription_task.AsyncResult(task_id).state != 'PENDING':
+            continue
+        try:
+            backend.store_result(follower_task_id, RuntimeError(message), "FAILURE")
+        except Exception as e:
+            logger.warning(f"Could not fail attached task {follower_task_id}: {e}")
+    logger.warning(f"🔗 {message}; failed {len(followers | {task_id})} attached task(s)")
+    return message
+
+def safe_update_state(self, state, meta=None, task_id=None):
+    """Safe wrapper for update_state that works both in Celery and direct call contexts
+    
+    task_id 需要在从其他线程（如 whisper 输出读取线程）上报进度时显式传入，
+    因为 self.request 是线程本地的。
+    """
     try:
-        if hasattr(self, 'update_state') and hasattr(self, 'request') and self.request.id:
-            self.update_state(state=state, meta=meta)
+        task_id = task_id or (self.request.id if hasattr(self, 'request') else None)
+        if hasattr(self, 'update_state') and task_id:
+            self.update_state(task_id=task_id, state=state, meta=meta)
         else:
             logger.info(f"State update: {state} - {meta}")
     except Exception as e:
         logger.warning(f"Could not update state: {e}")
 
 @celery_app.task(bind=True, name="app.tasks.create_transcription_task")
-def create_transcription_task(self, input_filepath_str: str, file_id: str, original_filename: str, transcription_params: dict = None):
+def create_transcription_task(self, input_filepath_str: str, file_id: str, original_filename: str, transcription_params: dict = None,
+                              media_info: dict = None, single_flight_key: str = None):
     """
     Process audio/video file and generate transcription with OpenAI Whisper
     
@@ -218,7 +521,9 @@ def create_transcription_task(self, input_filepath_str: str, file_id: str, origi
         input_filepath_str: 输入文件路径
         file_id: 文件ID
         original_filename: 原始文件名
-        transcription_params: 转录参数 {model, language, output_format, task}
+        transcription_params: 转录参数 {model, language, output_format, task, engine, cascade_model, draft, no_cache}
+        media_info: 上传时已探测的媒体信息 (可选，未提供时在任务中探测一次)
+        single_flight_key: single-flight 租约键 (见 submit_transcription)，结束时为挂在本任务上的相同请求写入结果
     """
     # Record overall start time
     overall_start_time = time.time()
@@ -232,9 +537,13 @@ def create_transcription_task(self, input_filepath_str: str, file_id: str, origi
     language = transcription_params.get("language", settings.WHISPER_LANGUAGE)
     output_format = transcription_params.get("output_format", "both")
     task_type = transcription_params.get("task", settings.WHISPER_TASK)
+    engine_name = transcription_params.get("engine") or settings.TRANSCRIPTION_ENGINE
+    cascade_model = transcription_params.get("cascade_model") or settings.CASCADE_MODEL or None
+    draft_enabled = bool(transcription_params.get("draft", False)) and model_name != settings.DRAFT_MODEL
     
     logger.info(f"📁 Starting transcription task for file: {original_filename}")
-    logger.info(f"🤖 Using model: {model_name}")
+    logger.info(f"🤖 Using model: {model_name} ({engine_name})"
+                + (f", cascading low-confidence spans to {cascade_model}" if cascade_model else ""))
     logger.info(f"🌐 Language: {language}")
     logger.info(f"📄 Output format: {output_format}")
     logger.info(f"🎯 Task type: {task_type}")
@@ -247,39 +556,133 @@ def create_transcription_task(self, input_filepath_str: str, file_id: str, origi
     audio_file_to_transcribe = input_filepath
     temp_audio_path = None
     
+    # 每个任务独立的临时目录：提取的音频、VAD 压缩音频、分块和 whisper 输出都放在这里
+    expected_bytes = input_filepath.stat().st_size * 2 if input_filepath.exists() else 0
+    workspace = JobWorkspace(file_id, expected_bytes=expected_bytes)
+    
     # Timing variables for different phases
     ffmpeg_time = 0
+    vad_time = 0
+    draft_time = 0
     transcription_time = 0
     subtitle_generation_time = 0
     
+    # 跟随任务使用的结果（片段）和失败原因
+    requested_params = {**transcription_params, "task": task_type, "engine": engine_name, "cascade_model": cascade_model}
+    shared_entry = None
+    shared_error = None
+    
     try:
-        safe_update_state(self, state='PROGRESS', meta={'status': 'Processing file...', 'progress': 10})
+        # 每个任务只探测一次媒体信息，时长用于超时、成本估算和调度（上传时已探测则直接复用 sidecar）
+        if media_info is None:
+            try:
+                media_info = get_media_info(input_filepath)
+            except Exception as e:
+                logger.warning(f"Could not probe {original_filename}: {e}")
+                media_info = {}
+        media_duration = media_info.get("duration")
+        content_hash = media_info.get("content_hash")  # 上传时计算，作为语言检测等缓存的键
+        audio_stream = select_audio_stream(media_info)
+        if audio_stream is not None:
+            logger.info(f"🔈 Multiple audio streams, transcribing audio stream {audio_stream}")
+        
+        # 结果缓存：键使用请求的模型和语言（路由前），API 端可以在入队前算出同一个键
+        result_key = None
+        if settings.RESULT_CACHE_ENABLED and content_hash:
+            try:
+                version = get_engine(engine_name).version()
+                record_engine_version(engine_name, version)
+                result_key = cache_key(content_hash, model_name, language, task_type, engine_name, version, cascade_model)
+            except Exception as e:
+                logger.warning(f"⚠️ Result cache unavailable: {e}")
+        if result_key and not transcription_params.get("no_cache"):
+            cached = get_result_cache().get(result_key)
+            if cached:
+                shared_entry = cached
+                return cached_transcription_result(cached, original_filename, file_id, output_format,
+                                                   requested_params, media_duration, overall_start_time)
+        
+        job_estimate = estimate_job(model_name, media_duration, engine_name)
+        logger.info(f"⏳ Media duration: {media_duration}s, expected cost: {job_estimate['expected_cost']}s")
+        
+        safe_update_state(self, state='PROGRESS', meta={
+            'status': 'Processing file...',
+            'progress': 10,
+            'audio_duration': media_duration,
+            'expected_cost': job_estimate['expected_cost']
+        })
+        
+        # 模型已下载时，在解码音频的同时把它预读到页缓存
+        if engine_name == "whisper_cpp":
+            get_whisper_manager().prefetch_model(model_name)
+            if cascade_model:
+                get_whisper_manager().prefetch_model(cascade_model)
+            if draft_enabled:
+                get_whisper_manager().prefetch_model(settings.DRAFT_MODEL)
+            if language == "auto" and settings.LANGUAGE_DETECT_ENABLED:
+                get_whisper_manager().prefetch_model(settings.LANGUAGE_DETECT_MODEL)
         
         # Handle video files - extract audio
+        # 启用分块或VAD时，其他音频格式也统一转换为 16 kHz 单声道 WAV，供静音检测使用
         video_extensions = {'.mov', '.mp4', '.avi', '.mkv', '.webm', '.flv', '.wmv'}
-        if input_filepath.suffix.lower() in video_extensions:
+        audio_extensions = {'.wav', '.mp3', '.flac', '.m4a', '.aac', '.ogg', '.wma'}
+        is_video = input_filepath.suffix.lower() in video_extensions
+        needs_normalization = (
+            (settings.CHUNKING_ENABLED or settings.VAD_ENABLED)
+            and input_filepath.suffix.lower() in audio_extensions
+            and not is_normalized_wav(input_filepath)
+        )
+        # 解码音频缓存：同一文件换模型或语言重跑时直接使用上次解码的 WAV，不再调用 ffmpeg
+        audio_key = None
+        cached_audio = None
+        if settings.AUDIO_CACHE_ENABLED and content_hash and not is_normalized_wav(input_filepath):
+            audio_key = audio_cache_key(content_hash, audio_stream)
+            cached_audio = get_audio_cache().get(audio_key)
+            if cached_audio:
+                audio_file_to_transcribe = cached_audio
+        # 流式解码：ffmpeg 输出的 PCM 经环形缓冲区直接送入 VAD、分块和引擎，不写中间 WAV
+        # 草稿和级联模式需要完整的 WAV 反复读取，仍走提取流程
+        stream_decode = (
+            settings.STREAM_DECODE_ENABLED and not draft_enabled and not cascade_model and cached_audio is None
+            and (is_video or (input_filepath.suffix.lower() in audio_extensions
+                              and not is_normalized_wav(input_filepath)))
+        )
+        if stream_decode and is_video and media_info and not media_info.get("has_audio"):
+            raise RuntimeError(f"Video file {original_filename} has no audio tracks.")
+        if (is_video or needs_normalization) and not stream_decode and cached_audio is None:
             ffmpeg_start = time.time()
-            temp_audio_path = output_dir / f"{file_id}_extracted_audio.wav"
+            # 有内容哈希时直接解码到缓存目录，提取完成后原子放入缓存
+            temp_audio_path = get_audio_cache().reserve(audio_key) if audio_key else workspace.file("extracted_audio.wav")
             try:
-                logger.info(f"🎬 Extracting audio from video: {input_filepath}")
-                
-                # Check if video has audio tracks
-                probe = ffmpeg.probe(str(input_filepath))
-                if not any(stream['codec_type'] == 'audio' for stream in probe.get('streams', [])):
-                    raise RuntimeError(f"Video file {original_filename} has no audio tracks.")
+                if is_video:
+                    logger.info(f"🎬 Extracting audio from video: {input_filepath}")
+                    
+                    # Check if video has audio tracks
+                    if media_info and not media_info.get("has_audio"):
+                        raise RuntimeError(f"Video file {original_filename} has no audio tracks.")
+                else:
+                    logger.info(f"🎵 Normalizing audio to 16 kHz mono WAV: {input_filepath}")
                 
                 # Extract audio
                 (
                     ffmpeg
                     .input(str(input_filepath))
-                    .output(str(temp_audio_path), acodec='pcm_s16le', ar='16000', ac=1)
+                    .output(str(temp_audio_path), format='wav', acodec='pcm_s16le', ar='16000', ac=1,
+                            **({'map': f'0:a:{audio_stream}'} if audio_stream is not None else {}))
                     .run(overwrite_output=True, capture_stdout=True, capture_stderr=True)
                 )
                 audio_file_to_transcribe = temp_audio_path
+                if audio_key:
+                    audio_file_to_transcribe = get_audio_cache().commit(audio_key, temp_audio_path)
+                    if audio_file_to_transcribe is None:
+                        # 放不进缓存时移到工作目录，随工作目录一起清理
+                        audio_file_to_transcribe = Path(shutil.move(str(temp_audio_path), workspace.file("extracted_audio.wav")))
                 ffmpeg_time = time.time() - ffmpeg_start
                 logger.info(f"✅ Audio extraction completed in {ffmpeg_time:.2f} seconds")
                 
             except Exception as e:
+                if audio_key:
+                    temp_audio_path.unlink(missing_ok=True)
                 error_msg = str(e.stderr.decode() if hasattr(e, 'stderr') and e.stderr else e)
                 logger.error(f"FFmpeg Error for {original_filename}: {error_msg}")
                 safe_update_state(self,
@@ -293,8 +696,8 @@ def create_transcription_task(self, input_filepath_str: str, file_id: str, origi
                 return
         
         # Check if it's an audio file
-        audio_extensions = {'.wav', '.mp3', '.flac', '.m4a', '.aac', '.ogg', '.wma'}
-        if input_filepath.suffix.lower() not in audio_extensions and temp_audio_path is None:
+        if (input_filepath.suffix.lower() not in audio_extensions and temp_audio_path is None and not stream_decode
+                and cached_audio is None):
             error_msg = f"Unsupported file format: {input_filepath.suffix}"
             logger.error(error_msg)
             safe_update_state(self,
@@ -309,65 +712,174 @@ def create_transcription_task(self, input_filepath_str: str, file_id: str, origi
         
         safe_update_state(self, state='PROGRESS', meta={'status': f'Starting transcription with {model_name} model...', 'progress': 30})
         
-        # Use OpenAI Whisper for transcription
-        logger.info(f"🎙️ Starting transcription with model: {model_name}")
-        transcription_data = transcribe_with_whisper(
-            str(audio_file_to_transcribe),
-            model_name=model_name,
-            language=language,
-            task_type=task_type
-        )
-        transcription_time = transcription_data.get("total_processing_time", 0)
+        # Voice activity detection - 只把语音区间送去转录
+        vad_info = None
+        if settings.VAD_ENABLED and is_normalized_wav(audio_file_to_transcribe):
+            vad_start = time.time()
+            vad_info = prepare_speech_audio(audio_file_to_transcribe, workspace.file("speech.wav"))
+            vad_time = time.time() - vad_start
+            logger.info(f"✅ VAD completed in {vad_time:.2f} seconds")
+        
+        # 语言检测预处理：language=auto 时先用最小模型检测几个语音窗口，主转录使用明确的 -l
+        language_detection = None
+        has_speech = not (vad_info is not None and vad_info["audio_path"] is None)
+        if (language == "auto" and settings.LANGUAGE_DETECT_ENABLED and has_speech
+                and is_normalized_wav(audio_file_to_transcribe)):
+            try:
+                language_detection = detect_language(
+                    audio_file_to_transcribe,
+                    engine_name,
+                    content_key=content_hash,
+                    spans=vad_info["spans"] if vad_info else None,
+                    work_dir=str(workspace.subdir("language"))
+                )
+            except Exception as e:
+                logger.warning(f"⚠️ Language detection failed, keeping auto-detect: {e}")
+            if is_confident(language_detection):
+                language = language_detection["language"]
+                routed_model = route_model(model_name, language, task_type)
+                if routed_model != model_name:
+                    logger.info(f"🔀 English audio, routing {model_name} → {routed_model}")
+                    model_name = routed_model
+                if cascade_model:
+                    cascade_model = route_model(cascade_model, language, task_type)
+        
+        # 两级任务的草稿字幕：之后的每次状态更新都带上它，/status 始终能返回草稿文件
+        draft_info = None
+        
+        if vad_info is not None and vad_info["audio_path"] is None:
+            # 没有任何语音，不启动模型
+            logger.info(f"🔇 No speech found in {original_filename}, skipping transcription")
+            transcription_data = {"text": "", "segments": [], "language": language}
+        else:
+            speech_audio_path = vad_info["audio_path"] if vad_info else str(audio_file_to_transcribe)
+            
+            if draft_enabled:
+                # 先用小模型快速生成草稿字幕，最终字幕完成后由客户端切换到最终版本
+                draft_start = time.time()
+                safe_update_state(self, state='PROGRESS', meta={'status': f'Drafting with {settings.DRAFT_MODEL} model...', 'progress': 30})
+                try:
+                    draft_data = transcribe_with_whisper(
+                        speech_audio_path,
+                        model_name=settings.DRAFT_MODEL,
+                        language=language,
+                        task_type=task_type,
+                        work_dir=str(workspace.subdir("draft")),
+                        engine_name=engine_name
+                    )
+                    draft_segments = draft_data.get("segments", [])
+                    if vad_info and vad_info["time_map"]:
+                        draft_segments = remap_segments(draft_segments, vad_info["time_map"])
+                    draft_time = time.time() - draft_start
+                    draft_info = {
+                        "model": settings.DRAFT_MODEL,
+                        "version": "draft",
+                        "files": write_subtitle_files(draft_segments, output_dir, Path(original_filename).stem,
+                                                      output_format, version="draft"),
+                        "transcription_time": round(draft_time, 2)
+                    }
+                    logger.info(f"📝 Draft subtitles with {settings.DRAFT_MODEL} ready in {draft_time:.2f} seconds")
+                except Exception as e:
+                    draft_time = time.time() - draft_start
+                    logger.warning(f"⚠️ Draft transcription with {settings.DRAFT_MODEL} failed, continuing with {model_name}: {e}")
+            
+            # 转录阶段的真实进度映射到 30%（有草稿时 40%）- 80% 区间
+            task_id = self.request.id if hasattr(self, 'request') else None
+            progress_start = 40 if draft_info else 30
+            
+            def report_transcription_progress(info):
+                percent = info.get("percent", 0)
+                safe_update_state(self, state='PROGRESS', task_id=task_id, meta={
+                    'status': f'Transcribing with {model_name} model... {percent:.0f}%',
+                    'progress': progress_start + int(percent * (80 - progress_start) / 100),
+                    'audio_seconds_processed': info.get("audio_seconds"),
+                    'audio_duration': info.get("audio_duration"),
+                    'realtime_factor': info.get("realtime_factor"),
+                    'draft': draft_info
+                })
+            
+            # Use OpenAI Whisper for transcription
+            logger.info(f"🎙️ Starting transcription with model: {model_name}")
+            if stream_decode:
+                def detect_stream_language(samples):
+                    # 流式模式下还没有完整音频，用第一个分块检测语言
+                    nonlocal language_detection
+                    if language != "auto" or not settings.LANGUAGE_DETECT_ENABLED:
+                        return {}
+                    try:
+                        language_detection = detect_language(
+                            samples,
+                            engine_name,
+                            content_key=content_hash,
+                            work_dir=str(workspace.subdir("language"))
+                        )
+                    except Exception as e:
+                        logger.warning(f"⚠️ Language detection failed, keeping auto-detect: {e}")
+                        return {}
+                    if not is_confident(language_detection):
+                        return {}
+                    detected = language_detection["language"]
+                    return {"language": detected, "model_name": route_model(model_name, detected, task_type)}
+                
+                transcription_data = transcribe_stream_with_whisper(
+                    str(input_filepath),
+                    model_name=model_name,
+                    language=language,
+                    task_type=task_type,
+                    media_duration=media_duration,
+                    work_dir=str(workspace.subdir("whisper")),
+                    progress_callback=ThrottledProgress(report_transcription_progress),
+                    engine_name=engine_name,
+                    first_chunk_hook=detect_stream_language,
+                    audio_stream=audio_stream,
+                    audio_key=audio_key
+                )
+                if is_confident(language_detection):
+                    language = language_detection["language"]
+                if transcription_data.get("model") and transcription_data["model"] != model_name:
+                    logger.info(f"🔀 English audio, routed {model_name} → {transcription_data['model']}")
+                    model_name = transcription_data["model"]
+            else:
+                transcription_data = transcribe_with_whisper(
+                    speech_audio_path,
+                    model_name=model_name,
+                    language=language,
+                    task_type=task_type,
+                    work_dir=str(workspace.subdir("whisper")),
+                    progress_callback=ThrottledProgress(report_transcription_progress),
+                    engine_name=engine_name,
+                    cascade_model=cascade_model,
+                    media_duration=media_duration
+                )
+            transcription_time = transcription_data.get("total_processing_time", 0)
+            if vad_info and vad_info["time_map"]:
+                # 压缩音频上的时间戳映射回原始时间轴
+                transcription_data["segments"] = remap_segments(
+                    transcription_data.get("segments", []), vad_info["time_map"]
+                )
         
         logger.info(f"✅ Transcription completed")
-        safe_update_state(self, state='PROGRESS', meta={'status': 'Generating subtitles...', 'progress': 80})
+        safe_update_state(self, state='PROGRESS', meta={'status': 'Generating subtitles...', 'progress': 80, 'draft': draft_info})
         
         # Generate subtitle files based on requested format
         subtitle_start = time.time()
-        generated_files = []
         
         # Extract segments from transcription data
         segments = transcription_data.get("segments", [])
         
-        if output_format in ["srt", "both"]:
-            srt_filename = f"{Path(original_filename).stem}.srt"
-            srt_path = output_dir / srt_filename
-            generated_files.append({"type": "srt", "filename": srt_filename, "path": str(srt_path)})
-            logger.info(f"📄 Will generate SRT file: {srt_path}")
-        
-        if output_format in ["vtt", "both"]:
-            vtt_filename = f"{Path(original_filename).stem}.vtt"
-            vtt_path = output_dir / vtt_filename
-            generated_files.append({"type": "vtt", "filename": vtt_filename, "path": str(vtt_path)})
-            logger.info(f"📄 Will generate VTT file: {vtt_path}")
-        
-        # Generate the subtitle files using existing function
-        if generated_files:
-            # 确保 segments 不为空
-            if not segments:
-                # Fallback: create a single segment with full text
-                full_text = transcription_data.get("text", "").strip()
-                if full_text:
-                    segments = [{
-                        "text": full_text,
-                        "start": 0.0,
-                        "end": 30.0  # Assume 30 seconds for full text
-                    }]
-            
-            if len(generated_files) == 2:  # both formats
-                generate_subtitles_from_segments(segments, 
-                    Path(generated_files[0]["path"]) if generated_files[0]["type"] == "srt" else Path(generated_files[1]["path"]),
-                    Path(generated_files[1]["path"]) if generated_files[1]["type"] == "vtt" else Path(generated_files[0]["path"]))
-            elif generated_files[0]["type"] == "srt":
-                # Only SRT
-                temp_vtt = output_dir / "temp.vtt"
-                generate_subtitles_from_segments(segments, Path(generated_files[0]["path"]), temp_vtt)
-                temp_vtt.unlink()  # Remove temp VTT file
-            else:
-                # Only VTT  
-                temp_srt = output_dir / "temp.srt"
-                generate_subtitles_from_segments(segments, temp_srt, Path(generated_files[0]["path"]))
-                temp_srt.unlink()  # Remove temp SRT file
+        # 确保 segments 不为空
+        if not segments:
+            # Fallback: create a single segment with full text
+            full_text = transcription_data.get("text", "").strip()
+            if full_text:
+                segments = [{
+                    "text": full_text,
+                    "start": 0.0,
+                    "end": 30.0  # Assume 30 seconds for full text
+                }]
+        
+        # 最终版本写入 <stem>.srt / <stem>.vtt（临时文件 + os.replace）
+        generated_files = write_subtitle_files(segments, output_dir, Path(original_filename).stem, output_format)
         subtitle_generation_time = time.time() - subtitle_start
         
         logger.info(f"✅ Subtitle generation completed in {subtitle_generation_time:.2f} seconds")
@@ -381,29 +893,57 @@ def create_transcription_task(self, input_filepath_str: str, file_id: str, origi
         logger.info(f"🏁 Task completed at: {end_datetime.strftime('%Y-%m-%d %H:%M:%S')}")
         logger.info(f"⏱️  TIMING SUMMARY:")
         logger.info(f"   📁 File processing: {ffmpeg_time:.2f}s")
+        logger.info(f"   🗣️  VAD: {vad_time:.2f}s")
+        if draft_enabled:
+            logger.info(f"   📝 Draft: {draft_time:.2f}s")
         logger.info(f"   🎙️  Transcription: {transcription_time:.2f}s")
         logger.info(f"   📄 Subtitle generation: {subtitle_generation_time:.2f}s")
         logger.info(f"   🎯 TOTAL TIME: {total_time:.2f}s ({timedelta(seconds=int(total_time))})")
         
+        # 只缓存片段，命中时按请求的 output_format 重新生成字幕（no_cache 也会刷新缓存）
+        shared_entry = {
+            "text": transcription_data.get("text", ""),
+            "segments": segments,
+            "language": language,
+            "model": model_name,
+            "engine": transcription_data.get("engine", engine_name),
+            "media_duration": media_duration,
+        }
+        if result_key:
+            get_result_cache().put(result_key, shared_entry)
+        
         return {
             "status": "Completed",
             "files": generated_files,  # 动态生成的文件列表
             "original_filename": original_filename,
             "file_id": file_id,
             "full_text": transcription_data.get("text", ""),
+            "media_duration": media_duration,
+            "expected_cost": job_estimate["expected_cost"],
+            "cpu_plan": transcription_data.get("cpu_plan"),  # 线程数、核心和规划原因，便于核对吞吐
+            "cascade": transcription_data.get("cascade"),  # 级联模式：重转的片段数、时长占比和耗时
+            "language_detection": language_detection,  # 预检测的语言、概率、是否命中缓存
+            "draft": draft_info,  # 草稿字幕（version=draft），最终文件在 files 中（version=final）
+            "cache": {"hit": False, "stored": result_key is not None},
             # 模型和参数信息
             "transcription_params": {
                 "model": model_name,
                 "language": language,
                 "output_format": output_format,
-                "task_type": task_type
+                "task_type": task_type,
+                "engine": transcription_data.get("engine", engine_name),
+                "cascade_model": cascade_model,
+                "draft": draft_enabled
             },
             # Timing information
             "timing": {
                 "total_time": total_time,
                 "total_time_formatted": str(timedelta(seconds=int(total_time))),
                 "ffmpeg_time": ffmpeg_time,
+                "vad_time": vad_time,
+                "draft_time": draft_time,
                 "transcription_time": transcription_time,
+                "realtime_factor": transcription_data.get("realtime_factor"),
                 "subtitle_generation_time": subtitle_generation_time,
                 "start_time": start_datetime.isoformat(),
                 "end_time": end_datetime.isoformat()
@@ -413,6 +953,7 @@ def create_transcription_task(self, input_filepath_str: str, file_id: str, origi
     except Exception as e:
         total_time = time.time() - overall_start_time
         logger.error(f"❌ Error during transcription for {original_filename} after {total_time:.2f} seconds: {e}", exc_info=True)
+        shared_error = str(e)
         safe_update_state(self,
             state='FAILURE', 
             meta={
@@ -424,12 +965,14 @@ def create_transcription_task(self, input_filepath_str: str, file_id: str, origi
         )
         raise
     finally:
+        if single_flight_key:
+            resolve_followers(self, single_flight_key, shared_entry, shared_error, requested_params)
         # Clean up temporary files
+        workspace.cleanup()
         cleanup_files = []
-        if temp_audio_path and temp_audio_path.exists():
-            cleanup_files.append(temp_audio_path)
-        if input_filepath.exists():
-            cleanup_files.append(input_filepath)
+        for path in (input_filepath, sidecar_path(input_filepath)):
+            if path.exists():
+                cleanup_files.append(path)
         
         for file_path in cleanup_files:
             try:
@@ -500,7 +1043,7 @@ def create_batch_transcription_task(self, batch_info: dict):
                 'task_id': '',  # 稍后更新
                 'status': 'PENDING',
                 'progress': 0,
-                'estimated_time': 30  # 默认预估时间
+                'estimated_time': file_info.get('estimated_time', 30)  # 默认预估时间
             })
         
         logger.info(f"📋 Initialized batch status in Redis for {batch_id}")
@@ -517,12 +1060,11 @@ def create_batch_transcription_task(self, batch_info: dict):
             file_id = file_info['file_id']
             original_filename = file_info['original_filename']
             
-            # 创建单个文件的转录任务
-            task_result = create_transcription_task.delay(
-                file_path, 
-                file_id, 
-                original_filename,
-                transcription_params
+            # 创建单个文件的转录任务，时间限制按文件时长设置；与排队中的任务相同时挂到该任务上
+            task_result, _ = submit_transcription(
+                file_path, file_id, original_filename, transcription_params,
+                media_info=file_info.get('media_info'),
+                time_limits=file_info.get('time_limits')
             )
             
             # 更新文件任务状态
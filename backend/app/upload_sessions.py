@@ -0,0 +1,250 @@
+"""
+Resumable chunked uploads
+
+A session preallocates <UPLOAD_DIR>/<upload_id><ext>.part at the declared
+size. Clients PUT fixed-size chunks at chunk-aligned offsets, in any order
+and in parallel; each chunk is written in place with pwrite and hashed
+while it streams in. Finalize renames the part file into place (no copy)
+and the file's checksum is the SHA-256 of its chunk digests in order, so
+it is verified without reading the file again. The same tree checksum
+(namespaced by chunk size, see content_key) keys the media, language,
+result and audio caches, so re-uploads through a session with the same
+chunk size hit them; it never matches the plain SHA-256 of /upload/.
+
+A chunk's digest is dropped when a write of it starts and recorded only
+when the write succeeds and passes its checks, so a failed re-PUT cannot
+leave new bytes behind an old digest. Finalize refuses to run while any
+chunk write is in flight.
+
+Session state is a small JSON file per upload under <UPLOAD_DIR>/sessions,
+updated under flock so parallel PUTs (and API replicas sharing the upload
+directory) do not lose each other's chunks.
+"""
+import os
+import json
+import time
+import uuid
+import fcntl
+import hashlib
+import logging
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List, Tuple
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# 超过这个时间仍未结束的分块写入视为已中断（API 进程在写入中途退出）
+STALE_WRITE_SECONDS = 3600
+
+
+class UploadSessionConflict(RuntimeError):
+    """会话当前不能完成：仍有缺失的分块或正在写入的分块"""
+
+
+class UploadChecksumMismatch(RuntimeError):
+    pass
+
+
+def merge_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def chunk_checksum(digests: List[str]) -> str:
+    """整个文件的校验值：按顺序拼接各分块 SHA-256 摘要后再做一次 SHA-256"""
+    return hashlib.sha256(b"".join(bytes.fromhex(digest) for digest in digests)).hexdigest()
+
+
+def content_key(session: Dict[str, Any], checksum: str) -> str:
+    """缓存使用的内容键：分块校验值随分块大小变化，加上前缀以免与整文件 SHA-256 混用"""
+    return f"chunks-{session['chunk_size']}:{checksum}"
+
+
+class UploadSessionStore:
+    """Upload sessions and their part files under UPLOAD_DIR"""
+
+    def __init__(self, upload_dir: Optional[str] = None):
+        self.upload_dir = Path(upload_dir or settings.UPLOAD_DIR)
+        self.session_dir = self.upload_dir / "sessions"
+        self.session_dir.mkdir(parents=True, exist_ok=True)
+
+    def _session_file(self, upload_id: str) -> Path:
+        return self.session_dir / f"{upload_id}.json"
+
+    def part_path(self, session: Dict[str, Any]) -> Path:
+        return self.upload_dir / f"{session['upload_id']}{session['extension']}.part"
+
+    @contextmanager
+    def _locked(self, upload_id: str):
+        """以独占锁读写会话状态（会话不存在时 yield None）"""
+        session_file = self._session_file(upload_id)
+        with open(self.session_dir / f"{upload_id}.lock", "a+") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                session = json.loads(session_file.read_text()) if session_file.exists() else None
+                yield session
+                if session is not None and session_file.exists():
+                    tmp_file = session_file.with_suffix(".tmp")
+                    tmp_file.write_text(json.dumps(session))
+                    os.replace(tmp_file, session_file)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def create(self, filename: str, size: int, chunk_size: int, checksum: Optional[str] = None) -> Dict[str, Any]:
+        self.expire()
+        session = {
+            "upload_id": str(uuid.uuid4()),
+            "filename": filename,
+            "extension": Path(filename).suffix,
+            "size": size,
+            "chunk_size": chunk_size,
+            "checksum": checksum.lower() if checksum else None,
+            "chunks": {},  # 分块序号 → SHA-256
+            "writing": {},  # 分块序号 → {写入标识: 开始时间}
+            "created": time.time(),
+        }
+        part_path = self.part_path(session)
+        with open(part_path, "wb") as f:
+            # 预先分配完整大小，分块按偏移直接写入最终位置
+            if size and hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(f.fileno(), 0, size)
+            else:
+                f.truncate(size)
+        self._session_file(session["upload_id"]).write_text(json.dumps(session))
+        logger.info(f"📦 Upload session {session['upload_id']} for {filename}: {size} bytes "
+                    f"in {self.chunk_count(session)} chunks of {chunk_size}")
+        return session
+
+    def get(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads(self._session_file(upload_id).read_text())
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def chunk_count(session: Dict[str, Any]) -> int:
+        return max(1, -(-session["size"] // session["chunk_size"]))
+
+    @staticmethod
+    def chunk_length(session: Dict[str, Any], index: int) -> int:
+        return min(session["chunk_size"], session["size"] - index * session["chunk_size"])
+
+    def begin_chunk(self, upload_id: str, index: int) -> Optional[str]:
+        """
+        Mark chunk index as being written and forget its previous digest
+
+        Returns a token for end_chunk(), or None when the session no longer
+        exists (finalized, deleted or expired).
+        """
+        token = uuid.uuid4().hex
+        with self._locked(upload_id) as session:
+            if session is None:
+                return None
+            now = time.time()
+            session["chunks"].pop(str(index), None)
+            writers = session.setdefault("writing", {}).setdefault(str(index), {})
+            for stale in [t for t, started in writers.items() if now - started > STALE_WRITE_SECONDS]:
+                del writers[stale]
+            writers[token] = now
+        return token
+
+    def end_chunk(self, upload_id: str, index: int, token: str, digest: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """结束 begin_chunk() 开始的写入；digest 为 None 表示写入失败，分块保持缺失"""
+        with self._locked(upload_id) as session:
+            if session is None:
+                return None
+            writing = session.setdefault("writing", {})
+            writers = writing.get(str(index), {})
+            writers.pop(token, None)
+            if not writers:
+                writing.pop(str(index), None)
+                if digest is not None:
+                    session["chunks"][str(index)] = digest
+            # 同一分块仍有其他写入进行中时不记录：文件里的字节可能来自任一次写入
+            return session
+
+    def writes_in_flight(self, session: Dict[str, Any]) -> List[int]:
+        now = time.time()
+        return sorted(int(index) for index, writers in session.get("writing", {}).items()
+                      if any(now - started <= STALE_WRITE_SECONDS for started in writers.values()))
+
+    def received_ranges(self, session: Dict[str, Any]) -> List[Tuple[int, int]]:
+        return merge_ranges([
+            (int(index) * session["chunk_size"], int(index) * session["chunk_size"] + self.chunk_length(session, int(index)))
+            for index in session["chunks"]
+        ])
+
+    def missing_ranges(self, session: Dict[str, Any]) -> List[Tuple[int, int]]:
+        missing, position = [], 0
+        for start, end in self.received_ranges(session):
+            if start > position:
+                missing.append((position, start))
+            position = end
+        if position < session["size"]:
+            missing.append((position, session["size"]))
+        return missing
+
+    def checksum(self, session: Dict[str, Any]) -> str:
+        return chunk_checksum([session["chunks"][str(index)] for index in range(self.chunk_count(session))])
+
+    def complete(self, upload_id: str, target: Path) -> Optional[Dict[str, Any]]:
+        """
+        Rename the finished part file to target (same directory, no copy) and delete the session
+
+        Completeness and the declared checksum are checked under the session
+        lock, so a chunk PUT cannot change the file in between. Raises
+        UploadSessionConflict or UploadChecksumMismatch; returns None when
+        the session does not exist.
+        """
+        with self._locked(upload_id) as session:
+            if session is None:
+                return None
+            missing = self.missing_ranges(session)
+            if missing:
+                raise UploadSessionConflict(f"Upload is incomplete, missing byte ranges: {missing[:10]}")
+            writing = self.writes_in_flight(session)
+            if writing:
+                raise UploadSessionConflict(f"Chunks {writing[:10]} are still being written")
+            if session["checksum"] and session["checksum"] != self.checksum(session):
+                raise UploadChecksumMismatch("Uploaded chunks do not match the session checksum")
+            os.replace(self.part_path(session), target)
+            self._session_file(upload_id).unlink(missing_ok=True)
+        (self.session_dir / f"{upload_id}.lock").unlink(missing_ok=True)
+        return session
+
+    def delete(self, upload_id: str) -> bool:
+        with self._locked(upload_id) as session:
+            if session is None:
+                return False
+            self.part_path(session).unlink(missing_ok=True)
+            self._session_file(upload_id).unlink(missing_ok=True)
+        (self.session_dir / f"{upload_id}.lock").unlink(missing_ok=True)
+        return True
+
+    def expire(self):
+        """删除超过 UPLOAD_SESSION_TTL 未完成的会话及其分块文件"""
+        cutoff = time.time() - settings.UPLOAD_SESSION_TTL
+        for session_file in self.session_dir.glob("*.json"):
+            try:
+                if session_file.stat().st_mtime < cutoff and self.delete(session_file.stem):
+                    logger.info(f"🧹 Expired upload session {session_file.stem}")
+            except OSError:
+                continue
+
+
+_upload_sessions: Optional[UploadSessionStore] = None
+
+
+def get_upload_sessions() -> UploadSessionStore:
+    """Get or create the global upload session store"""
+    global _upload_sessions
+    if _upload_sessions is None:
+        _upload_sessions = UploadSessionStore()
+    return _upload_sessions
@@ -0,0 +1,302 @@
+"""
+Upload persistence for the FastAPI endpoints
+
+Starlette's form parser spools every uploaded file to a temporary file
+before the endpoint runs, so copying it into UPLOAD_DIR wrote each upload
+twice and MAX_UPLOAD_MB was only checked after the whole body had arrived.
+Routes built with streaming_upload_route parse multipart bodies
+themselves: file parts are streamed from request.stream() straight into
+UPLOAD_DIR on a worker thread, hashed and size-checked per chunk, and
+save_upload only renames the received file into place.
+
+Chunks of resumable uploads (see upload_sessions.py) are streamed from the
+request body straight into their offset in the part file.
+"""
+import os
+import uuid
+import hashlib
+import logging
+from pathlib import Path
+from typing import BinaryIO, Callable, List, Tuple
+
+from fastapi import UploadFile, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.routing import APIRoute
+from python_multipart.multipart import MultipartParser, parse_options_header
+from python_multipart.exceptions import FormParserError
+from starlette.datastructures import FormData, Headers
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# 每次读写的字节数：足够大以减少系统调用，又不会让单个上传占用太多内存
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+# 普通表单字段的大小上限（与 Starlette 相同）
+MAX_FIELD_BYTES = 1024 * 1024
+
+
+class UploadTooLarge(RuntimeError):
+    pass
+
+
+def _limit_detail(filename: str) -> str:
+    return f"{filename} exceeds the {settings.MAX_UPLOAD_MB} MB upload limit"
+
+
+class ReceivedUpload(UploadFile):
+    """An uploaded file already written to UPLOAD_DIR while the request streamed in"""
+
+    def __init__(self, path: Path, filename: str, headers: Headers):
+        super().__init__(file=open(path, "w+b"), size=0, filename=filename, headers=headers)
+        self.path = path
+        self.digest = hashlib.sha256()
+
+    def _append(self, block: bytes):
+        self.digest.update(block)
+        self.file.write(block)
+
+    async def append(self, block: bytes):
+        """写入一块数据并更新哈希；超过 MAX_UPLOAD_MB 时抛出 HTTPException 413"""
+        max_bytes = settings.MAX_UPLOAD_MB * 1024 * 1024
+        if max_bytes and self.size + len(block) > max_bytes:
+            raise HTTPException(status_code=413, detail=_limit_detail(self.filename))
+        self.size += len(block)
+        await run_in_threadpool(self._append, block)
+
+    def discard(self):
+        self.file.close()
+        self.path.unlink(missing_ok=True)
+
+    async def close(self):
+        # 未被 save_upload 取走的文件（请求校验失败等）随请求一起删除
+        await super().close()
+        self.path.unlink(missing_ok=True)
+
+
+class StreamingMultipartParser:
+    """
+    Parses a multipart/form-data body from request.stream()
+
+    Plain fields are collected in memory; file parts become ReceivedUpload
+    files in upload_dir. The parser callbacks only queue file data, which is
+    buffered up to UPLOAD_CHUNK_BYTES and written off the event loop between
+    reads. On any error every file received so far is deleted.
+    """
+
+    def __init__(self, headers: Headers, stream, upload_dir: Path):
+        self.headers = headers
+        self.stream = stream
+        self.upload_dir = Path(upload_dir)
+        self.items: List[Tuple[str, object]] = []
+        self.files: List[ReceivedUpload] = []
+        self._charset = "utf-8"
+        self._header_name = b""
+        self._header_value = b""
+        self._part_headers: List[Tuple[bytes, bytes]] = []
+        self._field_name = ""
+        self._field_data = bytearray()
+        self._file = None
+        self._pending: List[Tuple[ReceivedUpload, bytes]] = []
+        self._buffer = bytearray()
+
+    def _decode(self, value: bytes) -> str:
+        try:
+            return value.decode(self._charset)
+        except (UnicodeDecodeError, LookupError):
+            return value.decode("latin-1")
+
+    def on_part_begin(self):
+        self._part_headers = []
+        self._field_data = bytearray()
+        self._file = None
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._part_headers.append((self._header_name.lower(), self._header_value))
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        disposition = dict(self._part_headers).get(b"content-disposition", b"")
+        _, options = parse_options_header(disposition)
+        if b"name" not in options:
+            raise HTTPException(status_code=400, detail='The Content-Disposition header field "name" must be provided.')
+        self._field_name = self._decode(options[b"name"])
+        if b"filename" in options:
+            filename = self._decode(options[b"filename"])
+            path = self.upload_dir / f".incoming-{uuid.uuid4()}{Path(filename).suffix}"
+            self._file = ReceivedUpload(path, filename, Headers(raw=self._part_headers))
+            self.files.append(self._file)
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self._file is not None:
+            self._pending.append((self._file, data[start:end]))
+        else:
+            self._field_data += data[start:end]
+            if len(self._field_data) > MAX_FIELD_BYTES:
+                raise HTTPException(status_code=400, detail=f"Form field {self._field_name} is too large")
+
+    def on_part_end(self):
+        if self._file is not None:
+            self._pending.append((self._file, b""))  # 文件结束：写出缓冲区
+            self.items.append((self._field_name, self._file))
+        else:
+            self.items.append((self._field_name, self._decode(bytes(self._field_data))))
+
+    async def _write_pending(self):
+        """把回调中排队的文件数据按 UPLOAD_CHUNK_BYTES 合并后写出"""
+        for file, data in self._pending:
+            self._buffer += data
+            if self._buffer and (not data or len(self._buffer) >= UPLOAD_CHUNK_BYTES):
+                block = bytes(self._buffer)
+                self._buffer.clear()
+                await file.append(block)
+        self._pending.clear()
+
+    async def parse(self) -> FormData:
+        _, params = parse_options_header(self.headers.get("Content-Type"))
+        charset = params.get(b"charset", b"utf-8")
+        self._charset = charset.decode("latin-1") if isinstance(charset, bytes) else charset
+        if b"boundary" not in params:
+            raise HTTPException(status_code=400, detail="Missing boundary in multipart.")
+
+        parser = MultipartParser(params[b"boundary"], {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        })
+        try:
+            async for chunk in self.stream:
+                parser.write(chunk)
+                await self._write_pending()
+            parser.finalize()
+            await self._write_pending()
+            for file in self.files:
+                await file.seek(0)
+        except BaseException as e:
+            for file in self.files:
+                file.discard()
+            if isinstance(e, FormParserError):
+                raise HTTPException(status_code=400, detail="Invalid multipart data.") from e
+            raise
+        return FormData(self.items)
+
+
+def streaming_upload_route(upload_dir: Path) -> type:
+    """
+    APIRoute class whose multipart bodies are streamed into upload_dir
+
+    Set it as the router's route_class; endpoints keep their UploadFile and
+    Form parameters, but the UploadFile objects are ReceivedUpload files that
+    save_upload moves into place without copying.
+    """
+
+    class StreamingUploadRequest(Request):
+        async def _get_form(self, **kwargs) -> FormData:
+            if self._form is None:
+                content_type, _ = parse_options_header(self.headers.get("Content-Type"))
+                if content_type != b"multipart/form-data":
+                    return await super()._get_form(**kwargs)
+                self._form = await StreamingMultipartParser(self.headers, self.stream(), upload_dir).parse()
+            return self._form
+
+    class StreamingUploadRoute(APIRoute):
+        def get_route_handler(self) -> Callable:
+            handler = super().get_route_handler()
+
+            async def streaming_upload_handler(request: Request):
+                return await handler(StreamingUploadRequest(request.scope, request.receive))
+
+            return streaming_upload_handler
+
+    return StreamingUploadRoute
+
+
+def copy_and_hash(source: BinaryIO, file_path: Path, max_bytes: int = 0) -> str:
+    """分块复制并计算 SHA-256；超过 max_bytes（0 为不限制）时删除已写入的部分并抛出 UploadTooLarge"""
+    digest = hashlib.sha256()
+    written = 0
+    try:
+        with open(file_path, "wb") as buffer:
+            for block in iter(lambda: source.read(UPLOAD_CHUNK_BYTES), b""):
+                written += len(block)
+                if max_bytes and written > max_bytes:
+                    raise UploadTooLarge(f"exceeds the {max_bytes // (1024 * 1024)} MB upload limit")
+                digest.update(block)
+                buffer.write(block)
+    except BaseException:
+        Path(file_path).unlink(missing_ok=True)
+        raise
+    return digest.hexdigest()
+
+
+async def save_upload(file: UploadFile, file_path: Path) -> str:
+    """
+    Save an upload to file_path and return its SHA-256
+
+    A ReceivedUpload was already written and hashed while the request
+    streamed in and is only renamed; any other UploadFile is copied off the
+    event loop. The hash is the content key of the media-info, language,
+    result and decoded-audio caches. Raises HTTPException 413 when the file
+    is larger than MAX_UPLOAD_MB.
+    """
+    max_bytes = settings.MAX_UPLOAD_MB * 1024 * 1024
+    # 客户端提供了大小时，超限的文件不必复制
+    if max_bytes and file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail=_limit_detail(file.filename))
+    if isinstance(file, ReceivedUpload):
+        await run_in_threadpool(file.file.flush)
+        os.replace(file.path, file_path)
+        return file.digest.hexdigest()
+    try:
+        return await run_in_threadpool(copy_and_hash, file.file, file_path, max_bytes)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=f"{file.filename} {e}")
+
+
+def _pwrite_all(fd: int, data: bytes, offset: int, digest) -> None:
+    digest.update(data)
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view, offset = view[written:], offset + written
+
+
+async def write_chunk(request: Request, part_path: Path, offset: int, length: int) -> str:
+    """
+    Stream a request body of exactly `length` bytes into part_path at offset
+
+    The body is buffered up to UPLOAD_CHUNK_BYTES and written with pwrite
+    (and hashed) on a worker thread. Returns the SHA-256 of the body; a
+    body of the wrong length raises HTTPException 400.
+    """
+    digest = hashlib.sha256()
+    buffer = bytearray()
+    received = 0
+    fd = os.open(part_path, os.O_WRONLY)
+    try:
+        async for block in request.stream():
+            received += len(block)
+            if received > length:
+                raise HTTPException(status_code=400, detail=f"Chunk body is longer than {length} bytes")
+            buffer += block
+            if len(buffer) >= UPLOAD_CHUNK_BYTES:
+                await run_in_threadpool(_pwrite_all, fd, bytes(buffer), offset + received - len(buffer), digest)
+                buffer.clear()
+        if buffer:
+            await run_in_threadpool(_pwrite_all, fd, bytes(buffer), offset + received - len(buffer), digest)
+    finally:
+        os.close(fd)
+    if received != length:
+        raise HTTPException(status_code=400, detail=f"Chunk body has {received} bytes, expected {length}")
+    return digest.hexdigest()
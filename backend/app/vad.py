@@ -0,0 +1,160 @@
+"""
+Energy / zero-crossing voice activity detection used to skip silence before inference
+"""
+import bisect
+import logging
+from pathlib import Path
+from typing import Dict, Any, List, Tuple, Union
+
+import numpy as np
+
+from .config import settings
+from .audio import read_pcm16_wav, write_pcm16_wav, frame_rms_db
+
+logger = logging.getLogger(__name__)
+
+# 过零率高于该值且能量只略高于阈值的帧视为噪声（嘶声、风噪），而不是语音
+NOISE_ZCR = 0.35
+
+
+def _runs(mask: np.ndarray) -> np.ndarray:
+    """返回布尔序列中连续 True 区间的 [start, end) 帧下标，形状 (n, 2)"""
+    padded = np.concatenate(([False], mask, [False]))
+    edges = np.flatnonzero(np.diff(padded.astype(np.int8)))
+    return edges.reshape(-1, 2)
+
+
+def frame_features(samples: np.ndarray, frame_length: int) -> Tuple[np.ndarray, np.ndarray]:
+    """计算每帧的能量（dBFS）和过零率"""
+    energy = frame_rms_db(samples, frame_length)
+    n_frames = len(energy)
+    if n_frames == 0:
+        return energy, np.zeros(0, dtype=np.float32)
+    frames = np.asarray(samples[: n_frames * frame_length]).reshape(n_frames, frame_length)
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (frame_length - 1)
+    return energy, zcr.astype(np.float32)
+
+
+def detect_speech(samples: np.ndarray, sample_rate: int) -> List[Tuple[float, float]]:
+    """
+    Detect speech spans in a mono PCM stream
+
+    Returns a list of (start, end) in seconds, already bridged over short
+    pauses and padded on both sides.
+    """
+    frame_seconds = settings.VAD_FRAME_MS / 1000.0
+    frame_length = int(frame_seconds * sample_rate)
+    energy, zcr = frame_features(samples, frame_length)
+    if len(energy) == 0:
+        return []
+
+    # 以低分位数估计底噪；阈值不超过响亮部分以下 10 dB，避免几乎全是语音的文件被整体判为静音
+    noise_floor = float(np.percentile(energy, 10))
+    loud_level = float(np.percentile(energy, 90))
+    threshold = max(settings.VAD_MIN_ENERGY_DB, min(noise_floor + settings.VAD_ENERGY_MARGIN_DB, loud_level - 10.0))
+
+    speech = energy > threshold
+    speech &= ~((zcr > NOISE_ZCR) & (energy < threshold + 6.0))
+
+    # 填补短暂停顿
+    min_silence_frames = int(settings.VAD_MIN_SILENCE_MS / settings.VAD_FRAME_MS)
+    for start, end in _runs(~speech):
+        if start > 0 and end < len(speech) and end - start < min_silence_frames:
+            speech[start:end] = True
+
+    # 去掉过短的语音片段（咔哒声、碰撞声）
+    min_speech_frames = max(1, int(settings.VAD_MIN_SPEECH_MS / settings.VAD_FRAME_MS))
+    runs = [(start, end) for start, end in _runs(speech) if end - start >= min_speech_frames]
+
+    total_seconds = len(samples) / sample_rate
+    padding = settings.VAD_PADDING_MS / 1000.0
+    spans: List[Tuple[float, float]] = []
+    for start, end in runs:
+        span_start = max(0.0, float(start) * frame_seconds - padding)
+        span_end = min(total_seconds, float(end) * frame_seconds + padding)
+        if spans and span_start <= spans[-1][1]:
+            spans[-1] = (spans[-1][0], span_end)
+        else:
+            spans.append((span_start, span_end))
+    return spans
+
+
+def prepare_speech_audio(wav_path: Union[str, Path], output_path: Union[str, Path]) -> Dict[str, Any]:
+    """
+    Run VAD over a normalized WAV and, when it pays off, write a compacted WAV
+    that only contains the speech spans.
+
+    Returns:
+        spans: 检测到的语音区间（原始时间轴，秒）
+        speech_seconds / total_seconds: 语音时长和总时长
+        audio_path: 需要送去转录的文件（压缩后的 WAV 或原文件），无语音时为 None
+        time_map: [(compact_start, original_start, length), ...]，压缩文件未生成时为空
+    """
+    samples, sample_rate = read_pcm16_wav(wav_path)
+    total_seconds = len(samples) / sample_rate
+    spans = detect_speech(samples, sample_rate)
+    speech_seconds = sum(end - start for start, end in spans)
+
+    result = {
+        "spans": spans,
+        "speech_seconds": speech_seconds,
+        "total_seconds": total_seconds,
+        "audio_path": str(wav_path) if spans else None,
+        "time_map": [],
+    }
+
+    if not spans:
+        logger.info(f"🔇 No speech detected in {total_seconds:.1f}s of audio")
+        return result
+
+    speech_ratio = speech_seconds / total_seconds if total_seconds else 1.0
+    logger.info(f"🗣️ VAD: {len(spans)} speech spans, {speech_seconds:.1f}s of {total_seconds:.1f}s ({speech_ratio:.0%})")
+    if speech_ratio >= settings.VAD_MAX_SPEECH_RATIO:
+        # 静音太少，压缩不划算，直接转录原文件
+        return result
+
+    compact, time_map = compact_speech(samples, sample_rate, spans)
+    write_pcm16_wav(output_path, compact, sample_rate)
+
+    result["audio_path"] = str(output_path)
+    result["time_map"] = time_map
+    return result
+
+
+def compact_speech(samples: np.ndarray, sample_rate: int,
+                   spans: List[Tuple[float, float]]) -> Tuple[np.ndarray, List[Tuple[float, float, float]]]:
+    """只保留语音区间的 PCM，以及 [(compact_start, original_start, length), ...] 时间映射"""
+    pieces = []
+    time_map = []
+    compact_position = 0.0
+    for start, end in spans:
+        first, last = int(start * sample_rate), int(end * sample_rate)
+        pieces.append(samples[first:last])
+        time_map.append((compact_position, first / sample_rate, (last - first) / sample_rate))
+        compact_position += (last - first) / sample_rate
+    return np.concatenate(pieces), time_map
+
+
+def _map_time(t: float, starts: List[float], time_map: List[Tuple[float, float, float]]) -> float:
+    index = max(0, bisect.bisect_right(starts, t) - 1)
+    compact_start, original_start, length = time_map[index]
+    return original_start + min(max(t - compact_start, 0.0), length)
+
+
+def remap_segments(segments: List[Dict], time_map: List[Tuple[float, float, float]]) -> List[Dict]:
+    """把压缩音频上的时间戳映射回原始时间轴"""
+    if not time_map:
+        return segments
+    starts = [entry[0] for entry in time_map]
+    remapped = []
+    for segment in segments:
+        remapped_segment = dict(segment)
+        remapped_segment["start"] = _map_time(segment["start"], starts, time_map)
+        remapped_segment["end"] = max(remapped_segment["start"], _map_time(segment["end"], starts, time_map))
+        remapped_segment["words"] = [
+            {**word, "start": _map_time(word["start"], starts, time_map), "end": _map_time(word["end"], starts, time_map)}
+            for word in segment.get("words", [])
+        ]
+        remapped.append(remapped_segment)
+    return remapped
@@ -1,19 +1,30 @@
 import os
+import re
 import logging
 import subprocess
 import json
 import time
 from pathlib import Path
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Callable
 from datetime import timedelta
 import platform
-import requests
 import shutil
+import tempfile
+import threading
 
 from .config import settings
+from .audio import is_normalized_wav, wav_duration
+from .progress import WhisperProgressParser
+from .cost_model import subprocess_timeout, record_realtime_factor
+from .model_store import get_model_store
+from .downloader import download_model_file
+from .capabilities import get_capability_cache
 
 logger = logging.getLogger(__name__)
 
+# whisper-cli -dl 的输出：whisper_full_with_state: auto-detected language: en (p = 0.970000)
+DETECTED_LANGUAGE_RE = re.compile(r"auto-detected language:\s*([a-z]{2,3})\s*\(p\s*=\s*([\d.]+)\)")
+
 class WhisperManager:
     """Manages whisper.cpp command line tool for transcription"""
     
@@ -34,9 +45,66 @@ class WhisperManager:
     }
     
     def __init__(self):
-        self.models_dir = Path("models")
+        self.models_dir = Path(settings.MODELS_DIR)
         self.models_dir.mkdir(exist_ok=True)
-        self.whisper_cpp_path = self._find_or_compile_whisper_cpp()
+        self.model_store = get_model_store(self.models_dir)
+        
+        # 可执行文件位置和支持的参数缓存在主机级文件中，worker 子进程重启时不再逐个运行 --help
+        self.capabilities = self._cached_capabilities()
+        self.whisper_cpp_path = self.capabilities["whisper_cli"]
+        self.whisper_server_path = None
+        if settings.WHISPER_ENGINE_MODE == "server":
+            self.whisper_server_path = self.capabilities["whisper_server"]
+            if not self.whisper_server_path:
+                logger.warning("whisper-server not found, server engine mode will fall back to whisper-cli")
+    
+    def _cached_capabilities(self) -> Dict[str, Any]:
+        """whisper-cli / whisper-server 路径和 whisper-cli 支持的参数（按可执行文件 mtime 和哈希缓存）"""
+        cache = get_capability_cache(settings.CAPABILITIES_CACHE_PATH)
+        key = {
+            "whisper_cpp_path": settings.WHISPER_CPP_PATH,
+            "whisper_server_path": settings.WHISPER_SERVER_PATH,
+            "deployment_mode": settings.DEPLOYMENT_MODE,
+            "path": os.getenv("PATH"),
+            "cwd": os.getcwd(),
+        }
+        return cache.get(
+            "whisper",
+            self._probe_capabilities,
+            key=key,
+            binaries=lambda data: [p for p in (data["whisper_cli"], data["whisper_server"]) if p],
+            is_negative=lambda data: not data["whisper_cli"],
+        )
+    
+    def _probe_capabilities(self) -> Dict[str, Any]:
+        """实际执行的探测：查找（必要时编译）whisper.cpp，并解析 --help 中的参数列表"""
+        cli_path = self._find_or_compile_whisper_cpp()
+        if cli_path:
+            cli_path = shutil.which(cli_path) or cli_path
+        return {
+            "whisper_cli": cli_path,
+            "whisper_server": self._find_whisper_server(cli_path),
+            "cli_options": self._probe_cli_options(cli_path) if cli_path else [],
+        }
+    
+    @staticmethod
+    def _probe_cli_options(cli_path: str) -> List[str]:
+        """解析 whisper-cli --help 输出中的参数名（如 -pp、-ojf、--output-json-full）"""
+        try:
+            result = subprocess.run([cli_path, "--help"], capture_output=True, text=True, timeout=10)
+        except (subprocess.TimeoutExpired, OSError):
+            return []
+        options = set()
+        for line in (result.stdout + result.stderr).splitlines():
+            match = re.match(r"\s+(-[\w-]+)(?:\s+[A-Z]+)?(?:,\s+(--[\w-]+))?", line)
+            if match:
+                options.update(option for option in match.groups() if option)
+        return sorted(options)
+    
+    def supports(self, option: str) -> bool:
+        """whisper-cli 是否支持某个参数（未能探测时假定支持）"""
+        options = self.capabilities.get("cli_options") or []
+        return not options or option in options
     
     def _get_whisper_build_dir(self) -> Path:
         """Get the whisper.cpp build directory based on deployment mode"""
@@ -183,24 +251,64 @@ class WhisperManager:
         logger.warning("whisper.cpp not found and compilation failed/not attempted")
         return None
     
-    def _download_model(self, model_name: str) -> Path:
-        """Download whisper.cpp model if not exists"""
-        # In hybrid mode, try mounted models first
+    def _find_whisper_server(self, cli_path: Optional[str]) -> Optional[str]:
+        """Find whisper-server executable for the persistent server engine mode"""
+        candidates = []
+        if settings.WHISPER_SERVER_PATH:
+            candidates.append(settings.WHISPER_SERVER_PATH)
+        if cli_path:
+            # whisper-server 通常与 whisper-cli 编译在同一目录
+            candidates.append(str(Path(cli_path).with_name("whisper-server")))
+        which_path = shutil.which("whisper-server")
+        if which_path:
+            candidates.append(which_path)
+        
+        for path in candidates:
+            if os.path.isfile(path) and os.access(path, os.X_OK):
+                logger.info(f"Found whisper-server at: {path}")
+                return path
+        
+        return None
+    
+    def _mounted_model_path(self, model_name: str) -> Optional[Path]:
+        """混合模式下挂载的模型文件（不存在时返回 None）"""
         if (hasattr(settings, 'DEPLOYMENT_MODE') and 
             settings.DEPLOYMENT_MODE == 'hybrid'):
             # In hybrid mode, models might be mounted at /app/models/
             model_file = Path(f"/app/models/ggml-{model_name}.bin")
             if model_file.exists():
-                logger.info(f"Using mounted model in hybrid mode: {model_file}")
                 return model_file
-            else:
-                logger.info(f"Model {model_name} not found in mounted path: {model_file}, will download")
+            logger.info(f"Model {model_name} not found in mounted path: {model_file}, will download")
+        return None
+    
+    def prefetch_model(self, model_name: str):
+        """模型已在磁盘上时，在后台把它预读到页缓存（与音频解码等步骤重叠）"""
+        if not settings.MODEL_PREWARM:
+            return
+        model_file = self._mounted_model_path(model_name) or self.model_store.model_path(model_name)
+        if model_file.exists():
+            self.model_store.warm_async(model_name, model_file)
+    
+    def _download_model(self, model_name: str) -> Path:
+        """Return a verified local model file, downloading it if missing or corrupted"""
+        # In hybrid mode, try mounted models first
+        model_file = self._mounted_model_path(model_name)
+        if model_file is not None:
+            logger.info(f"Using mounted model in hybrid mode: {model_file}")
+            if self.model_store.verify(model_name, model_file):
+                self.model_store.touch(model_name)
+                return model_file
+            raise RuntimeError(f"Mounted model {model_file} failed integrity check")
         
-        model_file = self.models_dir / f"ggml-{model_name}.bin"
+        model_file = self.model_store.model_path(model_name)
         
         if model_file.exists():
-            logger.info(f"Model {model_name} already exists at {model_file}")
-            return model_file
+            if self.model_store.verify(model_name, model_file):
+                logger.info(f"Model {model_name} already exists at {model_file}")
+                self.model_store.touch(model_name)
+                return model_file
+            logger.warning(f"Model {model_name} is corrupted, downloading it again")
+            self.model_store.remove(model_name)
         
         if model_name not in self.MODEL_URLS:
             raise ValueError(f"Unknown model name: {model_name}. Available: {list(self.MODEL_URLS.keys())}")
@@ -209,31 +317,22 @@ class WhisperManager:
         logger.info(f"Downloading model {model_name} from {url}")
         
         try:
-            response = requests.get(url, stream=True)
-            response.raise_for_status()
-            
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded = 0
-            
-            with open(model_file, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        if total_size > 0:
-                            progress = (downloaded / total_size) * 100
-                            if downloaded % (1024 * 1024) == 0:  # Log every MB
-                                logger.info(f"Download progress: {progress:.1f}%")
-            
+            # 并行 Range 下载，支持断点续传和校验；配置了镜像时优先从镜像下载
+            digest = download_model_file(model_file.name, url, model_file)
+            self.model_store.register(model_name, model_file, sha256=digest)
+            self.model_store.enforce_budget(keep=[model_name])
             logger.info(f"Model {model_name} downloaded successfully to {model_file}")
             return model_file
             
         except Exception as e:
-            if model_file.exists():
-                model_file.unlink()  # Remove partially downloaded file
+            # 保留 .part 文件，下次从断点继续
             raise RuntimeError(f"Failed to download model {model_name}: {e}")
     
-    def transcribe(self, audio_file_path: str, model_name: str = None, language: str = None, task_type: str = None) -> Dict[str, Any]:
+    def transcribe(self, audio_file_path: str, model_name: str = None, language: str = None, task_type: str = None,
+                   threads: Optional[int] = None, output_dir: Optional[str] = None,
+                   progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                   timeout: Optional[float] = None, affinity: Optional[List[int]] = None,
+                   token_probabilities: bool = False, record_rtf: bool = True) -> Dict[str, Any]:
         """
         Transcribe audio file using whisper.cpp command line tool
         
@@ -242,8 +341,15 @@ class WhisperManager:
             model_name: 模型名称 (可选，覆盖默认配置)
             language: 语言代码 (可选，覆盖默认配置)
             task_type: 任务类型 (可选，覆盖默认配置)
+            threads: whisper.cpp 线程数 (可选，覆盖 WHISPER_THREADS，并行分块时使用)
+            output_dir: 任务工作目录 (可选，whisper.cpp 输出文件写在这里，避免并发任务互相覆盖)
+            progress_callback: 进度回调 (可选，接收百分比、已处理音频秒数和实时率)
+            timeout: 子进程超时秒数 (可选，默认按音频时长和模型实测实时率计算)
+            affinity: 绑定的 CPU 列表 (可选，来自 cpu_planner)
+            token_probabilities: 输出 token 级概率 (-ojf)，按 token 组装带概率的单词
+            record_rtf: 记录本次运行的实时率 (并行分块只用部分线程，其耗时不代表整段运行，不记录)
         """
-        if not self.whisper_cpp_path:
+        if not self.whisper_cpp_path and not self.whisper_server_path:
             # Fallback: create mock transcription for testing
             logger.warning("whisper.cpp not available, creating mock transcription")
             return self._create_mock_transcription(audio_file_path)
@@ -261,19 +367,37 @@ class WhisperManager:
             # Download model if needed
             model_path = self._download_model(final_model_name)
             
+            # 按音频时长和模型实时率计算超时，而不是固定的 300 秒
+            audio_duration = wav_duration(audio_file_path) if is_normalized_wav(audio_file_path) else None
+            if timeout is None:
+                timeout = subprocess_timeout(final_model_name, audio_duration)
+            
+            if self.whisper_server_path:
+                return self._transcribe_with_server(
+                    audio_file_path, final_model_name, model_path, final_language, final_task_type, start_time,
+                    timeout=timeout, audio_duration=audio_duration if record_rtf else None,
+                    threads=threads, affinity=affinity
+                )
+            
+            # 每个任务使用独立的输出前缀，并发运行时不会读到别的任务的结果
+            own_output_dir = output_dir is None
+            output_dir_path = Path(output_dir or tempfile.mkdtemp(prefix="whisper_", dir=self._scratch_root()))
+            output_prefix = output_dir_path / f"{Path(audio_file_path).stem}_whisper"
+            
             # Prepare whisper.cpp command
             cmd = [
                 self.whisper_cpp_path,
                 "-f", audio_file_path,  # 输入音频文件
                 "-m", str(model_path),  # 模型路径
                 "-oj",  # 输出JSON格式
-                "-of", "/tmp/whisper_output",  # 输出文件前缀
+                "-of", str(output_prefix),  # 输出文件前缀
                 "-ng",  # 强制使用CPU模式避免GPU超时
             ]
             
             # Add additional parameters
-            if settings.WHISPER_THREADS > 0:
-                cmd.extend(["-t", str(settings.WHISPER_THREADS)])
+            final_threads = threads or settings.WHISPER_THREADS
+            if final_threads > 0:
+                cmd.extend(["-t", str(final_threads)])
             
             if final_language != "auto":
                 cmd.extend(["-l", final_language])
@@ -281,39 +405,55 @@ class WhisperManager:
             if final_task_type == "translate":
                 cmd.append("--translate")
             
-            # Run whisper.cpp
-            logger.info(f"Running command: {' '.join(cmd)}")
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+            if token_probabilities and self.supports("-ojf"):
+                cmd.append("-ojf")  # JSON 中包含 token 及其概率
             
-            if result.returncode != 0:
-                logger.error(f"whisper.cpp failed with code {result.returncode}")
-                logger.error(f"stderr: {result.stderr}")
-                raise RuntimeError(f"whisper.cpp failed: {result.stderr}")
+            if progress_callback and self.supports("-pp"):
+                cmd.append("-pp")  # 输出进度百分比
             
-            # Read JSON output
-            json_file = Path("/tmp/whisper_output.json")
-            if json_file.exists():
-                with open(json_file, 'r', encoding='utf-8') as f:
-                    whisper_result = json.load(f)
-                
-                # Clean up temp file
-                json_file.unlink()
+            try:
+                # Run whisper.cpp
+                logger.info(f"Running command: {' '.join(cmd)} (timeout {timeout:.0f}s)")
+                process_start = time.time()
+                result = self._run_whisper_process(cmd, timeout=timeout, audio_duration=audio_duration,
+                                                   progress_callback=progress_callback, affinity=affinity)
+                process_time = time.time() - process_start
                 
-                # Extract transcription text and segments from whisper.cpp JSON format
-                transcription_segments = whisper_result.get("transcription", [])
-                full_text = " ".join([seg.get("text", "").strip() for seg in transcription_segments])
-                language = whisper_result.get("result", {}).get("language", "unknown")
+                if result.returncode != 0:
+                    logger.error(f"whisper.cpp failed with code {result.returncode}")
+                    logger.error(f"stderr: {result.stderr}")
+                    raise RuntimeError(f"whisper.cpp failed: {result.stderr}")
                 
-            else:
-                # Fallback: parse text output
-                full_text = result.stdout.strip()
-                transcription_segments = []
-                language = "unknown"
+                # Read JSON output
+                json_file = output_prefix.with_suffix(".json")
+                if json_file.exists():
+                    with open(json_file, 'r', encoding='utf-8') as f:
+                        whisper_result = json.load(f)
+                    
+                    # Clean up temp file
+                    json_file.unlink()
+                    
+                    # Extract transcription text and segments from whisper.cpp JSON format
+                    transcription_segments = whisper_result.get("transcription", [])
+                    full_text = " ".join([seg.get("text", "").strip() for seg in transcription_segments])
+                    language = whisper_result.get("result", {}).get("language", "unknown")
+                    
+                else:
+                    # Fallback: parse text output
+                    full_text = result.stdout.strip()
+                    transcription_segments = []
+                    language = "unknown"
+            finally:
+                if own_output_dir:
+                    shutil.rmtree(output_dir_path, ignore_errors=True)
             
             end_time = time.time()
             transcription_duration = end_time - start_time
             
             logger.info(f"Transcription completed in {transcription_duration:.2f} seconds")
+            if audio_duration and record_rtf:
+                # 只计 whisper.cpp 进程的耗时，不含模型下载和校验
+                record_realtime_factor(final_model_name, process_time / audio_duration)
             
             # Format result to match expected structure
             formatted_result = {
@@ -323,6 +463,8 @@ class WhisperManager:
                 "transcription_time_formatted": str(timedelta(seconds=int(transcription_duration))),
                 "language": language
             }
+            if result.progress.get("realtime_factor") is not None:
+                formatted_result["realtime_factor"] = result.progress["realtime_factor"]
             
             return formatted_result
             
@@ -330,6 +472,150 @@ class WhisperManager:
             logger.error(f"Transcription failed: {e}")
             raise RuntimeError(f"whisper.cpp transcription failed: {e}")
     
+    def detect_language(self, audio_file_path: str, model_name: str, threads: Optional[int] = None,
+                        timeout: float = 120) -> Dict[str, Any]:
+        """
+        Detect the spoken language with whisper-cli -dl (only the first 30 s are decoded)
+        
+        Returns {"language", "probability"}.
+        """
+        if not self.whisper_cpp_path or not self.supports("-dl"):
+            raise RuntimeError("whisper-cli does not support language detection (-dl)")
+        
+        model_path = self._download_model(model_name)
+        cmd = [self.whisper_cpp_path, "-f", audio_file_path, "-m", str(model_path), "-dl", "-l", "auto", "-ng"]
+        final_threads = threads or settings.WHISPER_THREADS
+        if final_threads > 0:
+            cmd.extend(["-t", str(final_threads)])
+        
+        logger.info(f"Running command: {' '.join(cmd)}")
+        result = self._run_whisper_process(cmd, timeout=timeout)
+        match = DETECTED_LANGUAGE_RE.search(result.stderr + result.stdout)
+        if result.returncode != 0 or match is None:
+            raise RuntimeError(f"whisper.cpp language detection failed: {result.stderr[-500:]}")
+        return {"language": match.group(1), "probability": float(match.group(2))}
+    
+    def _run_whisper_process(self, cmd: List[str], timeout: float, audio_duration: Optional[float] = None,
+                             progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                             affinity: Optional[List[int]] = None) -> subprocess.CompletedProcess:
+        """
+        Run whisper.cpp and stream its stdout/stderr through reader threads
+        
+        Progress lines (-pp) and per-segment timestamp lines are parsed while the
+        process runs, so callers get real percentages instead of waiting for exit.
+        """
+        parser = WhisperProgressParser(audio_duration=audio_duration, callback=progress_callback)
+        
+        # worker 进程是多线程的，fork 后执行 preexec_fn 可能死锁：优先用 taskset 绑核，
+        # 没有 taskset 时在进程启动后立即设置（whisper.cpp 加载模型之后才创建计算线程）
+        taskset = shutil.which("taskset") if affinity else None
+        if taskset:
+            cmd = [taskset, "-c", ",".join(str(cpu) for cpu in affinity)] + cmd
+        
+        process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            errors="replace",
+            bufsize=1,
+        )
+        if affinity and not taskset and hasattr(os, "sched_setaffinity"):
+            try:
+                os.sched_setaffinity(process.pid, affinity)
+            except OSError as e:
+                logger.warning(f"Could not pin whisper.cpp (pid {process.pid}) to CPUs {affinity}: {e}")
+        stdout_lines: List[str] = []
+        stderr_lines: List[str] = []
+        
+        def _pump(stream, lines: List[str]):
+            for line in stream:
+                lines.append(line)
+                parser.feed(line)
+            stream.close()
+        
+        readers = [
+            threading.Thread(target=_pump, args=(process.stdout, stdout_lines), daemon=True),
+            threading.Thread(target=_pump, args=(process.stderr, stderr_lines), daemon=True),
+        ]
+        for reader in readers:
+            reader.start()
+        
+        try:
+            returncode = process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            raise
+        finally:
+            for reader in readers:
+                reader.join(timeout=5)
+        
+        completed = subprocess.CompletedProcess(cmd, returncode, "".join(stdout_lines), "".join(stderr_lines))
+        completed.progress = parser.snapshot()
+        return completed
+    
+    def _scratch_root(self) -> Path:
+        """未指定工作目录时，为单次调用选择临时目录的位置"""
+        from .workspace import select_scratch_root
+        
+        root = select_scratch_root()
+        root.mkdir(parents=True, exist_ok=True)
+        return root
+    
+    def _transcribe_with_server(self, audio_file_path: str, model_name: str, model_path: Path,
+                                language: str, task_type: str, start_time: float,
+                                timeout: float, audio_duration: Optional[float] = None,
+                                threads: Optional[int] = None, affinity: Optional[List[int]] = None) -> Dict[str, Any]:
+        """Transcribe through a warm whisper-server process instead of spawning whisper-cli"""
+        from .whisper_server import get_whisper_server_pool
+        
+        pool = get_whisper_server_pool(self.whisper_server_path)
+        server_result = pool.transcribe(
+            audio_file_path,
+            model_name=model_name,
+            model_path=str(model_path),
+            language=language,
+            task_type=task_type,
+            timeout=timeout,
+            threads=threads,
+            affinity=affinity,
+        )
+        
+        segments = self._format_server_segments(server_result.get("segments", []))
+        transcription_duration = time.time() - start_time
+        logger.info(f"Transcription completed via whisper-server in {transcription_duration:.2f} seconds")
+        if audio_duration:
+            # 只计推理请求的耗时，不含模型下载和服务进程启动
+            inference_time = server_result.get("inference_time", transcription_duration)
+            record_realtime_factor(model_name, inference_time / audio_duration)
+        
+        return {
+            "text": " ".join(seg["text"] for seg in segments),
+            "segments": segments,
+            "transcription_time": transcription_duration,
+            "transcription_time_formatted": str(timedelta(seconds=int(transcription_duration))),
+            "language": server_result.get("language", "unknown")
+        }
+    
+    def _format_server_segments(self, segments: List[Dict]) -> List[Dict]:
+        """Format whisper-server verbose_json segments to match expected structure"""
+        formatted_segments = []
+        
+        for segment in segments:
+            # verbose_json 的时间单位已经是秒；words 是子词 token，这里与 CLI 输出保持一致不展开
+            formatted_segment = {
+                "start": float(segment.get("start", 0.0)),
+                "end": float(segment.get("end", 0.0)),
+                "text": segment.get("text", "").strip(),
+                "words": []
+            }
+            if formatted_segment["text"]:
+                formatted_segments.append(formatted_segment)
+        
+        return formatted_segments
+    
     def _create_mock_transcription(self, audio_file_path: str) -> Dict[str, Any]:
         """Create a mock transcription for testing when whisper.cpp is not available"""
         mock_text = "This is a mock transcription generated because whisper.cpp is not available on this system."
@@ -378,6 +664,23 @@ class WhisperManager:
                 "words": []
             }
             
+            # -ojf 输出的 token：以空格开头的 token 开始一个新单词，其余子词拼接到前一个单词
+            for token in segment.get("tokens", []):
+                token_text = token.get("text", "")
+                if not token_text.strip() or (token_text.startswith("[_") and token_text.endswith("]")):
+                    continue  # [_BEG_]、[_TT_150] 等特殊 token
+                token_start = token.get("offsets", {}).get("from", 0) / 1000.0
+                token_end = token.get("offsets", {}).get("to", 0) / 1000.0
+                probability = token.get("p", 1.0)
+                words = formatted_segment["words"]
+                if words and not token_text.startswith(" "):
+                    words[-1]["word"] += token_text
+                    words[-1]["end"] = token_end
+                    words[-1]["probability"] = min(words[-1]["probability"], probability)
+                else:
+                    words.append({"start": token_start, "end": token_end, "word": token_text.strip(),
+                                  "probability": probability})
+            
             # Add word-level timestamps if available
             if "words" in segment:
                 for word in segment["words"]:
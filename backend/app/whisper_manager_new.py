@@ -1,8 +1,11 @@
 import os
+import re
 import logging
 import time
+import threading
 from pathlib import Path
-from typing import Optional, Dict, Any, List
+from collections import OrderedDict, Counter
+from typing import Optional, Dict, Any, List, Iterable
 from datetime import timedelta
 import platform
 
@@ -13,15 +16,167 @@ except ImportError:
     raise ImportError("Please install openai-whisper: pip install openai-whisper")
 
 from .config import settings
+from .workspace import mem_available_bytes
 
 logger = logging.getLogger(__name__)
 
+def _estimated_model_bytes(model_name: str) -> int:
+    """加载前按 SUPPORTED_MODELS 中的文件大小估算内存占用（ggml 文件是 fp16，PyTorch 权重是 fp32）"""
+    size = settings.SUPPORTED_MODELS.get(model_name, {}).get("size", "")
+    match = re.match(r"([\d.]+)\s*(MB|GB)", size)
+    if not match:
+        return 1024 ** 3
+    value = float(match.group(1)) * (1024 ** 3 if match.group(2) == "GB" else 1024 ** 2)
+    return int(value * 2)
+
+
+def _model_bytes(model) -> int:
+    """已加载模型的参数和缓冲区实际占用"""
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class ModelCache:
+    """
+    Loaded models kept in memory, least recently used evicted first
+
+    The cache holds as many models as fit in WHISPER_MODEL_CACHE_MB (half of
+    the available memory when 0). The model being requested is always
+    loaded, evicting everything else if it alone exceeds the budget. Models
+    are loaded one at a time; a request for a model that is being prefetched
+    waits for that load instead of starting a second one.
+    """
+
+    def __init__(self, loader, budget_bytes: int):
+        self._loader = loader
+        self.budget_bytes = budget_bytes
+        self._models: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self.stats = Counter()
+
+    def _lookup(self, model_name: str):
+        with self._lock:
+            entry = self._models.get(model_name)
+            if entry is not None:
+                self._models.move_to_end(model_name)
+                entry["last_used"] = time.time()
+                return entry["model"]
+        return None
+
+    def resident(self) -> List[str]:
+        with self._lock:
+            return list(self._models)
+
+    def used_bytes(self) -> int:
+        with self._lock:
+            return sum(entry["bytes"] for entry in self._models.values())
+
+    def _evict_for(self, needed: int, keep: Iterable[str] = ()) -> bool:
+        """按 LRU 淘汰，直到能放下 needed 字节；keep 中的模型不淘汰。返回是否放得下"""
+        keep = set(keep)
+        with self._lock:
+            for name in list(self._models):
+                if sum(entry["bytes"] for entry in self._models.values()) + needed <= self.budget_bytes:
+                    return True
+                if name in keep:
+                    continue
+                entry = self._models.pop(name)
+                self.stats["evictions"] += 1
+                logger.info(f"🗑️ Evicted model {name} from memory ({entry['bytes'] / 1024 ** 2:.0f} MB)")
+            return sum(entry["bytes"] for entry in self._models.values()) + needed <= self.budget_bytes
+
+    def get(self, model_name: str):
+        """返回已加载的模型，未加载时加载（必要时淘汰其他模型）"""
+        model = self._lookup(model_name)
+        if model is not None:
+            self._record("hits")
+            return model
+
+        with self._load_lock:
+            # 等锁期间可能已被预取线程加载
+            model = self._lookup(model_name)
+            if model is not None:
+                self._record("hits")
+                return model
+            self._record("misses")
+            self._evict_for(_estimated_model_bytes(model_name))
+            return self._load(model_name)
+
+    def prefetch(self, model_names: Iterable[str], keep: Iterable[str] = ()) -> List[str]:
+        """
+        Load models ahead of use, as long as they fit without evicting a model in keep
+
+        Returns the models that were loaded.
+        """
+        loaded = []
+        for model_name in model_names:
+            if self._lookup(model_name) is not None:
+                continue
+            with self._load_lock:
+                if model_name in self.resident():
+                    continue
+                if not self._evict_for(_estimated_model_bytes(model_name), keep=set(keep) | set(model_names)):
+                    logger.info(f"Not prefetching model {model_name}: does not fit in the model cache budget")
+                    break
+                self._load(model_name)
+                self._record("prefetches")
+                loaded.append(model_name)
+        return loaded
+
+    def _load(self, model_name: str):
+        start = time.time()
+        model = self._loader(model_name)
+        size = _model_bytes(model)
+        elapsed = time.time() - start
+        with self._lock:
+            self._models[model_name] = {"model": model, "bytes": size, "loaded_at": time.time(),
+                                        "last_used": time.time(), "load_seconds": elapsed}
+        self.stats["load_seconds"] += elapsed
+        logger.info(f"Model cache: loaded {model_name} ({size / 1024 ** 2:.0f} MB) in {elapsed:.1f}s, "
+                    f"{self.used_bytes() / 1024 ** 2:.0f}/{self.budget_bytes / 1024 ** 2:.0f} MB used")
+        return model
+
+    def _record(self, event: str):
+        self.stats[event] += 1
+        try:
+            from .redis_store import get_redis_client, MODEL_CACHE_STATS_KEY
+            get_redis_client().hincrby(MODEL_CACHE_STATS_KEY, event, 1)
+        except Exception as e:
+            logger.debug(f"Could not record model cache {event}: {e}")
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            models = {
+                name: {"size_mb": round(entry["bytes"] / 1024 ** 2, 1), "last_used": entry["last_used"],
+                       "load_seconds": round(entry["load_seconds"], 2)}
+                for name, entry in self._models.items()
+            }
+        requests = self.stats["hits"] + self.stats["misses"]
+        return {
+            "budget_mb": round(self.budget_bytes / 1024 ** 2),
+            "used_mb": round(sum(m["size_mb"] for m in models.values())),
+            "models": models,
+            "hits": self.stats["hits"],
+            "misses": self.stats["misses"],
+            "hit_rate": round(self.stats["hits"] / requests, 3) if requests else None,
+            "evictions": self.stats["evictions"],
+            "prefetches": self.stats["prefetches"],
+        }
+
+
 class WhisperManager:
     """Manages OpenAI Whisper model loading and inference"""
     
     def __init__(self):
-        self.whisper_model: Optional[whisper.Whisper] = None
+        budget_mb = settings.WHISPER_MODEL_CACHE_MB
+        if budget_mb > 0:
+            budget = budget_mb * 1024 ** 2
+        else:
+            budget = (mem_available_bytes() or 4 * 1024 ** 3) // 2
+        self.model_cache = ModelCache(self._load_from_disk, budget)
         self.current_model_name: Optional[str] = None
+        self._prefetch_thread: Optional[threading.Thread] = None
     
     def _get_device_setting(self) -> str:
         """Determine the best device setting for whisper"""
@@ -55,14 +210,7 @@ class WhisperManager:
         
         return "cpu"
     
-    def load_model(self, model_name: Optional[str] = None) -> whisper.Whisper:
-        """Load or reload OpenAI Whisper model"""
-        model_name = model_name or settings.MODEL_NAME
-        
-        if self.whisper_model and self.current_model_name == model_name:
-            logger.info(f"Model {model_name} already loaded")
-            return self.whisper_model
-        
+    def _load_from_disk(self, model_name: str) -> whisper.Whisper:
         # Determine device
         device = self._get_device_setting()
         
@@ -70,23 +218,77 @@ class WhisperManager:
             logger.info(f"Loading OpenAI Whisper model: {model_name} on device: {device}")
             
             # Load model with device setting
-            self.whisper_model = whisper.load_model(model_name, device=device)
-            self.current_model_name = model_name
+            model = whisper.load_model(model_name, device=device)
             
             logger.info(f"✅ Whisper model {model_name} loaded successfully on {device}")
-            return self.whisper_model
+            return model
             
         except Exception as e:
             logger.error(f"Failed to load OpenAI Whisper model: {e}")
             raise RuntimeError(f"Could not load OpenAI Whisper model {model_name}: {e}")
     
-    def transcribe(self, audio_file_path: str) -> Dict[str, Any]:
-        """Transcribe audio file using OpenAI Whisper"""
-        if not self.whisper_model:
-            self.load_model()
+    def load_model(self, model_name: Optional[str] = None) -> whisper.Whisper:
+        """Get OpenAI Whisper model from the in-memory cache, loading it if needed"""
+        model_name = model_name or settings.MODEL_NAME
+        model = self.model_cache.get(model_name)
+        self.current_model_name = model_name
+        return model
+    
+    def prefetch_queued_models(self):
+        """
+        在后台线程中预加载队列里即将用到的模型（按排队任务数从多到少）
+        
+        只统计使用 openai_whisper 引擎的排队任务；放不下时不会淘汰当前模型。
+        """
+        if not settings.WHISPER_MODEL_CACHE_PREFETCH:
+            return
+        if self._prefetch_thread is not None and self._prefetch_thread.is_alive():
+            return
+        
+        from .redis_store import queued_transcription_params
+        demand = Counter(
+            params.get("model") or settings.MODEL_NAME
+            for params in queued_transcription_params(limit=settings.WHISPER_MODEL_CACHE_LOOKAHEAD)
+            if (params.get("engine") or settings.TRANSCRIPTION_ENGINE) == "openai_whisper"
+        )
+        upcoming = [name for name, _ in demand.most_common() if name not in self.model_cache.resident()]
+        if not upcoming:
+            return
+        
+        keep = [self.current_model_name] if self.current_model_name else []
+        logger.info(f"Prefetching queued models {upcoming} (queued jobs: {dict(demand)})")
+        self._prefetch_thread = threading.Thread(
+            target=self._prefetch_quietly, args=(upcoming, keep), daemon=True
+        )
+        self._prefetch_thread.start()
+    
+    def _prefetch_quietly(self, model_names: List[str], keep: List[str]):
+        try:
+            self.model_cache.prefetch(model_names, keep=keep)
+        except Exception as e:
+            logger.warning(f"Model prefetch failed: {e}")
+    
+    def transcribe(self, audio_file_path, model_name: Optional[str] = None, language: Optional[str] = None,
+                   task_type: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Transcribe audio using OpenAI Whisper
+        
+        Args:
+            audio_file_path: 音频文件路径，或 16 kHz 单声道 float32 PCM 数组
+            model_name: 模型名称 (可选，从内存中的模型缓存获取)
+            language: 语言代码 (可选，覆盖默认配置)
+            task_type: 任务类型 (可选，覆盖默认配置)
+        """
+        whisper_model = self.load_model(model_name)
+        # 当前模型就位后，在后台加载排队任务需要的模型
+        self.prefetch_queued_models()
+        
+        final_language = language or settings.WHISPER_LANGUAGE
+        final_task_type = task_type or settings.WHISPER_TASK
         
         try:
-            logger.info(f"Starting transcription with OpenAI Whisper for {audio_file_path}")
+            source = audio_file_path if isinstance(audio_file_path, str) else f"<{len(audio_file_path)} samples>"
+            logger.info(f"Starting transcription with OpenAI Whisper for {source}")
             start_time = time.time()
             
             # Prepare transcription parameters
@@ -97,15 +299,15 @@ class WhisperManager:
             }
             
             # Add language if specified
-            if settings.WHISPER_LANGUAGE != "auto":
-                transcribe_options["language"] = settings.WHISPER_LANGUAGE
+            if final_language != "auto":
+                transcribe_options["language"] = final_language
             
             # Add task if specified
-            if settings.WHISPER_TASK == "translate":
+            if final_task_type == "translate":
                 transcribe_options["task"] = "translate"
             
             # Perform transcription
-            result = self.whisper_model.transcribe(audio_file_path, **transcribe_options)
+            result = whisper_model.transcribe(audio_file_path, **transcribe_options)
             
             end_time = time.time()
             transcription_duration = end_time - start_time
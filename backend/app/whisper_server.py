@@ -0,0 +1,392 @@
+import os
+import json
+import time
+import fcntl
+import signal
+import socket
+import logging
+import threading
+import subprocess
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List
+
+import requests
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class WhisperServerError(RuntimeError):
+    """Raised when a whisper-server process cannot serve a request"""
+
+
+def _pid_alive(pid: int) -> bool:
+    """检查进程是否仍然存活"""
+    try:
+        # 本进程启动的服务进程崩溃后会成为僵尸进程，kill(pid, 0) 仍然成功，先尝试回收
+        if os.waitpid(pid, os.WNOHANG)[0] == pid:
+            return False
+    except ChildProcessError:
+        pass
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _process_start_time(pid: int) -> Optional[int]:
+    """进程的启动时间（/proc/<pid>/stat 第 22 个字段，开机后的时钟滴答数）；无法读取时返回 None"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # 第 2 个字段是括号中的进程名，可能包含空格，从最后一个 ')' 之后开始数
+    fields = stat[stat.rfind(")") + 2:].split()
+    try:
+        return int(fields[19])
+    except (IndexError, ValueError):
+        return None
+
+
+def _is_server_process(entry: Dict[str, Any]) -> bool:
+    """
+    注册表中的 pid 是否仍是当初启动的服务进程
+
+    注册表在 worker 重启甚至主机重启后仍然保留，pid 可能已被无关进程复用，
+    所以除了存活还要比较启动时间。
+    """
+    if not _pid_alive(entry["pid"]):
+        return False
+    expected = entry.get("start_time")
+    if expected is None:
+        return True
+    return _process_start_time(entry["pid"]) == expected
+
+
+def _pin_process(pid: int, cpus: List[int]):
+    """把进程的所有线程绑定到 cpus（之后创建的线程继承该设置）"""
+    if not hasattr(os, "sched_setaffinity"):
+        return
+    try:
+        tids = [int(tid) for tid in os.listdir(f"/proc/{pid}/task")]
+    except OSError:
+        tids = [pid]
+    for tid in tids:
+        try:
+            os.sched_setaffinity(tid, cpus)
+        except OSError as e:
+            logger.debug(f"Could not pin whisper-server thread {tid} to CPUs {cpus}: {e}")
+
+
+def _find_free_port(host: str) -> int:
+    """向系统申请一个空闲端口"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+class WhisperServerPool:
+    """
+    Keeps long-lived whisper-server processes per model so jobs skip the model load.
+
+    The pool state lives in a host-wide registry file guarded by flock, so every
+    Celery worker child on the host shares the same warm processes, and the
+    processes survive worker recycling (worker_max_tasks_per_child).
+    """
+
+    def __init__(self, server_path: str):
+        self.server_path = server_path
+        self.host = settings.WHISPER_SERVER_HOST
+        self.state_dir = Path(settings.WHISPER_SERVER_STATE_DIR).expanduser()
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        self.state_file = self.state_dir / "servers.json"
+        self._reaper_started = False
+        self._reaper_lock = threading.Lock()
+
+    @contextmanager
+    def _locked_state(self):
+        """以独占锁读写主机级进程注册表"""
+        with open(self.state_dir / "servers.lock", "a+") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                state = {}
+                if self.state_file.exists():
+                    try:
+                        state = json.loads(self.state_file.read_text() or "{}")
+                    except json.JSONDecodeError:
+                        logger.warning(f"Corrupted whisper-server registry, resetting: {self.state_file}")
+                        state = {}
+                self._prune_dead(state)
+                yield state
+                tmp_file = self.state_file.with_suffix(".tmp")
+                tmp_file.write_text(json.dumps(state, indent=2))
+                os.replace(tmp_file, self.state_file)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _prune_dead(state: Dict[str, List[Dict[str, Any]]]):
+        """移除已退出的服务进程和已退出进程持有的租约"""
+        for model_name in list(state.keys()):
+            alive = []
+            for entry in state[model_name]:
+                if not _is_server_process(entry):
+                    logger.warning(f"whisper-server for {model_name} (pid {entry['pid']}) is gone, removing")
+                    continue
+                entry["leases"] = [pid for pid in entry.get("leases", []) if _pid_alive(pid)]
+                alive.append(entry)
+            if alive:
+                state[model_name] = alive
+            else:
+                del state[model_name]
+
+    def _spawn(self, model_name: str, model_path: str, threads: Optional[int] = None) -> Dict[str, Any]:
+        """启动一个新的 whisper-server 进程（调用方需持有注册表锁）；threads 来自任务的 CPU 规划"""
+        port = _find_free_port(self.host)
+        cmd = [
+            self.server_path,
+            "-m", model_path,
+            "--host", self.host,
+            "--port", str(port),
+            "-ng",  # 与 CLI 模式保持一致，强制使用CPU
+        ]
+        threads = threads or settings.WHISPER_THREADS
+        if threads > 0:
+            cmd.extend(["-t", str(threads)])
+
+        log_path = self.state_dir / f"{model_name}-{port}.log"
+        logger.info(f"Starting whisper-server for {model_name}: {' '.join(cmd)}")
+        with open(log_path, "ab") as log_file:
+            # start_new_session 让服务进程脱离当前 worker 子进程，worker 回收时不会被一起杀掉
+            process = subprocess.Popen(
+                cmd,
+                stdin=subprocess.DEVNULL,
+                stdout=log_file,
+                stderr=subprocess.STDOUT,
+                start_new_session=True,
+            )
+
+        return {
+            "pid": process.pid,
+            "start_time": _process_start_time(process.pid),
+            "port": port,
+            "model_path": model_path,
+            "threads": threads,
+            "started_at": time.time(),
+            "last_used": time.time(),
+            "leases": [],
+        }
+
+    def _acquire(self, model_name: str, model_path: str, threads: Optional[int] = None) -> Dict[str, Any]:
+        """
+        选择进程：优先使用线程数与本任务 CPU 规划相同的空闲进程；没有时在
+        WHISPER_SERVER_INSTANCES 之内按规划的线程数启动新进程，否则使用最空闲的进程
+        """
+        with self._locked_state() as state:
+            entries = state.setdefault(model_name, [])
+            entry = next((e for e in entries if not e["leases"] and (not threads or e.get("threads") == threads)), None)
+            if entry is None and len(entries) < settings.WHISPER_SERVER_INSTANCES:
+                entry = self._spawn(model_name, model_path, threads)
+                entries.append(entry)
+            if entry is None:
+                entry = min(entries, key=lambda e: len(e["leases"]))
+            entry["leases"].append(os.getpid())
+            entry["last_used"] = time.time()
+            return dict(entry)
+
+    def _release(self, model_name: str, pid: int):
+        """释放租约并刷新最近使用时间"""
+        with self._locked_state() as state:
+            for entry in state.get(model_name, []):
+                if entry["pid"] == pid:
+                    if os.getpid() in entry["leases"]:
+                        entry["leases"].remove(os.getpid())
+                    entry["last_used"] = time.time()
+
+    def _discard(self, model_name: str, pid: int):
+        """终止并移除一个异常的服务进程"""
+        with self._locked_state() as state:
+            entries = state.get(model_name, [])
+            removed = [e for e in entries if e["pid"] == pid]
+            state[model_name] = [e for e in entries if e["pid"] != pid]
+            if not state[model_name]:
+                del state[model_name]
+        for entry in removed:
+            self._terminate(entry)
+
+    @staticmethod
+    def _terminate(entry: Dict[str, Any]):
+        # pid 被复用时不能向无关的进程组发信号
+        if not _is_server_process(entry):
+            return
+        try:
+            os.killpg(entry["pid"], signal.SIGTERM)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def _base_url(self, entry: Dict[str, Any]) -> str:
+        return f"http://{self.host}:{entry['port']}"
+
+    def _health_check(self, entry: Dict[str, Any]) -> bool:
+        """检查服务是否已加载模型并可以接收请求"""
+        try:
+            response = requests.get(f"{self._base_url(entry)}/health", timeout=2)
+        except requests.RequestException:
+            return False
+        if response.status_code == 404:
+            # 旧版本 whisper-server 没有 /health，能响应即视为就绪
+            return True
+        return response.status_code == 200
+
+    def _wait_until_ready(self, entry: Dict[str, Any]):
+        deadline = time.time() + settings.WHISPER_SERVER_STARTUP_TIMEOUT
+        while time.time() < deadline:
+            if not _pid_alive(entry["pid"]):
+                raise WhisperServerError(f"whisper-server (pid {entry['pid']}) exited during startup")
+            if self._health_check(entry):
+                return
+            time.sleep(0.2)
+        raise WhisperServerError(
+            f"whisper-server (pid {entry['pid']}) not ready after {settings.WHISPER_SERVER_STARTUP_TIMEOUT}s"
+        )
+
+    def _inference(self, entry: Dict[str, Any], audio_file_path: str, language: str,
+                   task_type: str, timeout: float) -> Dict[str, Any]:
+        data = {
+            "response_format": "verbose_json",
+            "temperature": str(settings.WHISPER_TEMPERATURE),
+            "language": language or "auto",
+            "translate": "true" if task_type == "translate" else "false",
+        }
+        with open(audio_file_path, "rb") as audio_file:
+            response = requests.post(
+                f"{self._base_url(entry)}/inference",
+                files={"file": (Path(audio_file_path).name, audio_file)},
+                data=data,
+                timeout=timeout,
+            )
+        if response.status_code != 200:
+            raise WhisperServerError(f"whisper-server returned {response.status_code}: {response.text[:500]}")
+        result = response.json()
+        if "error" in result:
+            raise WhisperServerError(f"whisper-server error: {result['error']}")
+        return result
+
+    def transcribe(self, audio_file_path: str, model_name: str, model_path: str,
+                   language: str, task_type: str, timeout: float = 300,
+                   threads: Optional[int] = None, affinity: Optional[List[int]] = None) -> Dict[str, Any]:
+        """
+        Send one job to a warm whisper-server process for the model
+
+        threads and affinity come from the job's CPU plan: a new process is
+        started with that many threads, and a process the job has to itself
+        is pinned to the planned cores before the request is sent.
+
+        A crashed or unhealthy process is discarded and the request is retried
+        once on a freshly started process. A process that accepts the request
+        but does not answer within timeout is wedged: it is discarded too, but
+        the job is not retried (that would only double the wait).
+        """
+        self._ensure_reaper()
+        last_error: Optional[Exception] = None
+
+        for attempt in range(2):
+            entry = self._acquire(model_name, model_path, threads)
+            try:
+                self._wait_until_ready(entry)
+                if affinity and entry["leases"] == [os.getpid()]:
+                    _pin_process(entry["pid"], affinity)
+                inference_start = time.time()
+                result = self._inference(entry, audio_file_path, language, task_type, timeout)
+                result["inference_time"] = time.time() - inference_start  # 不含进程启动和模型加载
+                return result
+            except requests.ReadTimeout as e:
+                logger.warning(f"whisper-server for {model_name} (pid {entry['pid']}) timed out after {timeout}s, discarding")
+                self._discard(model_name, entry["pid"])
+                raise WhisperServerError(f"whisper-server for {model_name} did not respond within {timeout}s") from e
+            except (requests.RequestException, WhisperServerError) as e:
+                last_error = e
+                logger.warning(f"whisper-server for {model_name} failed (attempt {attempt + 1}): {e}, restarting")
+                self._discard(model_name, entry["pid"])
+            finally:
+                self._release(model_name, entry["pid"])
+
+        raise WhisperServerError(f"whisper-server for {model_name} failed after restart: {last_error}")
+
+    def status(self) -> Dict[str, List[Dict[str, Any]]]:
+        """返回当前主机上常驻进程的状态"""
+        with self._locked_state() as state:
+            return {
+                model_name: [
+                    {
+                        "pid": e["pid"],
+                        "port": e["port"],
+                        "busy": bool(e["leases"]),
+                        "idle_seconds": round(time.time() - e["last_used"], 1),
+                    }
+                    for e in entries
+                ]
+                for model_name, entries in state.items()
+            }
+
+    def reap_idle(self):
+        """关闭超过空闲时间且没有租约的进程"""
+        now = time.time()
+        to_stop = []
+        with self._locked_state() as state:
+            for model_name in list(state.keys()):
+                keep = []
+                for entry in state[model_name]:
+                    if not entry["leases"] and now - entry["last_used"] > settings.WHISPER_SERVER_IDLE_TIMEOUT:
+                        to_stop.append((model_name, entry))
+                    else:
+                        keep.append(entry)
+                if keep:
+                    state[model_name] = keep
+                else:
+                    del state[model_name]
+        for model_name, entry in to_stop:
+            logger.info(f"Stopping idle whisper-server for {model_name} (pid {entry['pid']})")
+            self._terminate(entry)
+
+    def shutdown(self):
+        """关闭所有常驻进程"""
+        with self._locked_state() as state:
+            stopping = [e for entries in state.values() for e in entries]
+            state.clear()
+        for entry in stopping:
+            self._terminate(entry)
+
+    def _ensure_reaper(self):
+        with self._reaper_lock:
+            if self._reaper_started:
+                return
+            self._reaper_started = True
+
+        def _reaper_loop():
+            interval = max(5, min(60, settings.WHISPER_SERVER_IDLE_TIMEOUT // 4))
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reap_idle()
+                except Exception as e:
+                    logger.warning(f"whisper-server idle reaper failed: {e}")
+
+        threading.Thread(target=_reaper_loop, name="whisper-server-reaper", daemon=True).start()
+
+
+# Global server pool instance
+_server_pool = None
+
+def get_whisper_server_pool(server_path: str) -> WhisperServerPool:
+    """Get or create the global whisper-server pool"""
+    global _server_pool
+    if _server_pool is None or _server_pool.server_path != server_path:
+        _server_pool = WhisperServerPool(server_path)
+    return _server_pool
@@ -0,0 +1,150 @@
+"""
+Per-job scratch workspaces for whisper output, extracted audio and chunks
+"""
+import os
+import time
+import shutil
+import logging
+import tempfile
+from pathlib import Path
+from typing import Optional, List
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+OWNER_FILE = ".owner"
+WORKSPACE_DIRNAME = "audio2sub"
+
+# 同一进程内两次清理残留目录的最小间隔（秒）
+_SWEEP_INTERVAL = 300
+_last_sweep = 0.0
+
+
+def mem_available_bytes() -> Optional[int]:
+    """读取 /proc/meminfo 中的 MemAvailable（非 Linux 返回 None）"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _disk_root() -> Path:
+    return Path(settings.SCRATCH_DIR or tempfile.gettempdir()) / WORKSPACE_DIRNAME
+
+
+def _tmpfs_root() -> Path:
+    return Path(settings.SCRATCH_TMPFS_PATH) / WORKSPACE_DIRNAME
+
+
+def select_scratch_root(expected_bytes: int = 0) -> Path:
+    """
+    Pick the scratch root for a job: the RAM-backed tmpfs when both the tmpfs
+    and the host have room for the job plus the configured reserve, otherwise
+    the disk scratch directory.
+    """
+    if settings.SCRATCH_PREFER_TMPFS and os.path.isdir(settings.SCRATCH_TMPFS_PATH):
+        reserve = settings.SCRATCH_TMPFS_MIN_FREE_MB * 1024 * 1024
+        try:
+            stat = os.statvfs(settings.SCRATCH_TMPFS_PATH)
+            tmpfs_free = stat.f_bavail * stat.f_frsize
+        except OSError:
+            tmpfs_free = 0
+        mem_available = mem_available_bytes()
+        # tmpfs 的数据占用内存，所以同时检查文件系统剩余空间和系统可用内存
+        if (tmpfs_free >= expected_bytes + reserve and mem_available is not None
+                and mem_available >= expected_bytes + reserve
+                and os.access(settings.SCRATCH_TMPFS_PATH, os.W_OK)):
+            return _tmpfs_root()
+    return _disk_root()
+
+
+def _owner_alive(workspace_dir: Path) -> bool:
+    try:
+        pid = int((workspace_dir / OWNER_FILE).read_text().strip())
+    except (OSError, ValueError):
+        # 没有属主记录的目录只在足够旧时才清理
+        try:
+            return time.time() - workspace_dir.stat().st_mtime < 3600
+        except OSError:
+            return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def sweep_stale_workspaces(force: bool = False) -> List[str]:
+    """
+    Remove workspaces whose owning process is gone, e.g. a worker child killed
+    by `revoke(terminate=True)` or the OOM killer before its cleanup ran.
+    """
+    global _last_sweep
+    if not force and time.time() - _last_sweep < _SWEEP_INTERVAL:
+        return []
+    _last_sweep = time.time()
+
+    removed = []
+    for root in {_disk_root(), _tmpfs_root()}:
+        if not root.is_dir():
+            continue
+        for workspace_dir in root.iterdir():
+            if workspace_dir.is_dir() and not _owner_alive(workspace_dir):
+                shutil.rmtree(workspace_dir, ignore_errors=True)
+                removed.append(str(workspace_dir))
+    if removed:
+        logger.info(f"🧹 Removed {len(removed)} stale job workspaces")
+    return removed
+
+
+class JobWorkspace:
+    """Isolated scratch directory for a single transcription job"""
+
+    def __init__(self, job_id: str, expected_bytes: int = 0):
+        self.job_id = job_id
+        self.expected_bytes = expected_bytes
+        self.path: Optional[Path] = None
+
+    def create(self) -> Path:
+        """创建工作目录并记录属主进程"""
+        sweep_stale_workspaces()
+        root = select_scratch_root(self.expected_bytes)
+        root.mkdir(parents=True, exist_ok=True)
+        self.path = Path(tempfile.mkdtemp(prefix=f"{self.job_id}_", dir=root))
+        (self.path / OWNER_FILE).write_text(str(os.getpid()))
+        logger.info(f"📂 Job workspace: {self.path}")
+        return self.path
+
+    def file(self, name: str) -> Path:
+        """返回工作目录中的文件路径"""
+        if self.path is None:
+            self.create()
+        return self.path / name
+
+    def subdir(self, name: str) -> Path:
+        """返回（并创建）工作目录中的子目录"""
+        directory = self.file(name)
+        directory.mkdir(parents=True, exist_ok=True)
+        return directory
+
+    def cleanup(self):
+        """删除工作目录（成功、失败都需要调用）"""
+        if self.path is not None:
+            shutil.rmtree(self.path, ignore_errors=True)
+            logger.info(f"Cleaned up job workspace: {self.path}")
+            self.path = None
+
+    def __enter__(self) -> "JobWorkspace":
+        self.create()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cleanup()
+        return False
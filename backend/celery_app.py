@@ -1,5 +1,7 @@
 from celery import Celery
+from celery.signals import worker_process_init
 from app.config import settings
+from app.cpu_planner import recommended_worker_concurrency
 
 # Initialize Celery
 celery_app = Celery(
@@ -23,12 +25,25 @@ celery_app.conf.update(
     task_soft_time_limit=3600,  # 1 hour
     task_time_limit=3900,  # 1 hour 5 minutes
     # Prevent memory leaks with prefork pool
-    worker_max_tasks_per_child=10,
+    worker_max_tasks_per_child=settings.WORKER_MAX_TASKS_PER_CHILD or None,
     worker_prefetch_multiplier=1,
     # Use prefork pool for better concurrency support
-    worker_concurrency=2,  # Limit concurrent workers for memory management
+    worker_concurrency=settings.WORKER_CONCURRENCY or recommended_worker_concurrency(),
 )
 
+@worker_process_init.connect
+def sweep_stale_workspaces_on_start(**kwargs):
+    """新的 worker 子进程启动时，清理被终止（revoke/OOM）的任务遗留的临时目录"""
+    from app.workspace import sweep_stale_workspaces
+    sweep_stale_workspaces(force=True)
+
+@worker_process_init.connect
+def prewarm_default_model(**kwargs):
+    """worker 子进程启动时预读默认模型，第一个任务不必从磁盘加载"""
+    if settings.MODEL_PREWARM:
+        from app.model_store import get_model_store
+        get_model_store().warm_async(settings.MODEL_NAME)
+
 # If you have a lot of tasks or complex routing, you might want to use autodiscover_tasks
 # celery_app.autodiscover_tasks(['app'])
 
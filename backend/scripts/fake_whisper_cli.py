@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Drop-in fake whisper-cli for load testing without models
+
+Accepts the whisper-cli options the workers use, spends time / CPU / memory
+according to the audio duration and model (see app/synthetic.py), prints
+progress and segment lines like whisper.cpp and writes whisper.cpp-shaped
+JSON next to the -of prefix.
+
+    WHISPER_CPP_PATH=$PWD/scripts/fake_whisper_cli.py \\
+    SYNTHETIC_RTF_SCALE=0.5 SYNTHETIC_FAILURE_RATE=0.02 \\
+    celery -A celery_app.celery_app worker --loglevel=info
+
+    # workers verify the model file before running, so create placeholders once
+    scripts/fake_whisper_cli.py --create-models models base,small
+
+Tuning (environment): SYNTHETIC_RTF_SCALE, SYNTHETIC_CPU_FRACTION,
+SYNTHETIC_MEMORY_SCALE, SYNTHETIC_FAILURE_RATE, SYNTHETIC_LOAD_SECONDS,
+SYNTHETIC_SEED.
+"""
+import os
+import sys
+import json
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.audio import wav_duration, is_normalized_wav  # noqa: E402
+from app.synthetic import (  # noqa: E402
+    SyntheticProfile, input_key, simulate_work, synthetic_transcription,
+)
+
+HELP = """
+usage: {prog} [options] file0 file1 ...
+
+options:
+  -h,        --help              [default] show this help message and exit
+  -t N,      --threads N         [4      ] number of threads to use during computation
+  -l LANG,   --language LANG     [en     ] spoken language ('auto' for auto-detect)
+  -dl,       --detect-language   [false  ] exit after automatically detecting language
+  -tr,       --translate         [false  ] translate from source language to english
+  -oj,       --output-json       [false  ] output result in a JSON file
+  -ojf,      --output-json-full  [false  ] include more information in the JSON file
+  -of FNAME, --output-file FNAME [       ] output file path (without file extension)
+  -pp,       --print-progress    [false  ] print progress
+  -np,       --no-prints         [false  ] do not print anything other than the results
+  -ng,       --no-gpu            [false  ] disable GPU
+  -m FNAME,  --model FNAME       [models/ggml-base.en.bin] model path
+  -f FNAME,  --file FNAME        [       ] input WAV file path
+"""
+
+VALUE_OPTIONS = {"-t": "threads", "--threads": "threads", "-l": "language", "--language": "language",
+                 "-of": "output", "--output-file": "output", "-m": "model", "--model": "model",
+                 "-f": "file", "--file": "file"}
+FLAG_OPTIONS = {"-dl": "detect_language", "--detect-language": "detect_language",
+                "-tr": "translate", "--translate": "translate", "-oj": "json", "--output-json": "json",
+                "-ojf": "json_full", "--output-json-full": "json_full", "-pp": "progress",
+                "--print-progress": "progress", "-np": "no_prints", "--no-prints": "no_prints"}
+
+
+def parse_args(argv):
+    args = {"threads": "4", "language": "en", "output": None, "model": "models/ggml-base.en.bin", "files": []}
+    index = 0
+    while index < len(argv):
+        arg = argv[index]
+        if arg in VALUE_OPTIONS:
+            index += 1
+            if VALUE_OPTIONS[arg] == "file":
+                args["files"].append(argv[index])
+            else:
+                args[VALUE_OPTIONS[arg]] = argv[index]
+        elif arg in FLAG_OPTIONS:
+            args[FLAG_OPTIONS[arg]] = True
+        elif arg.startswith("-"):
+            pass  # 其他 whisper-cli 参数（-ng、-osrt 等）不影响模拟结果
+        else:
+            args["files"].append(arg)
+        index += 1
+    return args
+
+
+def _clock(seconds: float) -> str:
+    ms = int(round(seconds * 1000))
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d}.{ms % 1000:03d}"
+
+
+def create_models(models_dir: str, names: str) -> int:
+    """为 worker 的模型校验创建占位文件（内容按模型名确定）"""
+    directory = Path(models_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    for name in filter(None, (n.strip() for n in names.split(","))):
+        path = directory / f"ggml-{name}.bin"
+        if not path.exists():
+            path.write_bytes(f"synthetic whisper model {name}\n".encode())
+        print(path)
+    return 0
+
+
+def main(argv) -> int:
+    if argv[:1] in (["-h"], ["--help"]):
+        sys.stderr.write(HELP.format(prog=Path(sys.argv[0]).name))
+        return 0
+    if argv[:1] == ["--create-models"] and len(argv) == 3:
+        return create_models(argv[1], argv[2])
+
+    args = parse_args(argv)
+    if not args["files"]:
+        sys.stderr.write("error: no input files specified\n")
+        return 2
+    if not os.path.exists(args["model"]):
+        sys.stderr.write(f"error: failed to initialize whisper context (model '{args['model']}' not found)\n")
+        return 3
+
+    profile = SyntheticProfile.from_mapping(os.environ)
+    model_name = Path(args["model"]).name
+    memory = profile.memory_bytes(model_name)
+
+    for audio_file in args["files"]:
+        if not is_normalized_wav(audio_file):
+            sys.stderr.write(f"error: failed to read WAV file '{audio_file}' (expected 16 kHz mono PCM)\n")
+            return 4
+        duration = wav_duration(audio_file)
+        key = input_key(audio_file, model_name)
+        result = synthetic_transcription(key, duration, model_name, language=args["language"],
+                                         translate=bool(args.get("translate")), full=bool(args.get("json_full")),
+                                         seed=profile.seed)
+
+        if args.get("detect_language"):
+            simulate_work(profile.load_seconds + min(30.0, duration) * 0.01, profile.cpu_fraction, memory)
+            sys.stderr.write(f"whisper_full_with_state: auto-detected language: {result['result']['language']} "
+                             f"(p = 0.9{int(key[:2], 16) % 10})\n")
+            continue
+
+        sys.stderr.write(f"whisper_init_from_file_with_params_no_state: loading model from '{args['model']}'\n")
+        sys.stderr.write(f"main: processing '{audio_file}' ({int(duration * 16000)} samples, {duration:.1f} sec), "
+                         f"{args['threads']} threads, lang = {result['result']['language']}, "
+                         f"task = {'translate' if args.get('translate') else 'transcribe'} ...\n")
+
+        segments = result["transcription"]
+        printed = {"segments": 0, "percent": -1}
+
+        def on_progress(fraction: float):
+            # 按模拟进度输出已“识别”的片段和进度百分比
+            processed = fraction * duration
+            while printed["segments"] < len(segments) and \
+                    segments[printed["segments"]]["offsets"]["to"] / 1000 <= processed:
+                segment = segments[printed["segments"]]
+                sys.stdout.write(f"[{_clock(segment['offsets']['from'] / 1000)} --> "
+                                 f"{_clock(segment['offsets']['to'] / 1000)}]  {segment['text']}\n")
+                sys.stdout.flush()
+                printed["segments"] += 1
+            percent = int(fraction * 100) // 5 * 5
+            if args.get("progress") and percent > printed["percent"]:
+                printed["percent"] = percent
+                sys.stderr.write(f"whisper_print_progress_callback: progress = {percent:3d}%\n")
+                sys.stderr.flush()
+
+        simulate_work(profile.processing_seconds(model_name, duration), profile.cpu_fraction, memory,
+                      progress=on_progress)
+        on_progress(1.0)
+
+        if profile.should_fail(key):
+            sys.stderr.write(f"whisper_full_with_state: synthetic failure for '{audio_file}' "
+                             f"(SYNTHETIC_FAILURE_RATE={profile.failure_rate})\n")
+            return 10
+
+        if args.get("json") or args.get("json_full"):
+            output = Path((args["output"] or audio_file) + ".json")
+            output.write_text(json.dumps(result, indent=2, ensure_ascii=False), encoding="utf-8")
+            sys.stderr.write(f"output_json: saving output to '{output}'\n")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Concurrent upload throughput and API latency under upload load
+
+Sends N concurrent uploads of a generated file to a running API while
+polling a cheap endpoint (/ping by default, or /status/<task_id>), first
+without load for a baseline. Reports aggregate upload throughput and the
+probe latency percentiles, so a blocked event loop shows up as a probe
+latency that grows with upload size.
+
+    uvicorn app.main:app --port 8000 &
+    scripts/upload_benchmark.py --url http://localhost:8000 --uploads 4 --size-mb 512
+    scripts/upload_benchmark.py --probe-path /status/<task_id>
+"""
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+
+import httpx
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(name, latencies):
+    if not latencies:
+        return f"{name}: no samples"
+    ms = [value * 1000 for value in latencies]
+    return (f"{name}: n={len(ms)} p50={percentile(ms, 0.5):.1f}ms p95={percentile(ms, 0.95):.1f}ms "
+            f"p99={percentile(ms, 0.99):.1f}ms max={max(ms):.1f}ms")
+
+
+async def probe(client, path, interval, stop, latencies):
+    """stop 被设置前，每隔 interval 秒请求一次 path 并记录延迟"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            await client.get(path)
+            latencies.append(time.perf_counter() - start)
+        except httpx.HTTPError as e:
+            print(f"probe failed: {e}")
+        await asyncio.sleep(interval)
+
+
+async def upload(client, endpoint, payload, model):
+    start = time.perf_counter()
+    with open(payload, "rb") as f:
+        response = await client.post(endpoint, files={"file": (payload.name, f)},
+                                     data={"model": model, "no_cache": "true"})
+    return response.status_code, time.perf_counter() - start
+
+
+async def run(args):
+    payload = Path(tempfile.gettempdir()) / f"upload_benchmark_{args.size_mb}mb.mp3"
+    size = args.size_mb * 1024 * 1024
+    if not payload.exists() or payload.stat().st_size != size:
+        with open(payload, "wb") as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+
+    timeout = httpx.Timeout(args.timeout)
+    async with httpx.AsyncClient(base_url=args.url, timeout=timeout) as probe_client, \
+            httpx.AsyncClient(base_url=args.url, timeout=timeout) as upload_client:
+        # 空载基线
+        baseline, stop = [], asyncio.Event()
+        task = asyncio.create_task(probe(probe_client, args.probe_path, args.probe_interval, stop, baseline))
+        await asyncio.sleep(args.baseline_seconds)
+        stop.set()
+        await task
+
+        loaded, stop = [], asyncio.Event()
+        task = asyncio.create_task(probe(probe_client, args.probe_path, args.probe_interval, stop, loaded))
+        start = time.perf_counter()
+        results = await asyncio.gather(*(upload(upload_client, args.endpoint, payload, args.model)
+                                         for _ in range(args.uploads)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await task
+
+    statuses = [status for status, _ in results]
+    durations = [duration for _, duration in results]
+    print(f"uploads: {args.uploads} x {args.size_mb} MB to {args.endpoint}, statuses {sorted(set(statuses))}")
+    print(f"upload time: mean={statistics.mean(durations):.2f}s max={max(durations):.2f}s, "
+          f"aggregate throughput {args.uploads * args.size_mb / elapsed:.1f} MB/s")
+    print(summarize(f"{args.probe_path} idle", baseline))
+    print(summarize(f"{args.probe_path} under upload load", loaded))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--endpoint", default="/upload/")
+    parser.add_argument("--uploads", type=int, default=4, help="concurrent uploads")
+    parser.add_argument("--size-mb", type=int, default=256, help="size of each upload")
+    parser.add_argument("--model", default="tiny")
+    parser.add_argument("--probe-path", default="/ping")
+    parser.add_argument("--probe-interval", type=float, default=0.05)
+    parser.add_argument("--baseline-seconds", type=float, default=2.0)
+    parser.add_argument("--timeout", type=float, default=600.0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
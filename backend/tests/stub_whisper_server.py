@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Minimal stand-in for whisper.cpp's whisper-server, used as WHISPER_SERVER_PATH in tests
+
+Accepts the options WhisperServerPool passes (-m, --host, --port, -ng, -t),
+answers GET /health (503 while "loading" for STUB_STARTUP_SECONDS) and
+POST /inference with a verbose_json-shaped body. While the file named by
+STUB_HANG_FILE exists, /inference accepts the request and never answers,
+like a wedged server.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STARTED = time.time()
+
+
+class Handler(BaseHTTPRequestHandler):
+    model_path = ""
+    threads = 0
+
+    def _send_json(self, status: int, body: dict):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._send_json(404, {"error": "not found"})
+        elif time.time() - STARTED < float(os.environ.get("STUB_STARTUP_SECONDS", "0")):
+            self._send_json(503, {"status": "loading model"})
+        else:
+            self._send_json(200, {"status": "ok"})
+
+    def do_POST(self):
+        if self.path != "/inference":
+            self._send_json(404, {"error": "not found"})
+            return
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        hang_file = os.environ.get("STUB_HANG_FILE")
+        while hang_file and os.path.exists(hang_file):
+            time.sleep(0.1)
+        self._send_json(200, {
+            "text": " stub transcription",
+            "language": "en",
+            "segments": [{"id": 0, "start": 0.0, "end": 1.0, "text": " stub transcription"}],
+            "model": self.model_path,
+            "pid": os.getpid(),
+            "threads": self.threads,
+        })
+
+    def log_message(self, format, *args):
+        sys.stderr.write(f"stub whisper-server: {format % args}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-m", "--model", required=True)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("-ng", "--no-gpu", action="store_true")
+    parser.add_argument("-t", "--threads", type=int, default=0)
+    args = parser.parse_args()
+
+    Handler.model_path = args.model
+    Handler.threads = args.threads
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+app.downloader against a threaded http.server stub
+
+Covers resuming a partial download from the .part file and its sidecar,
+discarding a truncated .part, checksum mismatches, falling back from a
+mirror (or peer) to the upstream URL, and servers that ignore Range.
+"""
+import re
+import json
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.config import settings
+from app.downloader import DownloadError, download_file, download_model_file
+
+MB = 1024 * 1024
+PAYLOAD = bytes(range(256)) * (3 * MB // 256) + b"tail"  # 4 个 1 MB 分片
+PAYLOAD_SHA256 = hashlib.sha256(PAYLOAD).hexdigest()
+
+
+class StubFileServer:
+    """
+    Serves files from a dict on a background thread
+
+    Options per instance: ranges (advertise Accept-Ranges), honor_ranges
+    (answer Range with 206, otherwise 200 and the whole file), linked_sha256
+    (sent as X-Linked-Etag like Hugging Face), fail_offsets (range starts
+    answered with 500). Every GET is recorded in requests.
+    """
+
+    def __init__(self, files, ranges=True, honor_ranges=True, linked_sha256=None):
+        self.files = files
+        self.ranges = ranges
+        self.honor_ranges = honor_ranges
+        self.linked_sha256 = linked_sha256
+        self.fail_offsets = set()
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _headers(self, body: bytes):
+                self.send_header("Content-Length", str(len(body)))
+                if stub.ranges:
+                    self.send_header("Accept-Ranges", "bytes")
+                if stub.linked_sha256:
+                    self.send_header("X-Linked-Etag", f'"{stub.linked_sha256}"')
+                self.send_header("ETag", '"stub"')
+                self.end_headers()
+
+            def do_HEAD(self):
+                body = stub.files.get(self.path)
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self._headers(body)
+
+            def do_GET(self):
+                body = stub.files.get(self.path)
+                range_header = self.headers.get("Range")
+                stub.requests.append((self.path, range_header))
+                if body is None:
+                    self.send_error(404)
+                    return
+                match = re.match(r"bytes=(\d+)-(\d+)", range_header or "")
+                if match and int(match.group(1)) in stub.fail_offsets:
+                    self.send_error(500)
+                    return
+                if match and stub.honor_ranges:
+                    start, end = int(match.group(1)), int(match.group(2))
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{len(body)}")
+                    body = body[start:end + 1]
+                else:
+                    self.send_response(200)
+                self._headers(body)
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def ranges_fetched(self):
+        return sorted(int(re.match(r"bytes=(\d+)", r).group(1)) // MB for _, r in self.requests if r)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def download_settings(monkeypatch):
+    monkeypatch.setattr(settings, "MODEL_DOWNLOAD_RANGE_MB", 1)
+    monkeypatch.setattr(settings, "MODEL_DOWNLOAD_CONNECTIONS", 4)
+    monkeypatch.setattr(settings, "MODEL_DOWNLOAD_RETRIES", 0)
+    monkeypatch.setattr(settings, "MODEL_DOWNLOAD_TIMEOUT", 10)
+    monkeypatch.setattr(settings, "MODEL_MIRROR_URL", "")
+    monkeypatch.setattr(settings, "MODEL_MIRROR_ONLY", False)
+
+
+def test_parallel_ranges_verified_against_linked_etag(tmp_path):
+    with StubFileServer({"/model.bin": PAYLOAD}, linked_sha256=PAYLOAD_SHA256) as server:
+        dest = tmp_path / "model.bin"
+        assert download_file(f"{server.url}/model.bin", dest) == PAYLOAD_SHA256
+        assert dest.read_bytes() == PAYLOAD
+        assert server.ranges_fetched() == [0, 1, 2, 3]
+        assert sorted(p.name for p in tmp_path.iterdir()) == ["model.bin", "model.bin.lock"]
+
+
+def test_resumes_interrupted_download(tmp_path):
+    dest = tmp_path / "model.bin"
+    with StubFileServer({"/model.bin": PAYLOAD}) as server:
+        server.fail_offsets = {2 * MB}
+        with pytest.raises(Exception):
+            download_file(f"{server.url}/model.bin", dest, expected_sha256=PAYLOAD_SHA256)
+        assert not dest.exists()
+        assert json.loads((tmp_path / "model.bin.part.json").read_text())["done"] == [0, 1, 3]
+
+        # 续传只请求缺少的分片
+        server.fail_offsets = set()
+        server.requests.clear()
+        assert download_file(f"{server.url}/model.bin", dest, expected_sha256=PAYLOAD_SHA256) == PAYLOAD_SHA256
+        assert server.ranges_fetched() == [2]
+        assert dest.read_bytes() == PAYLOAD
+        assert not (tmp_path / "model.bin.part.json").exists()
+
+
+def test_truncated_part_file_restarts(tmp_path):
+    dest = tmp_path / "model.bin"
+    part_file = tmp_path / "model.bin.part"
+    # 记录显示全部完成，但 .part 文件被截断：断点信息不可信，从头下载
+    part_file.write_bytes(PAYLOAD[:MB])
+    (tmp_path / "model.bin.part.json").write_text(json.dumps({
+        "size": len(PAYLOAD), "etag": '"stub"', "range_size": MB, "done": [0, 1, 2, 3]}))
+
+    with StubFileServer({"/model.bin": PAYLOAD}) as server:
+        assert download_file(f"{server.url}/model.bin", dest, expected_sha256=PAYLOAD_SHA256) == PAYLOAD_SHA256
+        assert server.ranges_fetched() == [0, 1, 2, 3]
+    assert dest.read_bytes() == PAYLOAD
+
+
+def test_checksum_mismatch_is_rejected(tmp_path):
+    dest = tmp_path / "model.bin"
+    with StubFileServer({"/model.bin": PAYLOAD}) as server:
+        with pytest.raises(DownloadError, match="checksum mismatch"):
+            download_file(f"{server.url}/model.bin", dest, expected_sha256="0" * 64)
+    # 校验失败的数据不会留下来用于续传
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["model.bin.lock"]
+
+
+def test_falls_back_from_mirror_to_upstream(tmp_path, monkeypatch):
+    corrupted = PAYLOAD[:-4] + b"XXXX"
+    with StubFileServer({"/models/files/model.bin": corrupted}) as peer, \
+            StubFileServer({"/model.bin": PAYLOAD}, linked_sha256=PAYLOAD_SHA256) as upstream:
+        monkeypatch.setattr(settings, "MODEL_MIRROR_URL", f"{peer.url}/models/files/")
+        upstream_url = f"{upstream.url}/model.bin"
+
+        # 对等节点的文件损坏：校验失败后回退到上游
+        dest = tmp_path / "model.bin"
+        assert download_model_file("model.bin", upstream_url, dest, PAYLOAD_SHA256) == PAYLOAD_SHA256
+        assert dest.read_bytes() == PAYLOAD
+        assert peer.requests and upstream.requests
+
+        # 对等节点没有这个文件（404）
+        missing = tmp_path / "missing" / "model-small.bin"
+        upstream.files["/model-small.bin"] = PAYLOAD
+        assert download_model_file("model-small.bin", f"{upstream.url}/model-small.bin",
+                                   missing, PAYLOAD_SHA256) == PAYLOAD_SHA256
+
+        # 对等节点可用时不访问上游
+        upstream.requests.clear()
+        peer.files["/models/files/model.bin"] = PAYLOAD
+        dest.unlink()
+        assert download_model_file("model.bin", upstream_url, dest, PAYLOAD_SHA256) == PAYLOAD_SHA256
+        assert upstream.requests == []
+
+        # 只允许镜像时不回退
+        monkeypatch.setattr(settings, "MODEL_MIRROR_ONLY", True)
+        peer.files.clear()
+        dest.unlink()
+        with pytest.raises(DownloadError):
+            download_model_file("model.bin", upstream_url, dest, PAYLOAD_SHA256)
+        assert upstream.requests == []
+
+
+@pytest.mark.parametrize("advertise_ranges", [True, False])
+def test_server_ignoring_range_gets_single_connection(tmp_path, advertise_ranges):
+    dest = tmp_path / "model.bin"
+    with StubFileServer({"/model.bin": PAYLOAD}, ranges=advertise_ranges, honor_ranges=False) as server:
+        assert download_file(f"{server.url}/model.bin", dest, expected_sha256=PAYLOAD_SHA256) == PAYLOAD_SHA256
+        assert dest.read_bytes() == PAYLOAD
+        assert server.requests[-1] == ("/model.bin", None)
+    assert not (tmp_path / "model.bin.part.json").exists()
@@ -0,0 +1,70 @@
+"""
+Single-flight followers whose leader never resolves them (app/single_flight.py)
+
+A leader killed by the pool (WorkerLostError) or revoked never runs its
+finally block; /status must fail its followers and release the lease
+instead of reporting PENDING forever. Needs fakeredis.
+"""
+import pytest
+from celery.backends.cache import CacheBackend
+from fastapi.testclient import TestClient
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from app import main, single_flight
+from app.tasks import create_transcription_task
+from app.single_flight import INFLIGHT_PREFIX, join_flight
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    client = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(single_flight, "get_redis_client", lambda: client)
+    return client
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = CacheBackend(app=create_transcription_task.app, backend="memory")
+    backend.client.cache.clear()  # 内存缓存在进程内共享
+    monkeypatch.setattr(create_transcription_task, "backend", backend)
+    return backend
+
+
+def attach(key: str, task_id: str):
+    return join_flight(key, task_id, 600, {"task_id": task_id, "file_id": task_id,
+                                           "original_filename": "a.wav", "output_format": "srt"})
+
+
+def status(task_id: str) -> dict:
+    return TestClient(main.app).get(f"/status/{task_id}").json()
+
+
+@pytest.mark.parametrize("leader_state", ["FAILURE", "REVOKED"])
+def test_followers_fail_when_leader_dies(redis_client, backend, leader_state):
+    assert attach("k", "leader") is None
+    assert attach("k", "follower-1") == "leader"
+    assert attach("k", "follower-2") == "leader"
+    assert status("follower-1") == {"state": "PENDING", "status": "Pending...", "attached_to": "leader"}
+
+    # worker 子进程被杀（池记录 WorkerLostError）或任务被撤销：领头任务的 finally 没有执行
+    backend.store_result("leader", RuntimeError("Worker exited prematurely: signal 9 (SIGKILL)"), leader_state)
+
+    response = status("follower-1")
+    assert response["state"] == "FAILURE" and "leader" in response["status"]
+    assert create_transcription_task.AsyncResult("follower-2").state == "FAILURE"
+    assert not redis_client.exists(INFLIGHT_PREFIX + "k")
+
+    # 租约已释放，相同的新请求重新成为领头任务
+    assert attach("k", "retry") is None
+    assert status("follower-1")["state"] == "FAILURE"
+
+
+def test_followers_wait_while_leader_runs(redis_client, backend):
+    assert attach("k", "leader") is None
+    assert attach("k", "follower") == "leader"
+    backend.store_result("leader", {"status": "Transcribing", "progress": 40}, "PROGRESS")
+
+    assert status("follower") == {"state": "PROGRESS", "status": "Transcribing", "progress": 40,
+                                  "attached_to": "leader"}
+    assert redis_client.get(INFLIGHT_PREFIX + "k") == "leader"
@@ -0,0 +1,76 @@
+"""
+Streaming multipart uploads (app/uploads.py)
+
+Uploaded files are written into the upload directory while the body
+streams in and moved into place without a second copy; oversized files are
+rejected mid-stream, and nothing is left behind when a request fails.
+"""
+import hashlib
+
+import pytest
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi.testclient import TestClient
+
+from app import main
+from app.config import settings
+from app.uploads import ReceivedUpload, save_upload, streaming_upload_route
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def upload_dir(tmp_path):
+    return tmp_path / "uploads"
+
+
+@pytest.fixture
+def client(upload_dir):
+    upload_dir.mkdir()
+    app = FastAPI()
+    app.router.route_class = streaming_upload_route(upload_dir)
+
+    @app.post("/upload/")
+    async def upload(file: UploadFile = File(...), model: str = Form(...), count: int = Form(default=1)):
+        assert isinstance(file, ReceivedUpload)
+        content_hash = await save_upload(file, upload_dir / f"saved{file.filename}")
+        return {"sha256": content_hash, "size": file.size, "model": model, "count": count}
+
+    return TestClient(app)
+
+
+def test_streams_file_into_upload_dir(client, upload_dir):
+    body = bytes(range(256)) * (20 * MB // 256)  # 超过一个写入块
+    response = client.post("/upload/", files={"file": (".wav", body)}, data={"model": "base", "count": "3"})
+    assert response.status_code == 200
+    assert response.json() == {"sha256": hashlib.sha256(body).hexdigest(), "size": len(body),
+                                "model": "base", "count": 3}
+    assert [path.name for path in upload_dir.iterdir()] == ["saved.wav"]
+    assert (upload_dir / "saved.wav").read_bytes() == body
+
+
+def test_rejects_oversized_upload_while_streaming(client, upload_dir, monkeypatch):
+    monkeypatch.setattr(settings, "MAX_UPLOAD_MB", 1)
+    response = client.post("/upload/", files={"file": (".wav", bytes(2 * MB))}, data={"model": "base"})
+    assert response.status_code == 413
+    assert list(upload_dir.iterdir()) == []
+
+
+def test_removes_unsaved_files(client, upload_dir):
+    # 表单校验失败时端点不会运行，已接收的文件随请求删除
+    response = client.post("/upload/", files={"file": (".wav", b"RIFF")}, data={"model": "base", "count": "x"})
+    assert response.status_code == 422
+    assert list(upload_dir.iterdir()) == []
+
+
+def test_batch_failure_removes_saved_files(monkeypatch):
+    def plan_transcription_job(file_path, *args):
+        if file_path.read_bytes() == b"second":
+            raise HTTPException(status_code=413, detail="too long")
+        return {"media_info": {}, "time_limits": {}, "estimated_time": 1}
+
+    monkeypatch.setattr(main, "plan_transcription_job", plan_transcription_job)
+    before = set(main.UPLOAD_DIR.iterdir())
+    response = TestClient(main.app).post("/batch-upload/", files=[
+        ("files", ("a.wav", b"first")), ("files", ("b.wav", b"second")), ("files", ("c.wav", b"third"))])
+    assert response.status_code == 413
+    assert set(main.UPLOAD_DIR.iterdir()) == before
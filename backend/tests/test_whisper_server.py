@@ -0,0 +1,147 @@
+"""
+WhisperServerPool against a stub whisper-server (tests/stub_whisper_server.py)
+
+Covers the health check before the first request, restart after the
+server crashes, discarding a wedged server whose request times out, idle
+reaping, servers sized from the job's CPU plan, and registry entries whose
+pid now belongs to another process.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from app.config import settings
+from app.whisper_server import WhisperServerPool, WhisperServerError, _pid_alive
+
+STUB_SERVER = Path(__file__).parent / "stub_whisper_server.py"
+
+
+def wait_for_exit(pid: int, timeout: float = 5.0) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if not _pid_alive(pid):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def server_pids(pool: WhisperServerPool, model_name: str = "tiny"):
+    return [entry["pid"] for entry in pool.status().get(model_name, [])]
+
+
+@pytest.fixture
+def audio_file(tmp_path):
+    path = tmp_path / "audio.wav"
+    path.write_bytes(b"RIFF" + bytes(1024))
+    return path
+
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "WHISPER_SERVER_STATE_DIR", str(tmp_path / "state"))
+    monkeypatch.setattr(settings, "WHISPER_SERVER_STARTUP_TIMEOUT", 10)
+    monkeypatch.setattr(settings, "WHISPER_SERVER_IDLE_TIMEOUT", 600)
+    monkeypatch.setattr(settings, "WHISPER_SERVER_INSTANCES", 1)
+    monkeypatch.setenv("STUB_HANG_FILE", str(tmp_path / "hang"))
+    pool = WhisperServerPool(str(STUB_SERVER))
+    # 测试中手动调用 reap_idle，不启动后台回收线程
+    monkeypatch.setattr(pool, "_ensure_reaper", lambda: None)
+    yield pool
+    pids = [entry["pid"] for entries in pool.status().values() for entry in entries]
+    pool.shutdown()
+    for pid in pids:
+        wait_for_exit(pid)
+
+
+def transcribe(pool: WhisperServerPool, audio_file: Path, timeout: float = 10, **kwargs):
+    return pool.transcribe(str(audio_file), "tiny", "/models/ggml-tiny.bin", "en", "transcribe",
+                           timeout=timeout, **kwargs)
+
+
+def test_waits_for_health_check_then_transcribes(pool, audio_file, monkeypatch):
+    monkeypatch.setenv("STUB_STARTUP_SECONDS", "0.5")
+    result = transcribe(pool, audio_file)
+    assert result["text"].strip() == "stub transcription"
+    assert result["model"] == "/models/ggml-tiny.bin"
+
+    status = pool.status()["tiny"]
+    assert [entry["pid"] for entry in status] == [result["pid"]]
+    assert not status[0]["busy"]
+
+    # 第二个请求复用同一个常驻进程
+    assert transcribe(pool, audio_file)["pid"] == result["pid"]
+
+
+def test_restarts_after_crash(pool, audio_file):
+    first_pid = transcribe(pool, audio_file)["pid"]
+    os.kill(first_pid, signal.SIGKILL)
+    assert wait_for_exit(first_pid)
+
+    result = transcribe(pool, audio_file)
+    assert result["pid"] != first_pid
+    assert server_pids(pool) == [result["pid"]]
+
+
+def test_discards_wedged_server_on_timeout(pool, audio_file, tmp_path):
+    first_pid = transcribe(pool, audio_file)["pid"]
+    (tmp_path / "hang").touch()
+
+    with pytest.raises(WhisperServerError, match="did not respond"):
+        transcribe(pool, audio_file, timeout=1)
+    assert server_pids(pool) == []
+    assert wait_for_exit(first_pid)
+
+    (tmp_path / "hang").unlink()
+    assert transcribe(pool, audio_file)["pid"] != first_pid
+
+
+def test_reaps_idle_servers(pool, audio_file, monkeypatch):
+    pid = transcribe(pool, audio_file)["pid"]
+
+    pool.reap_idle()
+    assert server_pids(pool) == [pid]
+
+    monkeypatch.setattr(settings, "WHISPER_SERVER_IDLE_TIMEOUT", 0)
+    pool.reap_idle()
+    assert server_pids(pool) == []
+    assert wait_for_exit(pid)
+
+
+def test_sizes_servers_from_cpu_plan(pool, audio_file, monkeypatch):
+    monkeypatch.setattr(settings, "WHISPER_SERVER_INSTANCES", 2)
+    cpus = sorted(os.sched_getaffinity(0))[:1]
+    first = transcribe(pool, audio_file, threads=2, affinity=cpus)
+    assert first["threads"] == 2
+    assert os.sched_getaffinity(first["pid"]) == set(cpus)
+
+    # 线程数不同的任务启动第二个进程，相同的任务复用已有进程
+    second = transcribe(pool, audio_file, threads=4)
+    assert second["threads"] == 4 and second["pid"] != first["pid"]
+    assert transcribe(pool, audio_file, threads=2)["pid"] == first["pid"]
+
+    # 达到 WHISPER_SERVER_INSTANCES 后不再启动新进程
+    assert transcribe(pool, audio_file, threads=8)["pid"] in (first["pid"], second["pid"])
+    assert len(server_pids(pool)) == 2
+
+
+def test_ignores_reused_pids(pool):
+    # 与注册表中记录的 pid 相同、但启动时间不同的无关进程
+    unrelated = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"], start_new_session=True)
+    try:
+        entry = {"pid": unrelated.pid, "start_time": -1, "port": 1, "model_path": "/models/ggml-tiny.bin",
+                 "started_at": 0, "last_used": 0, "leases": []}
+        pool.state_file.write_text(json.dumps({"tiny": [entry]}))
+
+        assert server_pids(pool) == []
+        pool._terminate(entry)
+        pool.shutdown()
+        assert unrelated.poll() is None
+    finally:
+        unrelated.kill()
+        unrelated.wait()